@@ -0,0 +1,97 @@
+"""
+Import-time budget for the API module.
+
+Imports ``medical_api`` in fresh interpreters (``python -X importtime``) and
+fails (exit 1) when the median wall time exceeds the budget or when a
+dependency that should load lazily (graph, LLM SDK, MongoDB driver) is
+imported eagerly. Heavy work belongs in the startup warmup, not at import.
+
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --budget-ms 500 --repeat 9
+
+Like the replay benchmark, wall times are machine-specific; set the budget for
+the machine that runs the gate (``TRIAGE_IMPORT_BUDGET_MS``).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULT_BUDGET_MS = float(os.getenv("TRIAGE_IMPORT_BUDGET_MS", "750"))
+
+# Must not be imported by `import medical_api`; the warmup loads them
+LAZY_MODULES = ("langgraph", "langchain_core", "langchain_openai", "openai", "pymongo")
+
+_PROBE = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "import medical_api\n"
+    "elapsed = time.perf_counter() - start\n"
+    "print(json.dumps({'ms': elapsed * 1000, 'eager': [m for m in %r if m in sys.modules]}))\n"
+) % (LAZY_MODULES,)
+
+
+def probe() -> Tuple[float, List[str], str]:
+    """One fresh-interpreter import: (wall ms, eagerly imported lazy modules, -X importtime log)."""
+    env = dict(os.environ, TRIAGE_LOG_LEVEL="WARNING")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result["ms"], result["eager"], proc.stderr
+
+
+def slowest_imports(importtime_log: str, top: int) -> List[Tuple[str, float]]:
+    """Top-level imports of the probe by cumulative time (ms)."""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        # Direct imports of the probe/medical_api are indented by at most one level
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth <= 1 and cumulative.strip().isdigit():
+            rows.append((name.strip(), int(cumulative) / 1000))
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return rows[:top]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gate the import time of medical_api")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh imports; the median is gated")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list")
+    args = parser.parse_args(argv)
+
+    # The first import may also compile bytecode; keep it out of the measurement
+    probe()
+    timings, eager, log = [], [], ""
+    for _ in range(max(1, args.repeat)):
+        ms, eager, log = probe()
+        timings.append(ms)
+    median = statistics.median(timings)
+
+    print(f"import medical_api: median {median:.0f} ms over {len(timings)} runs (budget {args.budget_ms:.0f} ms)")
+    for name, ms in slowest_imports(log, args.top):
+        print(f"  {name:40s} {ms:8.1f} ms")
+
+    failed = False
+    if eager:
+        print(f"Imported eagerly (should load lazily): {', '.join(eager)}")
+        failed = True
+    if median > args.budget_ms:
+        print(f"Import time over budget by {median - args.budget_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,518 @@
+"""
+Recorded-session replay benchmark with regression gates.
+
+Replays interview fixtures (recorded with TRIAGE_RECORD_DIR, see
+session_recorder.py) against `build_app()`, serving every model response from
+the recording, and measures the graph's own cost with the LLM taken out:
+
+- per-node CPU time (``node_cpu_ms.<node>``)
+- per-node allocations: net and peak traced bytes (``node_alloc_kb.<node>``,
+  ``node_peak_kb.<node>``), measured in a separate tracemalloc pass
+- checkpoint bytes held per session (``checkpoint_bytes``) and the in-memory
+  size of the session's state once loaded (``state_kb``)
+- time spent serializing and deserializing checkpoints (``checkpoint_serde_ms``)
+- end-to-end graph overhead per session, excluding model time (``graph_overhead_ms``)
+
+All values are per-session means across fixtures; timing metrics take the
+median of ``--repeat`` runs after a warm-up pass. The run fails (exit 1) when a
+metric exceeds ``value * (1 + tolerance) + slack`` from the baseline, or when a
+replay diverges from the recorded results. Each fixture replays under the
+question_gain stopping threshold and the interview trees it was recorded with
+(neither, for fixtures older than them). Trees are loaded from
+TRIAGE_INTERVIEW_TREES or ``--trees``, and must be the recorded version.
+
+    python benchmarks/replay_bench.py
+    python benchmarks/replay_bench.py --update-baseline   # after an intended change
+    python benchmarks/replay_bench.py --stop-gain 0.12    # what would this threshold save?
+
+``--stop-gain`` replays every fixture under another threshold instead. Where
+the interview now ends sooner, the unused recorded questions and model calls
+are skipped. It reports questions, model calls and tokens per session,
+recorded against replayed, and gates nothing.
+
+CPU and timing baselines are machine-specific; refresh them on the machine
+that runs the gate.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+from langchain_core.language_models.chat_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import messages_from_dict  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+from langgraph.types import Command  # noqa: E402
+
+import duplicate_questions  # noqa: E402
+import interview_trees  # noqa: E402
+import langgraph_model_medical  # noqa: E402
+import question_gain  # noqa: E402
+from langgraph_model_medical import build_app, checkpoint_store_size  # noqa: E402
+from medical_api import _pending_question, _resume_update, serialize_result  # noqa: E402
+
+DEFAULT_FIXTURES = BENCH_DIR / "fixtures"
+DEFAULT_BASELINE = BENCH_DIR / "baseline.jsonl"
+# Interview trees available to fixtures recorded with them (set by main)
+LOADED_TREES: Optional["interview_trees.InterviewTrees"] = None
+NODES = ("agent", "urgency", "final_output")
+
+# Allowed increase over baseline before the gate fails: relative tolerance, plus an
+# absolute slack (in the metric's unit) so tiny values aren't gated on noise
+DEFAULT_TOLERANCE = {
+    "node_cpu_ms": (0.30, 1.0),
+    "graph_overhead_ms": (0.30, 2.0),
+    "node_alloc_kb": (0.15, 4.0),
+    "node_peak_kb": (0.15, 4.0),
+    "checkpoint_bytes": (0.05, 256),
+    "checkpoint_serde_ms": (0.30, 0.5),
+    "state_kb": (0.10, 2.0),
+}
+
+
+class ReplayDivergence(Exception):
+    pass
+
+
+class ReplayScript:
+    """Recorded model responses for one session, served strictly in call order.
+
+    A lenient script skips recorded calls the graph no longer makes (an
+    interview that ends sooner goes straight to the final diagnosis).
+    """
+
+    def __init__(self, responses: List[dict], lenient: bool = False):
+        self.responses = responses
+        self.lenient = lenient
+        self.position = 0
+        self.served: List[dict] = []
+        self.model_seconds = 0.0
+
+    def next_message(self, node: str):
+        while self.lenient and self.position < len(self.responses) and self.responses[self.position]["node"] != node:
+            self.position += 1
+        if self.position >= len(self.responses):
+            raise ReplayDivergence(f"graph made more model calls than recorded ({len(self.responses)})")
+        entry = self.responses[self.position]
+        if entry["node"] != node:
+            raise ReplayDivergence(f"model call {self.position}: expected {entry['node']}, graph called {node}")
+        self.position += 1
+        self.served.append(entry)
+        return messages_from_dict([entry["message"]])[0]
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model answering from a ReplayScript; the agent node is the one with tools bound."""
+
+    script: Any = None
+    model_name: str = "replay"
+    temperature: float = 0.0
+    streaming: bool = False
+    stream_usage: bool = True
+    reasoning: Optional[Dict[str, Any]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def bind_tools(self, tools, *, tool_choice: Optional[str] = None, **kwargs):
+        return self.bind(tools_bound=True, **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        start = time.perf_counter()
+        node = "agent" if kwargs.get("tools_bound") else "final_output"
+        message = self.script.next_message(node)
+        self.script.model_seconds += time.perf_counter() - start
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class TimedSerde:
+    """Wraps a checkpointer's serde and totals the time spent (de)serializing checkpoints."""
+
+    def __init__(self, serde):
+        self.serde = serde
+        self.seconds = 0.0
+
+    def dumps_typed(self, obj):
+        start = time.perf_counter()
+        try:
+            return self.serde.dumps_typed(obj)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def loads_typed(self, data):
+        start = time.perf_counter()
+        try:
+            return self.serde.loads_typed(data)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self.serde, name)
+
+
+def deep_size(obj, seen: Optional[set] = None) -> int:
+    """Approximate bytes held by ``obj`` and everything it references (shared objects once)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif not isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        if hasattr(obj, "__dict__"):
+            size += deep_size(vars(obj), seen)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+class NodeProfiler(BaseCallbackHandler):
+    """Per-node CPU time and (optionally) tracemalloc allocation deltas via chain callbacks."""
+
+    run_inline = True
+
+    def __init__(self, trace_allocations: bool = False):
+        self.trace_allocations = trace_allocations
+        self.cpu = defaultdict(float)
+        self.alloc = defaultdict(int)
+        self.peak = defaultdict(int)
+        self._open: Dict[Any, tuple] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        name = kwargs.get("name")
+        if name not in NODES or (kwargs.get("metadata") or {}).get("langgraph_node") != name:
+            return
+        base = 0
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        self._open[run_id] = (name, time.process_time(), base)
+
+    def _finish(self, run_id):
+        entry = self._open.pop(run_id, None)
+        if entry is None:
+            return
+        name, cpu_start, base = entry
+        self.cpu[name] += time.process_time() - cpu_start
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self.alloc[name] += max(0, current - base)
+            self.peak[name] = max(self.peak[name], peak - base)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # Interrupts surface as errors; the node's work still counts
+        self._finish(run_id)
+
+
+def load_fixture(path: Path) -> dict:
+    steps, responses, header = [], [], {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if event.get("event") == "model":
+                responses.append(event)
+            elif event.get("event") == "step":
+                steps.append(event)
+            elif event.get("event") == "session":
+                header = event
+    return {
+        "name": path.stem,
+        "steps": steps,
+        "responses": responses,
+        "stop_gain_threshold": header.get("stop_gain_threshold", 0.0),
+        "interview_trees": header.get("interview_trees"),
+        "duplicate_question_similarity": header.get("duplicate_question_similarity", 0.0),
+    }
+
+
+def _check(fixture: dict, index: int, expected: dict, actual: dict, lenient: bool = False):
+    if lenient and expected.get("type") == "question" and actual.get("type") in ("confirm", "diagnosis"):
+        return  # the interview ended sooner than recorded
+    keys = ("type", "query") if expected.get("type") == "question" else ("type",)
+    for key in keys:
+        if expected.get(key) != actual.get(key):
+            raise ReplayDivergence(
+                f"{fixture['name']} step {index} ({key}): recorded {expected.get(key)!r}, replayed {actual.get(key)!r}"
+            )
+
+
+def _drive(graph, step: dict, config: dict):
+    inputs = step.get("input") or {}
+    if step["step"] == "start":
+        return graph.invoke({
+            "symptoms": inputs.get("symptoms") or [],
+            "medical_records": inputs.get("medical_records") or "",
+        }, config=config)
+    if step["step"] == "resume":
+        # Mirrors medical_api._run_resume
+        pending = _pending_question(graph.get_state(config))
+        recorded, update = _resume_update(inputs.get("response"), inputs.get("question"), pending)
+        return graph.invoke(Command(resume=recorded, update=update), config=config)
+    return graph.invoke(Command(resume="yes" if inputs.get("confirm") else "no"), config=config)
+
+
+def replay_steps(graph, fixture: dict, script: "ReplayScript", config: dict) -> List[dict]:
+    """Drive ``graph`` through the fixture's recorded steps; returns the API payload of each."""
+    payloads = []
+    for index, step in enumerate(fixture["steps"]):
+        if step["step"] not in ("start", "resume", "confirm"):
+            continue
+        last = payloads[-1]["type"] if payloads else None
+        if script.lenient and (last == "diagnosis" or (last == "confirm" and step["step"] == "resume")):
+            continue  # the interview ended sooner than recorded; skip the remaining answers
+        payload = serialize_result(_drive(graph, step, config))
+        _check(fixture, index, step.get("result") or {}, payload, script.lenient)
+        payloads.append(payload)
+    if script.lenient and payloads and payloads[-1]["type"] == "confirm":
+        # The recording never reached a confirmation step
+        payloads.append(serialize_result(_drive(graph, {"step": "confirm", "input": {"confirm": True}}, config)))
+    if not script.lenient and script.position != len(script.responses):
+        raise ReplayDivergence(f"{fixture['name']}: {len(script.responses) - script.position} recorded model calls unused")
+    return payloads
+
+
+@contextmanager
+def replaying(fixture: dict, script: "ReplayScript", stop_gain: Optional[float] = None):
+    """Serve the model from ``script`` under the fixture's stopping threshold (or ``stop_gain``), trees and duplicate check."""
+    version = fixture["interview_trees"]
+    if version is not None and (LOADED_TREES is None or LOADED_TREES.version != version):
+        raise ReplayDivergence(f"{fixture['name']} was recorded with interview trees {version}; pass them with --trees")
+    langgraph_model_medical.CHAT_MODEL_FACTORY = lambda **kwargs: ReplayChatModel(script=script)
+    previous = question_gain.GAIN_THRESHOLD, interview_trees.TREES, duplicate_questions.SIMILARITY_THRESHOLD
+    question_gain.GAIN_THRESHOLD = fixture["stop_gain_threshold"] if stop_gain is None else stop_gain
+    interview_trees.TREES = LOADED_TREES if version is not None else None
+    duplicate_questions.SIMILARITY_THRESHOLD = fixture["duplicate_question_similarity"]
+    try:
+        yield
+    finally:
+        langgraph_model_medical.CHAT_MODEL_FACTORY = None
+        question_gain.GAIN_THRESHOLD, interview_trees.TREES, duplicate_questions.SIMILARITY_THRESHOLD = previous
+
+
+def _tokens(responses: List[dict]) -> int:
+    usage = [(r["message"].get("data") or {}).get("usage_metadata") or {} for r in responses]
+    return sum(u.get("total_tokens", 0) for u in usage)
+
+
+def replay_session(fixture: dict, trace_allocations: bool = False, stop_gain: Optional[float] = None) -> dict:
+    """Replay one fixture on a fresh graph and return its measurements.
+
+    ``stop_gain`` replays under that stopping threshold (leniently) instead of
+    the one the fixture was recorded with.
+    """
+    script = ReplayScript(fixture["responses"], lenient=stop_gain is not None)
+    with replaying(fixture, script, stop_gain):
+        graph = build_app()
+        serde = graph.checkpointer.serde = TimedSerde(graph.checkpointer.serde)
+        profiler = NodeProfiler(trace_allocations)
+        config = {"configurable": {"thread_id": f"replay-{fixture['name']}"}, "callbacks": [profiler]}
+
+        start = time.perf_counter()
+        payloads = replay_steps(graph, fixture, script, config)
+        wall = time.perf_counter() - start
+
+        return {
+            "cpu": dict(profiler.cpu),
+            "alloc": dict(profiler.alloc),
+            "peak": dict(profiler.peak),
+            "checkpoint_bytes": checkpoint_store_size(graph.checkpointer)[1],
+            "serde": serde.seconds,
+            "state_bytes": deep_size(graph.get_state(config).values),
+            "overhead": wall - script.model_seconds,
+            "questions": sum(1 for p in payloads if p["type"] == "question"),
+            "model_calls": len(script.served),
+            "tokens": _tokens(script.served),
+        }
+
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def run_benchmark(fixtures: List[dict], repeat: int) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+
+    # Warm-up: first calls pay for imports, caches and lazy compilation
+    for fixture in fixtures:
+        replay_session(fixture)
+
+    # Timing pass(es): no tracemalloc, median across repeats of the per-session mean
+    timing: Dict[str, List[float]] = defaultdict(list)
+    checkpoint_bytes: List[int] = []
+    for _ in range(repeat):
+        runs = [replay_session(fixture) for fixture in fixtures]
+        for node in NODES:
+            timing[f"node_cpu_ms.{node}"].append(_mean([r["cpu"].get(node, 0.0) * 1000 for r in runs]))
+        timing["graph_overhead_ms"].append(_mean([r["overhead"] * 1000 for r in runs]))
+        timing["checkpoint_serde_ms"].append(_mean([r["serde"] * 1000 for r in runs]))
+        checkpoint_bytes = [r["checkpoint_bytes"] for r in runs]
+        state_bytes = [r["state_bytes"] for r in runs]
+    for key, values in timing.items():
+        results[key] = round(statistics.median(values), 3)
+    results["checkpoint_bytes"] = round(_mean(checkpoint_bytes), 1)
+    results["state_kb"] = round(_mean(state_bytes) / 1024, 2)
+
+    # Allocation pass: deterministic enough to run once
+    tracemalloc.start()
+    try:
+        runs = [replay_session(fixture, trace_allocations=True) for fixture in fixtures]
+    finally:
+        tracemalloc.stop()
+    for node in NODES:
+        results[f"node_alloc_kb.{node}"] = round(_mean([r["alloc"].get(node, 0) / 1024 for r in runs]), 2)
+        results[f"node_peak_kb.{node}"] = round(_mean([r["peak"].get(node, 0) / 1024 for r in runs]), 2)
+    return results
+
+
+def load_baseline(path: Path) -> Dict[str, dict]:
+    if not path.exists():
+        return {}
+    baseline = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                baseline[entry["metric"]] = entry
+    return baseline
+
+
+def write_baseline(path: Path, results: Dict[str, float], previous: Dict[str, dict]):
+    with open(path, "w", encoding="utf-8") as f:
+        for metric in sorted(results):
+            default_tolerance, default_slack = DEFAULT_TOLERANCE[metric.split(".")[0]]
+            entry = {
+                "metric": metric,
+                "value": results[metric],
+                "tolerance": previous.get(metric, {}).get("tolerance", default_tolerance),
+                "slack": previous.get(metric, {}).get("slack", default_slack),
+            }
+            f.write(json.dumps(entry) + "\n")
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, dict]) -> List[str]:
+    regressions = []
+    for metric, value in sorted(results.items()):
+        entry = baseline.get(metric)
+        if entry is None:
+            continue
+        limit = entry["value"] * (1 + entry["tolerance"]) + entry.get("slack", 0)
+        if value > limit:
+            regressions.append(
+                f"{metric}: {value} > {entry['value']} (+{entry['tolerance']:.0%} +{entry.get('slack', 0)} allowed)"
+            )
+    return regressions
+
+
+def stopping_report(fixtures: List[dict], stop_gain: float) -> List[dict]:
+    """Per fixture: questions, model calls and tokens as recorded and as replayed under ``stop_gain``."""
+    rows = []
+    for fixture in fixtures:
+        run = replay_session(fixture, stop_gain=stop_gain)
+        rows.append({
+            "fixture": fixture["name"],
+            "questions": (sum(1 for s in fixture["steps"] if (s.get("result") or {}).get("type") == "question"), run["questions"]),
+            "model_calls": (len(fixture["responses"]), run["model_calls"]),
+            "tokens": (_tokens(fixture["responses"]), run["tokens"]),
+        })
+    return rows
+
+
+def print_stopping_report(rows: List[dict], stop_gain: float):
+    print(f"Replayed {len(rows)} sessions with TRIAGE_STOP_GAIN_THRESHOLD={stop_gain} (recorded -> replayed)")
+    print(f"  {'fixture':32s} {'questions':>12} {'model calls':>12} {'tokens':>14}")
+    for row in rows:
+        cells = [f"{a} -> {b}" for a, b in (row["questions"], row["model_calls"], row["tokens"])]
+        print(f"  {row['fixture']:32s} {cells[0]:>12} {cells[1]:>12} {cells[2]:>14}")
+    for key in ("questions", "model_calls", "tokens"):
+        before, after = _mean([r[key][0] for r in rows]), _mean([r[key][1] for r in rows])
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"  mean {key:27s} {before:>10.1f} -> {after:<10.1f} ({change:+.0f}%)")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded sessions and gate on graph overhead")
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURES, help="Directory of recorded .jsonl sessions")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--repeat", type=int, default=5, help="Timing runs; the median is reported")
+    parser.add_argument("--update-baseline", action="store_true", help="Write current results as the new baseline")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument(
+        "--stop-gain", type=float, default=None, metavar="THRESHOLD",
+        help="Replay under this question_gain threshold and report what it saves (no gating)",
+    )
+    parser.add_argument("--trees", type=Path, default=None, help="Interview tree artifact for fixtures recorded with one")
+    args = parser.parse_args(argv)
+
+    global LOADED_TREES
+    LOADED_TREES = interview_trees.InterviewTrees.load(args.trees) if args.trees else interview_trees.load_configured()
+
+    paths = sorted(args.fixtures.glob("*.jsonl"))
+    if not paths:
+        print(f"No fixtures found in {args.fixtures}")
+        return 1
+    fixtures = [load_fixture(p) for p in paths]
+
+    if args.stop_gain is not None:
+        try:
+            rows = stopping_report(fixtures, args.stop_gain)
+        except ReplayDivergence as e:
+            print(f"Replay diverged from recording: {e}")
+            return 1
+        if args.json:
+            print(json.dumps({"stop_gain_threshold": args.stop_gain, "sessions": rows}, indent=2))
+        else:
+            print_stopping_report(rows, args.stop_gain)
+        return 0
+
+    try:
+        results = run_benchmark(fixtures, max(1, args.repeat))
+    except ReplayDivergence as e:
+        print(f"Replay diverged from recording: {e}")
+        return 1
+
+    baseline = load_baseline(args.baseline)
+    if args.json:
+        print(json.dumps({"fixtures": len(fixtures), "results": results}, indent=2))
+    else:
+        print(f"Replayed {len(fixtures)} sessions")
+        for metric, value in sorted(results.items()):
+            base = baseline.get(metric, {}).get("value")
+            print(f"  {metric:32s} {value:>12}" + (f"   (baseline {base})" if base is not None else ""))
+
+    if args.update_baseline:
+        write_baseline(args.baseline, results, baseline)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline)
+    if regressions:
+        print("Regressions over baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
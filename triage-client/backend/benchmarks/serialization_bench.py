@@ -0,0 +1,138 @@
+"""
+Micro-benchmark for serialization.py against the library defaults.
+
+Replays the recorded fixtures (see replay_bench.py) to collect realistic data,
+then times each serialization path per session:
+
+- ``response``: every API payload of the session, FastAPI's default
+  (``jsonable_encoder`` + ``JSONResponse``) vs `serialization.JSONResponseClass`
+- ``mongo``: BSON encoding of the finished session's patient document
+  (built by ``medical_api._patient_document``; needs pymongo)
+
+Both response paths must produce the same JSON; the run fails (exit 1)
+otherwise. Numbers are microseconds per session, best
+of ``--repeat`` runs.
+
+    python benchmarks/serialization_bench.py
+    python benchmarks/serialization_bench.py --json
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import serialization  # noqa: E402
+from langgraph_model_medical import build_app  # noqa: E402
+from medical_api import _patient_document  # noqa: E402
+from replay_bench import (  # noqa: E402
+    DEFAULT_FIXTURES, ReplayDivergence, ReplayScript, load_fixture, replay_steps, replaying,
+)
+
+try:
+    import bson
+except ImportError:
+    bson = None
+
+
+def collect(fixture: dict) -> dict:
+    """Replay one fixture and return its API payloads and patient document."""
+    script = ReplayScript(fixture["responses"])
+    with replaying(fixture, script):
+        graph = build_app()
+        config = {"configurable": {"thread_id": f"serde-{fixture['name']}"}}
+        payloads = replay_steps(graph, fixture, script, config)
+        values = graph.get_state(config).values
+    document = None
+    if values.get("diagnosis"):
+        document = _patient_document(config["configurable"]["thread_id"], values, values["diagnosis"], "Bench Patient")
+    return {"payloads": payloads, "document": document}
+
+
+def _best_us(fn: Callable[[], object], repeat: int) -> float:
+    number = 20
+    return round(min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6, 1)
+
+
+def _default_response(payloads: List[dict]) -> List[bytes]:
+    return [JSONResponse(jsonable_encoder(p)).body for p in payloads]
+
+
+def _fast_response(payloads: List[dict]) -> List[bytes]:
+    return [serialization.JSONResponseClass(p).body for p in payloads]
+
+
+def _mean(values: List[float]) -> float:
+    return round(sum(values) / len(values), 1) if values else 0.0
+
+
+def run(sessions: List[dict], repeat: int) -> Dict[str, Dict[str, Optional[float]]]:
+    rows: Dict[str, Dict[str, list]] = {
+        "response": {"default": [], "serialization": []},
+        "mongo": {"default": [], "serialization": []},
+    }
+    for session in sessions:
+        payloads, document = session["payloads"], session["document"]
+
+        if [json.loads(b) for b in _default_response(payloads)] != [json.loads(b) for b in _fast_response(payloads)]:
+            raise ReplayDivergence("JSONResponseClass output differs from FastAPI's default encoding")
+        rows["response"]["default"].append(_best_us(lambda: _default_response(payloads), repeat))
+        rows["response"]["serialization"].append(_best_us(lambda: _fast_response(payloads), repeat))
+
+        if bson is not None and document is not None:
+            rows["mongo"]["serialization"].append(_best_us(lambda: bson.encode(document), repeat))
+
+    results = {}
+    for name, sides in rows.items():
+        default, fast = _mean(sides["default"]) or None, _mean(sides["serialization"]) or None
+        results[name] = {
+            "default_us": default,
+            "serialization_us": fast,
+            "speedup": round(default / fast, 2) if default and fast else None,
+        }
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare serialization.py with the library default paths")
+    parser.add_argument("--fixtures", type=Path, default=DEFAULT_FIXTURES, help="Directory of recorded .jsonl sessions")
+    parser.add_argument("--repeat", type=int, default=7, help="Timing runs; the best is reported")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args(argv)
+
+    paths = sorted(args.fixtures.glob("*.jsonl"))
+    if not paths:
+        print(f"No fixtures found in {args.fixtures}")
+        return 1
+    try:
+        sessions = [collect(load_fixture(p)) for p in paths]
+        results = run(sessions, max(1, args.repeat))
+    except ReplayDivergence as e:
+        print(f"Serialization check failed: {e}")
+        return 1
+
+    if args.json:
+        print(json.dumps({"fixtures": len(paths), "results": results}, indent=2))
+        return 0
+    print(f"Serialized {len(paths)} sessions (us per session, best of {args.repeat})")
+    print(f"  {'path':<12}{'default':>12}{'serialization':>16}{'speedup':>10}")
+    for name, row in results.items():
+        default = "-" if row["default_us"] is None else row["default_us"]
+        fast = "-" if row["serialization_us"] is None else row["serialization_us"]
+        speedup = "-" if row["speedup"] is None else f"{row['speedup']}x"
+        print(f"  {name:<12}{default:>12}{fast:>16}{speedup:>10}")
+    if serialization.orjson is None:
+        print("  (orjson is not installed; responses fall back to the stdlib encoder)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
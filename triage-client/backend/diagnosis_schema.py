@@ -0,0 +1,121 @@
+"""
+Typed final diagnosis.
+
+`final_output_node` requests the diagnosis with a strict JSON-schema response
+format built from `Diagnosis` (``RESPONSE_FORMAT``), so the provider constrains
+the shape and the reply is validated exactly once, by `parse`. The result goes
+into ``State["diagnosis"]`` as a plain dict, which the checkpoint serde packs
+natively; the API returns it as is and the Mongo writer copies fields from it.
+
+``urgency_level_text`` is derived from ``urgency_level`` rather than generated,
+so the two can never disagree. The three ``*_impact``/``*_insights`` fields and
+the per-differential history fields default to empty for recordings made
+before the schema existed; the provider is still required to fill them.
+
+A refusal, truncated or off-schema reply raises `pydantic.ValidationError`
+from `parse`. `final_output_node` asks once more, and if that reply fails too
+it stores `unvalidated` instead: an empty differential at the session's
+provisional urgency, marked ``"validated": false`` and keeping the raw reply,
+so the patient still reaches the queue for staff to review.
+"""
+
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, computed_field, model_validator
+
+URGENCY_TEXT = {1: "Emergency", 2: "High", 3: "Moderate", 4: "Low", 5: "Routine"}
+
+
+class DifferentialItem(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    rank: int = Field(ge=1)
+    diagnosis: str = Field(description="Condition name")
+    probability_percent: int = Field(ge=0, le=100)
+    reasoning: str = Field(description="Start with medical history analysis, then clinical reasoning")
+    key_features: List[str] = Field(description="Symptoms, history connections and findings supporting it")
+    next_steps: List[str] = Field(description="History-guided tests and targeted interventions")
+    medical_history_relevance: str = Field(
+        "", description="How the patient's documented history supports this diagnosis"
+    )
+    history_confidence_score: int = Field(0, ge=0, le=100)
+
+
+class Diagnosis(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    differential_diagnosis: List[DifferentialItem] = Field(description="Top 5 conditions, most likely first")
+    clinical_summary: str = Field(description="Assessment integrating current symptoms with medical history")
+    urgency_level: Literal[1, 2, 3, 4, 5] = Field(description="1 Emergency, 2 High, 3 Moderate, 4 Low, 5 Routine")
+    symptom_analysis_impact: str = Field("", description="How current symptoms drive the assessment")
+    medical_history_impact: str = Field("", description="How documented history informs the assessment")
+    balanced_insights: str = Field("", description="Insights from integrating symptoms with medical background")
+    age: Optional[int] = Field(None, ge=0, le=130, description="Patient age in years if the history states it, else null")
+    disclaimer: str
+
+    @computed_field
+    @property
+    def urgency_level_text(self) -> str:
+        return URGENCY_TEXT[self.urgency_level]
+
+    @model_validator(mode="after")
+    def _rank_order(self):
+        self.differential_diagnosis.sort(key=lambda item: item.rank)
+        return self
+
+
+def _strict(node):
+    """OpenAI strict mode: every property required, no extra keys, no defaults."""
+    if isinstance(node, dict):
+        node.pop("default", None)
+        properties = node.get("properties")
+        if properties is not None:
+            node["required"] = list(properties)
+            node["additionalProperties"] = False
+            _strict(list(properties.values()))
+        _strict(list((node.get("$defs") or {}).values()))
+        _strict(node.get("items"))
+        _strict(node.get("anyOf"))
+    elif isinstance(node, list):
+        for child in node:
+            _strict(child)
+    return node
+
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "triage_diagnosis",
+        "strict": True,
+        "schema": _strict(Diagnosis.model_json_schema()),
+    },
+}
+
+
+def parse(text: str) -> dict:
+    """Validate the model's reply; raises `pydantic.ValidationError` if it does not match."""
+    return Diagnosis.model_validate_json(text).model_dump()
+
+
+UNVALIDATED_SUMMARY = "The model's diagnosis could not be validated; review this patient manually."
+UNVALIDATED_DISCLAIMER = (
+    "This AI output is for informational purposes only and is not a substitute for professional medical advice."
+)
+
+
+def unvalidated(text: str, urgency_level: Optional[int] = None) -> dict:
+    """Minimal diagnosis for a reply that never validated; ``urgency_level`` defaults to Moderate."""
+    level = urgency_level if urgency_level in URGENCY_TEXT else 3
+    return {
+        "differential_diagnosis": [],
+        "clinical_summary": UNVALIDATED_SUMMARY,
+        "urgency_level": level,
+        "urgency_level_text": URGENCY_TEXT[level],
+        "symptom_analysis_impact": "",
+        "medical_history_impact": "",
+        "balanced_insights": "",
+        "age": None,
+        "disclaimer": UNVALIDATED_DISCLAIMER,
+        "validated": False,
+        "raw_text": text,
+    }
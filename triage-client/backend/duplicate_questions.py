@@ -0,0 +1,98 @@
+"""
+Near-duplicate interview questions.
+
+The model sometimes asks again, in other words, what the patient has already
+answered ("When did it start?" and later "How long have you had this?").
+Before the agent asks a question the model proposed, `find_duplicate` compares
+it with the questions answered so far:
+
+- **Normalizing.** Text is lower-cased, and common paraphrases become one
+  token (`PARAPHRASES`: "how long", "when did", "since when" all become
+  ``onset``). Stop words are dropped, and the remaining words are sorted.
+- **Similarity.** The Jaccard similarity of the character trigrams of two
+  normalized questions. Trigrams absorb plurals, tenses and small wording
+  changes.
+- **Threshold.** Similarity of at least ``TRIAGE_DUPLICATE_QUESTION_SIMILARITY``
+  (default 0.6) is a duplicate. Setting 0 turns the check off.
+
+On a duplicate, agent_node gives the model the earlier question and its
+answer, and asks for a different question once. If the second proposal
+repeats too, agent_node does not take that as the model wanting to finish:
+it asks about the next open area itself (question_gain's essential areas
+first), unless the question limit is reached. The check is local and needs
+no model call. A session asks only a handful of
+questions, so trigram sets are compared directly, with no MinHash signatures.
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import FrozenSet, Iterable, NamedTuple, Optional
+
+SIMILARITY_THRESHOLD = float(os.getenv("TRIAGE_DUPLICATE_QUESTION_SIMILARITY", "0.6"))
+
+# Phrasings of the same triage question, mapped to one token (longest phrases match first)
+PARAPHRASES = {
+    "onset": ("how long have you had", "how long has", "how long", "when did", "when was", "since when",
+              "what time", "started", "starting", "start", "began", "begin", "onset", "duration"),
+    "severity": ("how severe", "how bad", "how much does it hurt", "pain scale", "scale of", "rate",
+                 "severe", "severity", "intensity"),
+    "trend": ("getting worse", "getting better", "worsening", "improving", "changed", "changing"),
+    "triggers": ("makes it better or worse", "make it better or worse", "better or worse", "worse or better",
+                 "makes it worse", "make it worse", "makes it better", "make it better",
+                 "triggers", "trigger", "aggravates", "relieves"),
+    "associated": ("other symptoms", "any other", "anything else", "along with", "associated"),
+    "medication": ("medications", "medication", "medicines", "medicine", "pills", "prescribed"),
+    "character": ("feel like", "describe", "describe the feeling", "what kind", "what type", "character"),
+}
+# Filler, and the words that name the complaint itself ("the pain", "this symptom")
+STOP_WORDS = frozenset((
+    "a", "about", "all", "an", "and", "any", "anything", "are", "at", "be", "been", "can", "could",
+    "currently", "do", "does", "did", "exact", "exactly", "for", "had", "has", "have", "how", "i",
+    "in", "is", "it", "its", "just", "me", "of", "on", "or", "please", "really", "right", "now",
+    "so", "that", "the", "there", "this", "to", "was", "what", "when", "where", "which", "with",
+    "would", "you", "your", "pain", "symptom", "symptoms", "feeling", "problem",
+))
+
+_PHRASES = sorted(((phrase, token) for token, phrases in PARAPHRASES.items() for phrase in phrases), key=lambda p: -len(p[0]))
+_PARAPHRASE = re.compile(r"\b(" + "|".join(re.escape(phrase) for phrase, _ in _PHRASES) + r")\b")
+_TOKEN_OF = dict(_PHRASES)
+_WORD = re.compile(r"[a-z]+")
+
+
+class Duplicate(NamedTuple):
+    index: int  # position in the questions it was compared with
+    question: str
+    similarity: float
+
+
+def normalize(question: str) -> str:
+    text = _PARAPHRASE.sub(lambda m: f" {_TOKEN_OF[m.group(1)]} ", (question or "").lower())
+    return " ".join(sorted({word for word in _WORD.findall(text) if word not in STOP_WORDS}))
+
+
+@lru_cache(maxsize=1024)
+def shingles(question: str) -> FrozenSet[str]:
+    """Character trigrams of the normalized question, with word boundaries marked."""
+    text = f" {normalize(question)} "
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2)) if text.strip() else frozenset()
+
+
+def similarity(a: str, b: str) -> float:
+    sa, sb = shingles(a), shingles(b)
+    if not sa or not sb:
+        return 0.0
+    return len(sa & sb) / len(sa | sb)
+
+
+def find_duplicate(candidate: str, asked: Iterable[str], threshold: Optional[float] = None) -> Optional[Duplicate]:
+    """The asked question most similar to ``candidate`` if it reaches the threshold, else None."""
+    threshold = SIMILARITY_THRESHOLD if threshold is None else threshold
+    if threshold <= 0 or not candidate:
+        return None
+    best = None
+    for index, question in enumerate(asked):
+        score = similarity(candidate, question)
+        if score >= threshold and (best is None or score > best.similarity):
+            best = Duplicate(index, question, round(score, 3))
+    return best
@@ -0,0 +1,270 @@
+"""
+Deterministic offline stand-in for the hosted chat model.
+
+Select it with ``TRIAGE_LLM_PROVIDER=fake``. Every graph node then talks to
+`FakeTriageChatModel`, which emits realistic ``ask_user_for_input`` /
+``signal_diagnosis_complete`` tool calls and diagnosis JSON from seeded
+templates (or a scripted file), with configurable latency and streaming speed.
+Runs are reproducible: the same seed and the same conversation always produce
+the same questions, diagnosis and delays.
+
+Environment:
+- ``FAKE_LLM_SEED``: base seed (default ``0``)
+- ``FAKE_LLM_QUESTIONS``: questions to ask before signalling completion (default ``4``)
+- ``FAKE_LLM_SCRIPT``: optional JSON file ``{"questions": [...], "diagnosis": {...}}``
+  replacing the built-in templates; questions use the ``ask_user_for_input`` args
+- ``FAKE_LLM_LATENCY_MS``: mean time to first token (default ``0``)
+- ``FAKE_LLM_LATENCY_DIST``: ``constant`` (default), ``uniform``, ``exponential`` or ``lognormal``
+- ``FAKE_LLM_LATENCY_SIGMA``: spread for ``uniform`` (fraction of mean) and ``lognormal`` (default ``0.5``)
+- ``FAKE_LLM_TOKENS_PER_SEC``: streaming speed for generated text; ``0`` streams instantly (default)
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+QUESTION_TEMPLATES = [
+    {"query": "When did this start?", "options": {"Within the last hour": "", "A few hours ago": "", "Earlier today": "", "Yesterday": "", "Several days ago": ""}, "question_type": "multiple_choice"},
+    {"query": "How severe is it right now?", "options": {"Mild": "", "Moderate": "", "Severe": "", "Worst ever": ""}, "question_type": "multiple_choice"},
+    {"query": "Is it getting worse?", "options": {"Getting worse": "", "About the same": "", "Getting better": ""}, "question_type": "multiple_choice"},
+    {"query": "Any other symptoms along with this?", "options": {"Fever": "", "Nausea or vomiting": "", "Shortness of breath": "", "Dizziness": "", "None of these": ""}, "question_type": "select_multiple"},
+    {"query": "What makes it better or worse?", "options": None, "question_type": "open_ended"},
+    {"query": "Does this relate to a known condition?", "options": {"Yes": "", "No": "", "Not sure": ""}, "question_type": "multiple_choice"},
+    {"query": "Are you taking any medications for this?", "options": {"Yes, prescribed": "", "Over-the-counter only": "", "No": ""}, "question_type": "multiple_choice"},
+    {"query": "How would you describe the feeling?", "options": {"Sharp": "", "Dull or aching": "", "Throbbing": "", "Burning": "", "Pressure": ""}, "question_type": "multiple_choice"},
+]
+
+CONDITION_BANK = {
+    "chest": ["Acute coronary syndrome", "Stable angina", "Gastroesophageal reflux disease", "Costochondritis", "Pulmonary embolism"],
+    "breath": ["Asthma exacerbation", "Pneumonia", "COPD exacerbation", "Pulmonary embolism", "Anxiety-related hyperventilation"],
+    "head": ["Migraine", "Tension-type headache", "Meningitis", "Subarachnoid hemorrhage", "Sinusitis"],
+    "abdom": ["Appendicitis", "Gastroenteritis", "Cholecystitis", "Kidney stone", "Peptic ulcer disease"],
+    "fever": ["Viral syndrome", "Urinary tract infection", "Influenza", "Pneumonia", "Sepsis"],
+}
+GENERIC_CONDITIONS = ["Viral syndrome", "Dehydration", "Musculoskeletal strain", "Anxiety", "Medication side effect"]
+
+_AGE = re.compile(r"\b(\d{1,3})-year-old\b")
+
+
+def _seed_for(*parts: str) -> int:
+    digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, default=str)
+
+
+class FakeTriageChatModel(BaseChatModel):
+    """Offline chat model speaking the triage graph's tool protocol."""
+
+    model_name: str = Field(default="fake-triage", alias="model")
+    temperature: float = 0.0
+    streaming: bool = False
+    stream_usage: bool = True
+    reasoning: Optional[Dict[str, Any]] = None
+
+    seed: int = Field(default_factory=lambda: int(os.getenv("FAKE_LLM_SEED", "0")))
+    questions_before_diagnosis: int = Field(default_factory=lambda: int(os.getenv("FAKE_LLM_QUESTIONS", "4")))
+    script_path: Optional[str] = Field(default_factory=lambda: os.getenv("FAKE_LLM_SCRIPT") or None)
+    latency_ms: float = Field(default_factory=lambda: float(os.getenv("FAKE_LLM_LATENCY_MS", "0")))
+    latency_dist: str = Field(default_factory=lambda: os.getenv("FAKE_LLM_LATENCY_DIST", "constant").lower())
+    latency_sigma: float = Field(default_factory=lambda: float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5")))
+    tokens_per_sec: float = Field(default_factory=lambda: float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "0")))
+
+    model_config = {"populate_by_name": True}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-triage"
+
+    def bind_tools(self, tools, *, tool_choice: Optional[str] = None, **kwargs):
+        names = [getattr(t, "name", None) or getattr(t, "__name__", str(t)) for t in tools]
+        return self.bind(tool_names=names, tool_choice=tool_choice, **kwargs)
+
+    # --- response construction ---
+
+    def _script(self) -> Optional[dict]:
+        if not self.script_path:
+            return None
+        with open(self.script_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _session_key(self, messages: List[BaseMessage]) -> str:
+        """Stable per-patient key: the presenting complaint line the nodes always send."""
+        for message in messages:
+            text = _text(message)
+            if message.type == "human" and ("Patient presents with:" in text or "PATIENT PRESENTATION:" in text):
+                return text.split("CLINICAL INTERVIEW:")[0].strip()
+        return _text(messages[0]) if messages else ""
+
+    def _questions_asked(self, messages: List[BaseMessage]) -> int:
+        """Answered question round-trips in the transcript.
+
+        When a node resumes from an interrupt LangGraph replays it, and the
+        replayed call must make the same tool call as the original. The resume
+        has already stored the answer by then; agent_node leaves that row out of
+        the replayed call's messages (see its ``resuming`` check), so the count
+        matches the original call.
+        """
+        return sum(1 for m in messages if m.type == "ai" and _text(m).startswith(("I need to clarify", "Can you help me understand")))
+
+    def _agent_message(self, messages: List[BaseMessage], tool_names: List[str]) -> AIMessage:
+        asked = self._questions_asked(messages)
+        script = self._script()
+        questions = (script or {}).get("questions") or QUESTION_TEMPLATES
+        limit = len(questions) if script else self.questions_before_diagnosis
+
+        if asked >= limit and "signal_diagnosis_complete" in tool_names:
+            name, args = "signal_diagnosis_complete", {}
+        else:
+            if script:
+                args = dict(questions[min(asked, len(questions) - 1)])
+            else:
+                rng = random.Random(self.seed ^ _seed_for(self._session_key(messages)))
+                order = list(range(len(QUESTION_TEMPLATES)))
+                rng.shuffle(order)
+                args = dict(QUESTION_TEMPLATES[order[asked % len(order)]])
+            if args.get("options") is None:
+                args.pop("options", None)
+            name = "ask_user_for_input"
+        call_id = "call_" + hashlib.sha1(f"{self._session_key(messages)}:{asked}:{name}".encode()).hexdigest()[:16]
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": call_id, "type": "tool_call"}])
+
+    def _diagnosis_text(self, messages: List[BaseMessage]) -> str:
+        script = self._script()
+        if script and script.get("diagnosis") is not None:
+            return json.dumps(script["diagnosis"])
+
+        key = self._session_key(messages)
+        rng = random.Random(self.seed ^ _seed_for(key, "diagnosis"))
+        lower = key.lower()
+        pool: List[str] = []
+        for keyword, conditions in CONDITION_BANK.items():
+            if keyword in lower:
+                pool.extend(c for c in conditions if c not in pool)
+        pool.extend(c for c in GENERIC_CONDITIONS if c not in pool)
+        picks = rng.sample(pool[:8], 5) if len(pool) >= 5 else pool
+
+        weights = sorted((rng.randint(5, 40) for _ in picks), reverse=True)
+        total = sum(weights)
+        urgency = rng.choice([1, 2, 2, 3, 3, 3, 4, 5])
+        age = _AGE.search(key)
+        payload = {
+            "differential_diagnosis": [
+                {
+                    "rank": rank,
+                    "diagnosis": condition,
+                    "probability_percent": round(weight * 100 / total),
+                    "reasoning": f"Presentation is consistent with {condition.lower()}.",
+                    "key_features": ["presenting symptoms", "interview answers"],
+                    "next_steps": ["Vital signs", "Clinical examination"],
+                    "medical_history_relevance": "Reviewed against documented history.",
+                    "history_confidence_score": rng.randint(40, 90),
+                }
+                for rank, (condition, weight) in enumerate(zip(picks, weights), start=1)
+            ],
+            "clinical_summary": f"Offline assessment; leading consideration is {picks[0].lower()}.",
+            "urgency_level": urgency,
+            "symptom_analysis_impact": "Interview answers narrow the presentation.",
+            "medical_history_impact": "Documented history was taken into account.",
+            "balanced_insights": "Symptoms and history point the same way.",
+            "age": int(age.group(1)) if age else None,
+            "disclaimer": "Generated by the offline fake model for testing; not medical advice.",
+        }
+        return json.dumps(payload)
+
+    def _respond(self, messages: List[BaseMessage], tool_names: Optional[List[str]]) -> AIMessage:
+        if tool_names:
+            message = self._agent_message(messages, tool_names)
+            completion_text = json.dumps(message.tool_calls[0]["args"])
+        else:
+            message = AIMessage(content=self._diagnosis_text(messages))
+            completion_text = message.content
+        prompt_tokens = sum(len(_text(m)) for m in messages) // 4
+        completion_tokens = max(1, len(completion_text) // 4)
+        message.usage_metadata = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        message.response_metadata = {"model_name": self.model_name}
+        return message
+
+    # --- latency model ---
+
+    def _first_token_delay(self, messages: List[BaseMessage]) -> float:
+        mean = self.latency_ms / 1000.0
+        if mean <= 0:
+            return 0.0
+        rng = random.Random(self.seed ^ _seed_for(*(_text(m) for m in messages), "latency"))
+        dist = self.latency_dist
+        if dist == "uniform":
+            spread = mean * self.latency_sigma
+            return max(0.0, rng.uniform(mean - spread, mean + spread))
+        if dist == "exponential":
+            return rng.expovariate(1.0 / mean)
+        if dist == "lognormal":
+            sigma = self.latency_sigma
+            # Parameterized so the distribution's mean equals FAKE_LLM_LATENCY_MS
+            return rng.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+        return mean
+
+    # --- BaseChatModel interface ---
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        delay = self._first_token_delay(messages)
+        message = self._respond(messages, kwargs.get("tool_names"))
+        text = message.content if isinstance(message.content, str) else ""
+        if self.tokens_per_sec > 0 and text:
+            delay += (len(text) / 4) / self.tokens_per_sec
+        if delay:
+            time.sleep(delay)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        delay = self._first_token_delay(messages)
+        if delay:
+            time.sleep(delay)
+        message = self._respond(messages, kwargs.get("tool_names"))
+
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}],
+            ))
+            if run_manager:
+                run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+        else:
+            text = message.content
+            per_token = 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+            for start in range(0, len(text), 4):
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=text[start:start + 4]))
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+                if per_token:
+                    time.sleep(per_token)
+
+        final = ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            usage_metadata=message.usage_metadata,
+            response_metadata=message.response_metadata,
+        ))
+        yield final
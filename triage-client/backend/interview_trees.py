@@ -0,0 +1,256 @@
+"""
+Compiled interview decision trees for common presentations.
+
+For a frequent presentation the agent model tends to ask the same questions
+in the same order. This module replays that order without calling the
+model:
+
+- **Mining (offline).** ``python interview_trees.py --recordings DIR`` reads
+  recorded sessions (session_recorder.py fixtures). For each complaint (the
+  normalized set of presenting symptoms, plus whether there is a medical
+  history) it builds a tree: question, then one branch per answer, then the
+  next question, or ``complete`` where the interview ended.
+- **Pruning.** A node is kept only when at least ``--min-support`` sessions
+  reached it and at least ``--min-agreement`` of them did the same next.
+- **Artifact.** The trees are written as one JSON file. Its ``version`` is a
+  hash of the trees, so sessions and logs can name the exact trees they ran
+  with.
+- **Serving.** Set ``TRIAGE_INTERVIEW_TREES`` to the file. `build_app` loads
+  it, and agent_node asks the tree's question, with no model call, while a
+  patient's answers stay on the tree. At a ``complete`` leaf it goes to
+  confirmation. The first answer without a branch hands the interview back
+  to the model for good. A declined confirmation does the same.
+
+An interview that stays on its tree needs only the final diagnosis call.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import question_gain
+import serialization
+import transcript
+from triage_logging import get_logger
+
+logger = get_logger("interview_trees")
+
+ARTIFACT_FORMAT = 1
+TREES_PATH = os.getenv("TRIAGE_INTERVIEW_TREES") or None
+DEFAULT_MIN_SUPPORT = 5
+DEFAULT_MIN_AGREEMENT = 0.8
+
+COMPLETE = "complete"
+
+
+def complaint_key(symptoms: Optional[Iterable[str]], medical_records: Optional[str] = None) -> str:
+    key = "|".join(sorted({s.strip().lower() for s in symptoms or () if isinstance(s, str) and s.strip()}))
+    return key + (" +history" if question_gain.has_history(medical_records) else "")
+
+
+def _answer_key(answer) -> str:
+    return " ".join(str(answer or "").lower().split())
+
+
+class InterviewTrees:
+    """A loaded artifact: per complaint, nested nodes ``{"support", "question" | "complete", "answers"}``."""
+
+    def __init__(self, artifact: dict):
+        if artifact.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported interview tree format: {artifact.get('format')!r}")
+        self.version: str = artifact["version"]
+        self.trees: Dict[str, dict] = artifact["trees"]
+
+    @classmethod
+    def load(cls, path) -> "InterviewTrees":
+        with open(path, "rb") as f:
+            return cls(serialization.loads(f.read()))
+
+    def _walk(self, state: dict, turns: List["transcript.Turn"]) -> Optional[dict]:
+        """The node reached by ``turns`` from the complaint's root; None once off the tree."""
+        node = self.trees.get(complaint_key(state.get("symptoms"), state.get("medical_records")))
+        for turn in turns:
+            if node is None or not turn.is_question or "question" not in node or node["question"]["query"] != turn.question:
+                return None
+            node = node.get("answers", {}).get(_answer_key(turn.answer))
+        return node
+
+    def next_question(self, state: dict, resuming: bool = False) -> Optional[dict]:
+        """``ask_user_for_input`` arguments for the next question, or None when the model decides.
+
+        ``resuming`` is the replay of an interrupted ask: the answer is already
+        in the transcript, and the tree re-asks the question it came from so the
+        node takes the same path as before.
+        """
+        turns = transcript.turns(state)
+        if resuming:
+            node = self._walk(state, turns[:-1])
+            if node is None or "question" not in node or node["question"]["query"] != turns[-1].question:
+                return None
+        else:
+            node = self._walk(state, turns)
+        if node is None or "question" not in node:
+            return None
+        return dict(node["question"])
+
+    def completes(self, state: dict) -> bool:
+        """True when the answers so far reach a ``complete`` leaf."""
+        node = self._walk(state, transcript.turns(state))
+        return node is not None and node.get(COMPLETE, False)
+
+
+TREES: Optional[InterviewTrees] = None
+_configured = False
+
+
+def load_configured() -> Optional[InterviewTrees]:
+    """Load ``TRIAGE_INTERVIEW_TREES`` once (called by build_app); None when unset or unreadable."""
+    global TREES, _configured
+    if not _configured and TREES_PATH:
+        _configured = True
+        try:
+            TREES = InterviewTrees.load(TREES_PATH)
+            logger.info("Interview trees loaded", extra={"path": TREES_PATH, "version": TREES.version, "complaints": len(TREES.trees)})
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Interview trees not loaded; the model asks every question", extra={"path": TREES_PATH, "error": str(e)})
+    return TREES
+
+
+# --- mining ---
+
+def recorded_interviews(path: Path) -> Tuple[str, List[Tuple[dict, str]], bool]:
+    """(complaint, [(question payload, answer)], completed) from one recorded session."""
+    key, turns, completed, pending = "", [], False, None
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = serialization.loads(line)
+            if event.get("event") != "step":
+                continue
+            inputs, result = event.get("input") or {}, event.get("result") or {}
+            if event["step"] == "start":
+                key = complaint_key(inputs.get("symptoms"), inputs.get("medical_records"))
+            elif event["step"] == "resume" and pending is not None:
+                # The transcript row the live session stored for this answer
+                question, answer = transcript.answer_row(inputs.get("response"), inputs.get("question"), pending)[:2]
+                turns.append(({**pending, "query": question}, answer))
+            pending = None
+            if result.get("type") == "question":
+                pending = {k: result.get(k) for k in ("query", "options", "question_type")}
+            elif result.get("type") in ("confirm", "diagnosis"):
+                completed = True
+                break
+    return key, turns, completed
+
+
+def _action(turns: List[Tuple[dict, str]], index: int, completed: bool):
+    if index < len(turns):
+        return ("question", serialization.dumps(turns[index][0]))
+    return (COMPLETE,) if completed else None
+
+
+def mine(sessions: Iterable[Tuple[str, List[Tuple[dict, str]], bool]], min_support: int, min_agreement: float) -> Dict[str, dict]:
+    """Build the pruned trees from (complaint, turns, completed) sessions."""
+    # What sessions did next at each path: (complaint, ((query, answer), ...)) -> Counter of actions
+    counts: Dict[tuple, Counter] = defaultdict(Counter)
+    branches: Dict[tuple, set] = defaultdict(set)
+    for key, turns, completed in sessions:
+        path = ()
+        for index in range(len(turns) + 1):
+            action = _action(turns, index, completed)
+            if action is None:
+                break
+            counts[(key, path)][action] += 1
+            if index < len(turns):
+                step = (turns[index][0]["query"], _answer_key(turns[index][1]))
+                branches[(key, path)].add(step)
+                path += (step,)
+
+    def compile_node(key: str, path: tuple) -> Optional[dict]:
+        seen = counts.get((key, path))
+        if not seen:
+            return None
+        support = sum(seen.values())
+        action, agreeing = seen.most_common(1)[0]
+        if support < min_support or agreeing / support < min_agreement:
+            return None
+        if action[0] == COMPLETE:
+            return {"support": support, COMPLETE: True}
+        question = serialization.loads(action[1])
+        answers = {}
+        for query, answer in sorted(branches[(key, path)]):
+            child = compile_node(key, path + ((query, answer),)) if query == question["query"] else None
+            if child is not None:
+                answers[answer] = child
+        return {"support": support, "question": question, "answers": answers}
+
+    trees = {}
+    for key in sorted({key for key, path in counts if not path}):
+        root = compile_node(key, ())
+        if root is not None:
+            trees[key] = root
+    return trees
+
+
+def build_artifact(trees: Dict[str, dict], sessions: int, min_support: int, min_agreement: float) -> dict:
+    return {
+        "format": ARTIFACT_FORMAT,
+        "version": hashlib.sha256(json.dumps(trees, sort_keys=True).encode("utf-8")).hexdigest()[:12],
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sessions": sessions,
+        "min_support": min_support,
+        "min_agreement": min_agreement,
+        "trees": trees,
+    }
+
+
+def _count_nodes(node: dict) -> int:
+    return 1 + sum(_count_nodes(child) for child in node.get("answers", {}).values())
+
+
+def served_steps(trees: Dict[str, dict], key: str, turns: List[Tuple[dict, str]], completed: bool) -> int:
+    """How many of a session's agent steps (its questions, then completing) the trees would take."""
+    node, served = trees.get(key), 0
+    for question, answer in turns:
+        if node is None or node.get("question", {}).get("query") != question["query"]:
+            return served
+        served += 1
+        node = node["answers"].get(_answer_key(answer))
+    return served + int(completed and node is not None and node.get(COMPLETE, False))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mine interview decision trees from recorded sessions")
+    parser.add_argument("--recordings", type=Path, required=True, help="Directory of recorded .jsonl sessions (TRIAGE_RECORD_DIR)")
+    parser.add_argument("--out", type=Path, default=Path("interview_trees.json"))
+    parser.add_argument("--min-support", type=int, default=DEFAULT_MIN_SUPPORT, help="Sessions that must reach a node to keep it")
+    parser.add_argument("--min-agreement", type=float, default=DEFAULT_MIN_AGREEMENT, help="Share of them that must agree on the next step")
+    args = parser.parse_args(argv)
+
+    paths = sorted(args.recordings.glob("*.jsonl"))
+    if not paths:
+        print(f"No recordings found in {args.recordings}")
+        return 1
+    sessions = [recorded_interviews(p) for p in paths]
+    trees = mine(sessions, args.min_support, args.min_agreement)
+    artifact = build_artifact(trees, len(sessions), args.min_support, args.min_agreement)
+    args.out.write_bytes(serialization.dumps(artifact))
+
+    print(f"Mined {len(sessions)} sessions into {len(trees)} trees, version {artifact['version']} -> {args.out}")
+    for key, root in trees.items():
+        print(f"  {key:60s} {root['support']:>5} sessions {_count_nodes(root):>4} nodes")
+    steps = sum(len(turns) + int(completed) for _, turns, completed in sessions)
+    served = sum(served_steps(trees, *session) for session in sessions)
+    print(f"Agent steps the trees would take in these sessions: {served} of {steps} ({served / max(steps, 1):.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
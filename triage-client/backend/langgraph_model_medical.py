@@ -1,19 +1,37 @@
+import dataclasses
+import logging
+import operator
 import os
-from typing import Optional, TypedDict, Annotated
+import time
+from typing import List, Optional, TypedDict, Annotated
 
 import dotenv
-from langgraph.graph import StateGraph, END, add_messages
+from pydantic import ValidationError
+from langgraph.config import get_config
+from langgraph.graph import StateGraph, START, END
 from langgraph.types import interrupt, Command
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 from langchain_core.tools import tool
-from langchain_core.messages import BaseMessage, AIMessage, HumanMessage, SystemMessage, ToolMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from llm_callbacks import LLMMetricsCallback, RecordingCallback
+from metrics import NODE_LATENCY
+from profiling import span
+from session_hibernation import HIBERNATE_AFTER_SECONDS, HibernatingSaver
+from token_usage import drain_pending, timed_invoke
+import diagnosis_schema
+import duplicate_questions
+import interview_trees
+import question_gain
+import transcript
+import urgency_score
+from triage_logging import configure_logging, get_logger
 
 # tool imports are consolidated below
 
 # For debugging and visualization
 import json
-from datetime import datetime
 
 dotenv.load_dotenv()
 
@@ -21,49 +39,210 @@ dotenv.load_dotenv()
 class State(TypedDict, total=False):
     symptoms: list[str]
     medical_records: Optional[str]
-    questions_asked: list[str]
-    responses: list[str]
-    diagnosis: Optional[str]
-    messages: Annotated[list[BaseMessage], add_messages]
+    # One row per answered question or confirmation; questions, answers and the
+    # model's chat history are derived from it (see transcript.py)
+    transcript: Annotated[list[list], operator.add]
+    # Validated diagnosis_schema.Diagnosis as a plain dict (or diagnosis_schema.unvalidated)
+    diagnosis: Optional[dict]
+    # Level from urgency_score while the interview runs (see urgency_node)
+    provisional_urgency: Optional[int]
+    # Transcript lengths when the last answer was taken, and when the questioning
+    # was settled (question_gain or an interview tree); see _ask
+    answered_at: Optional[int]
+    settled_at: Optional[int]
+    # One entry per model call (see token_usage.py)
+    usage: Annotated[list[dict], operator.add]
+
+
+logger = get_logger("graph")
 
 
 def log_step(step_name: str, state: State, extra_info: str = ""):
     """Helper function to log what's happening at each step."""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"\n [{timestamp}] {step_name}")
-    print(f"   Symptoms: {state.get('symptoms', [])}")
-    print(f"   Medical Records: {'Yes' if state.get('medical_records') else 'No'}")
-    print(f"   Questions Asked: {len(state.get('questions_asked', []))}")
-    print(f"   Has Diagnosis: {'Yes' if state.get('diagnosis') else 'No'}")
-    
-    if extra_info:
-        print(f"   Info: {extra_info}")
-    print("-" * 60)
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug(
+        extra_info or step_name,
+        extra={
+            "step": step_name,
+            "symptoms": state.get('symptoms', []),
+            "has_medical_records": bool(state.get('medical_records')),
+            "questions_asked": transcript.question_count(state),
+            "has_diagnosis": bool(state.get('diagnosis')),
+        },
+    )
+
+
+def transcript_messages(state: State) -> list:
+    """The interview as chat messages for the model, built from the transcript rows."""
+    messages = []
+    for turn in transcript.turns(state):
+        if turn.kind == transcript.CONFIRM:
+            messages.append(AIMessage(content=(
+                "Thanks. Generating your differential diagnosis now." if turn.confirmed
+                else "Okay. I’ll ask a few more clarifying questions."
+            )))
+            continue
+        if turn.question:
+            if turn.kind == transcript.OPEN_ENDED:
+                content = f"Can you help me understand: {turn.question}"
+            else:
+                content = f"I need to clarify something: {turn.question}"
+                if turn.options:
+                    prefix = "You may choose one or more of" if turn.kind == "select_multiple" else "Please choose from"
+                    content += f" {prefix}: {', '.join(turn.options)}"
+            messages.append(AIMessage(content=content))
+        messages.append(HumanMessage(content=turn.answer))
+    return messages
+
+
+# Optional override used by the replay benchmark to serve recorded model responses
+CHAT_MODEL_FACTORY = None
+
+# Extra final_output calls after a diagnosis reply that does not validate
+DIAGNOSIS_RETRIES = 1
+
+# Called as sink(thread_id, estimate, previous_level, state) when the provisional
+# urgency changes; medical_api hands it to a background writer, so it must not block
+PROVISIONAL_URGENCY_SINK = None
+
+
+def chat_model(**kwargs):
+    """Chat model for the graph nodes; TRIAGE_LLM_PROVIDER=fake swaps in the offline stand-in."""
+    if CHAT_MODEL_FACTORY is not None:
+        return CHAT_MODEL_FACTORY(**kwargs)
+    if os.getenv("TRIAGE_LLM_PROVIDER", "openai").strip().lower() == "fake":
+        from fake_llm import FakeTriageChatModel
+        kwargs.pop("model", None)
+        return FakeTriageChatModel(**kwargs)
+    # Imported here: langchain_openai pulls in the whole openai SDK (~0.7s)
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(**kwargs)
+
+
+_llm_callbacks: dict = {}
+
+
+def llm_callbacks(node: str, model_name: str) -> list:
+    """Shared callbacks (metrics, session recording) for a node/model pair, created once."""
+    key = (node, model_name)
+    callbacks = _llm_callbacks.get(key)
+    if callbacks is None:
+        callbacks = _llm_callbacks.setdefault(key, [LLMMetricsCallback(node, model_name), RecordingCallback(node)])
+    return callbacks
+
+
+def timed_node(name: str, fn):
+    """Wrap a graph node so its wall time (including interrupts) lands in NODE_LATENCY
+    and, for profiled requests, in a ``node:<name>`` span."""
+    histogram = NODE_LATENCY.labels(name)
+    span_name = f"node:{name}"
+
+    def node(state: State):
+        start = time.perf_counter()
+        try:
+            with span(span_name):
+                return fn(state)
+        finally:
+            elapsed = time.perf_counter() - start
+            histogram.observe(elapsed)
+            logger.debug("node finished", extra={"node": name, "duration_ms": round(elapsed * 1000, 2)})
+
+    node.__name__ = getattr(fn, "__name__", name)
+    node.__doc__ = fn.__doc__
+    return node
+
+
+def _graph_thread_id() -> Optional[str]:
+    try:
+        return get_config().get("configurable", {}).get("thread_id")
+    except RuntimeError:
+        return None
+
+
+def _with_usage_update(result, entries: list):
+    if not entries:
+        return result
+    if isinstance(result, Command) and (result.update is None or isinstance(result.update, dict)):
+        return dataclasses.replace(result, update={**(result.update or {}), "usage": entries})
+    if isinstance(result, dict):
+        return {**result, "usage": entries}
+    return result
+
+
+def usage_node(fn):
+    """Wrap a graph node so usage from its model calls is appended to ``State["usage"]``.
+
+    A node interrupted after its model call returns nothing, so its entries stay
+    parked until the replayed node returns and both calls are written together.
+    """
+
+    def node(state: State):
+        result = fn(state)
+        return _with_usage_update(result, drain_pending(_graph_thread_id()))
+
+    node.__name__ = getattr(fn, "__name__", "node")
+    node.__doc__ = fn.__doc__
+    return node
 
 
 # Register available tools for medical diagnosis
 from tools import ask_user_for_input, signal_diagnosis_complete
 tools = [ask_user_for_input, signal_diagnosis_complete]
+
+# agent_node's own question for an area no question has covered yet
+AREA_QUESTIONS = {
+    "severity": "How severe is this symptom right now?",
+    "quality": "Describe the exact character of this symptom?",
+    "triggers": "What makes it better or worse?",
+    "associated_symptoms": "Any other concerning symptoms?",
+    "context": "What were you doing when this started?",
+    "timing": "When exactly did this start?",
+    "basic_history": "Any relevant medical conditions or medications?",
+    "history_correlation": "Does this relate to any of your known conditions?",
+}
 # Note: We handle tool execution manually below to support interrupt-based flows.
 
 
 def agent_node(state: State):
     """Medical diagnostic agent that analyzes symptoms and asks clarifying questions."""
     log_step("AGENT_NODE", state, "Analyzing symptoms and generating diagnostic questions")
+
+    # The last answer settled the interview: confirm without another model call.
+    # A declined confirmation adds a row, so the model takes over again.
+    rows = state.get("transcript") or ()
+    if state.get("settled_at") == len(rows):
+        return signal_diagnosis_complete.invoke({})
+
+    # An answer that no node has taken yet means this is the replay of an
+    # interrupted ask: whichever question is asked now receives that answer.
+    resuming = bool(rows) and rows[-1][2] != transcript.CONFIRM and state.get("answered_at") != len(rows)
+
+    # On a compiled interview tree the tree asks the next question.
+    trees = interview_trees.TREES
+    if trees is not None:
+        params = trees.next_question(state, resuming)
+        if params is not None:
+            return _ask(state, params)
     
-    # Get existing conversation messages (includes user interactions)
-    existing_messages = state.get('messages', [])
+    # A replayed call sees the interview as the original call did, without the
+    # answer it is about to consume, so it takes the same path and tool call.
+    interview = {**state, "transcript": rows[:-1]} if resuming else state
+
     symptoms = state.get('symptoms', [])
     medical_records = state.get('medical_records', '')
-    questions_asked = state.get('questions_asked', [])
-    responses = state.get('responses', [])
+    questions_asked = transcript.questions_asked(interview)
     
-    # Initialize ChatOpenAI with tools bound
-    model = ChatOpenAI(
+    # Initialize ChatOpenAI with tools bound (streamed so time-to-first-token is measurable)
+    base_model = chat_model(
         model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
         temperature=0,
         reasoning={"effort": "low"},
-    ).bind_tools(tools, tool_choice="required")
+        streaming=True,
+        stream_usage=True,
+    )
+    model_name = base_model.model_name
+    model = base_model.bind_tools(tools, tool_choice="required")
     
     # Build the diagnostic context
     symptoms_str = ", ".join(symptoms) if symptoms else "No symptoms provided"
@@ -71,7 +250,7 @@ def agent_node(state: State):
     questions_context = f"Previous Questions Asked: {len(questions_asked)}"
     
     # Analyze existing medical records for targeted questioning
-    has_substantial_history = medical_records and medical_records.lower() not in ["no medical history provided", "no significant medical history", ""]
+    has_substantial_history = question_gain.has_history(medical_records)
     
     # Extract key elements from medical history if available
     history_indicators = {
@@ -88,31 +267,7 @@ def agent_node(state: State):
             medical_context_flags[category] = any(keyword in history_lower for keyword in keywords)
     
     # Analyze what areas have been covered based on previous questions
-    covered_areas = []
-    timing_questions = ["when", "started", "how long", "duration", "time"]
-    severity_questions = ["severe", "pain scale", "rate", "intensity", "bad"]
-    quality_questions = ["feel like", "describe", "type of", "kind of", "sensation"]
-    trigger_questions = ["better", "worse", "trigger", "cause", "aggravate", "relieve"]
-    associated_questions = ["other symptoms", "anything else", "along with", "together"]
-    context_questions = ["doing when", "started when", "recent", "changes", "circumstances"]
-    history_correlation_questions = ["relate", "connection", "similar", "medication", "condition", "before"]
-    
-    all_questions_text = " ".join(questions_asked).lower()
-    
-    if any(word in all_questions_text for word in timing_questions):
-        covered_areas.append("timing")
-    if any(word in all_questions_text for word in severity_questions):
-        covered_areas.append("severity") 
-    if any(word in all_questions_text for word in quality_questions):
-        covered_areas.append("quality")
-    if any(word in all_questions_text for word in trigger_questions):
-        covered_areas.append("triggers")
-    if any(word in all_questions_text for word in associated_questions):
-        covered_areas.append("associated_symptoms")
-    if any(word in all_questions_text for word in context_questions):
-        covered_areas.append("context")
-    if any(word in all_questions_text for word in history_correlation_questions):
-        covered_areas.append("history_correlation")
+    covered_areas = question_gain.covered_areas(questions_asked)
     
     # Balanced priority areas focusing equally on symptoms and medical history
     if has_substantial_history:
@@ -195,27 +350,50 @@ def agent_node(state: State):
     ]
     
     # Add previous Q&A pairs to context
-    if questions_asked and responses:
-        qa_context = "\n".join([f"Q: {q}\nA: {a}" for q, a in zip(questions_asked, responses)])
+    qa_pairs = transcript.qa_pairs(interview)
+    if qa_pairs:
+        qa_context = "\n".join([f"Q: {q}\nA: {a}" for q, a in qa_pairs])
         messages.append(HumanMessage(content=f"Previous conversation:\n{qa_context}"))
     
-    # Add any other conversation messages
-    messages.extend(existing_messages)
+    # Add the conversation itself
+    messages.extend(transcript_messages(interview))
 
     # Call the model
-    response = model.invoke(messages)
-    
+    response = timed_invoke(
+        model, messages, "agent", model_name, _graph_thread_id(),
+        config={"callbacks": llm_callbacks("agent", model_name)},
+    )
+
+    # A question the patient already answered in other words is not asked
+    # again: the model gets the earlier answer and one more try.
+    repeated = None if resuming else _repeated_question(response, questions_asked)
+    if repeated is not None:
+        logger.info("Model repeated a question", extra={
+            "thread_id": _graph_thread_id(),
+            "question": repeated.question,
+            "similarity": repeated.similarity,
+        })
+        answer = transcript.qa_pairs(interview)[repeated.index][1]
+        messages.append(HumanMessage(content=(
+            f'You already asked "{repeated.question}" and the patient answered: {answer}\n'
+            "Do not ask that again in other words. Ask about something not covered yet, "
+            "or use signal_diagnosis_complete if you have enough information."
+        )))
+        response = timed_invoke(
+            model, messages, "agent", model_name, _graph_thread_id(),
+            config={"callbacks": llm_callbacks("agent", model_name)},
+        )
+        repeated = _repeated_question(response, questions_asked)
+
     # Check if model chose to use tools
     if response.tool_calls:
         for tool_call in response.tool_calls:
             tool_name = tool_call["name"]
             tool_args = tool_call.get("args", {}) or {}
 
-            if tool_name == "ask_user_for_input" and should_continue_questioning:
-                # Store the question being asked
+            if tool_name == "ask_user_for_input" and should_continue_questioning and repeated is None:
                 question = tool_args.get("query", "Please provide more information")
-                updated_questions = questions_asked + [question]
-                
+
                 # Use the interrupt-capable tool to gather user input
                 params = {
                     "query": question,
@@ -224,9 +402,14 @@ def agent_node(state: State):
                 }
                 
                 # Update state and return the interrupt
-                return ask_user_for_input.invoke(params)
+                return _ask(state, params)
             
-            elif tool_name == "signal_diagnosis_complete":
+            elif tool_name == "signal_diagnosis_complete" or repeated is not None:
+                if repeated is not None and should_continue_questioning:
+                    # Repeating itself twice is not the model wanting to finish:
+                    # ask the next open area itself (the tree, if any, had no question)
+                    return _ask(state, _open_area_question(interview, missing_areas, questions_asked))
+
                 # Enhanced completion logic considering balanced coverage
                 has_enough_for_diagnosis = (
                     not should_continue_questioning or 
@@ -285,19 +468,10 @@ def agent_node(state: State):
                     elif missing_areas:
                         # Standard questions when no substantial history
                         area = missing_areas[0]
-                        standard_prompts = {
-                            "severity": "How severe is this symptom right now?",
-                            "quality": "Describe the exact character of this symptom?",
-                            "triggers": "What makes it better or worse?",
-                            "associated_symptoms": "Any other concerning symptoms?",
-                            "context": "What were you doing when this started?",
-                            "timing": "When exactly did this start?",
-                            "basic_history": "Any relevant medical conditions or medications?"
-                        }
-                        follow_up = standard_prompts.get(area, follow_up)
+                        follow_up = AREA_QUESTIONS.get(area, follow_up)
                 except Exception:
                     pass
-                return ask_user_for_input.invoke({
+                return _ask(state, {
                     "query": follow_up,
                     "question_type": "open_ended",
                 })
@@ -324,40 +498,107 @@ def agent_node(state: State):
     else:
         fallback_question = "Any other important symptoms or details?"
         
-    return ask_user_for_input.invoke({
+    return _ask(state, {
         "query": fallback_question,
         "question_type": "open_ended"
     })
 
 
+def _open_area_question(state: State, missing_areas: List[str], questions_asked: List[str]) -> dict:
+    """``ask_user_for_input`` arguments for the first open area whose question was not answered already.
+
+    question_gain's essential areas come first, then agent_node's own priority list.
+    """
+    areas = question_gain.expected_gain(state).open_areas + missing_areas
+    for area in dict.fromkeys(areas):
+        query = AREA_QUESTIONS.get(area)
+        if query and duplicate_questions.find_duplicate(query, questions_asked) is None:
+            return {"query": query, "question_type": "open_ended"}
+    return {"query": "Any other important details for triage?", "question_type": "open_ended"}
+
+
+def _repeated_question(response, questions_asked: List[str]) -> Optional["duplicate_questions.Duplicate"]:
+    """The answered question that the response's ``ask_user_for_input`` call repeats, if any."""
+    for tool_call in response.tool_calls or ():
+        if tool_call["name"] == "ask_user_for_input":
+            return duplicate_questions.find_duplicate((tool_call.get("args") or {}).get("query"), questions_asked)
+    return None
+
+
+def _ask(state: State, params: dict):
+    """Ask the patient a question, then let question_gain decide whether to ask another.
+
+    Code after the interrupt runs only when the node replays with the answer,
+    which the resume has already added to the transcript.
+    """
+    command = ask_user_for_input.invoke(params)
+    answered = len(state.get("transcript") or ())
+    update = {"answered_at": answered}
+    trees = interview_trees.TREES
+    if trees is not None and trees.completes(state):
+        reason = {"interview_trees": trees.version}
+    else:
+        gain = question_gain.settled(state)
+        if gain is None:
+            return Command(goto=command.goto, update=update)
+        reason = {"expected_gain": gain.value, "open_areas": gain.open_areas}
+    logger.info("Interview settled", extra={
+        "thread_id": _graph_thread_id(),
+        "questions": transcript.question_count(state),
+        **reason,
+    })
+    update["settled_at"] = answered
+    return Command(goto=command.goto, update=update)
+
+
+def urgency_node(state: State):
+    """Re-estimate urgency from the symptoms and answers so far; runs next to the agent."""
+    estimate = urgency_score.estimate(state.get("symptoms"), transcript.turns(state), state.get("medical_records"))
+    previous = state.get("provisional_urgency")
+    if estimate.level == previous:
+        return {}
+    thread_id = _graph_thread_id()
+    if PROVISIONAL_URGENCY_SINK is not None and thread_id:
+        try:
+            PROVISIONAL_URGENCY_SINK(thread_id, estimate, previous, state)
+        except Exception:
+            logger.exception("Provisional urgency sink failed", extra={"thread_id": thread_id})
+    return {"provisional_urgency": estimate.level}
+
+
+def _message_text(message) -> str:
+    """Text of a model reply; the Responses API returns a list of content blocks."""
+    content = message.content
+    if isinstance(content, list):
+        return "".join(block["text"] for block in content if isinstance(block, dict) and block.get("type") == "text")
+    return content
+
+
 def final_output_node(state: State):
     """Generate final medical diagnosis with top 5 possible causes."""
     log_step("FINAL_OUTPUT_NODE", state, "Generating differential diagnosis")
     
     # Initialize ChatOpenAI
-    model = ChatOpenAI(
+    base_model = chat_model(
         model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
         temperature=float(os.getenv("OPENAI_TEMPERATURE", "0.3")),  # Lower temp for medical accuracy
         reasoning={"effort": "medium"},
+        streaming=True,
+        stream_usage=True,
     )
+    model_name = base_model.model_name
+    model = base_model.bind(response_format=diagnosis_schema.RESPONSE_FORMAT)
     
     # Extract medical context from state
     symptoms = state.get('symptoms', [])
     medical_records = state.get('medical_records', '')
-    questions_asked = state.get('questions_asked', [])
-    responses = state.get('responses', [])
     
     # Build comprehensive medical context
     symptoms_str = ", ".join(symptoms) if symptoms else "No symptoms provided"
     medical_context = medical_records or "No medical history provided"
     
     # Create Q&A summary
-    qa_summary = ""
-    if questions_asked and responses:
-        qa_pairs = []
-        for q, a in zip(questions_asked, responses):
-            qa_pairs.append(f"Q: {q}\nA: {a}")
-        qa_summary = "\n\n".join(qa_pairs)
+    qa_summary = "\n\n".join(f"Q: {q}\nA: {a}" for q, a in transcript.qa_pairs(state))
     
     # Analyze medical history comprehensiveness
     has_comprehensive_history = medical_records and len(medical_records) > 50 and medical_records.lower() not in [
@@ -376,28 +617,7 @@ def final_output_node(state: State):
             "• SYMPTOM ANALYSIS: Thoroughly evaluate current presentation, severity, and acuity\n"
             "• HISTORY INTEGRATION: Consider how symptoms relate to documented conditions\n"
             "• EQUAL WEIGHTING: Balance current clinical picture with medical background\n\n"
-            "RESPOND ONLY WITH A VALID JSON OBJECT in this exact format:\n"
-            "{\n"
-            "  \"differential_diagnosis\": [\n"
-            "    {\n"
-            "      \"rank\": 1,\n"
-            "      \"diagnosis\": \"Condition Name\",\n"
-            "      \"probability_percent\": 45,\n"
-            "      \"reasoning\": \"START with medical history analysis, then clinical reasoning\",\n"
-            "      \"key_features\": [\"symptom1\", \"history_connection1\", \"finding2\"],\n"
-            "      \"next_steps\": [\"history_guided_test1\", \"targeted_intervention2\"],\n"
-            "      \"medical_history_relevance\": \"DETAILED explanation of how patient's documented history supports this diagnosis\",\n"
-            "      \"history_confidence_score\": 85\n"
-            "    }\n"
-            "  ],\n"
-            "  \"clinical_summary\": \"Balanced assessment integrating current symptoms with medical history\",\n"
-            "  \"urgency_level\": 1,\n"
-            "  \"urgency_level_text\": \"Emergency|High|Moderate|Low|Routine\",\n"
-            "  \"symptom_analysis_impact\": \"Analysis of how current symptoms drive the diagnostic assessment\",\n"
-            "  \"medical_history_impact\": \"Analysis of how documented history informs the diagnostic assessment\",\n"
-            "  \"balanced_insights\": \"Key insights derived from integrating symptoms with medical background\",\n"
-            "  \"disclaimer\": \"This is a triage assessment tool utilizing comprehensive medical history analysis.\"\n"
-            "}\n\n"
+            "Respond with the diagnosis object defined by the response schema.\n\n"
             "🚨 BALANCED DIAGNOSTIC PRIORITIES:\n"
             f"- WEIGHT FACTOR: {'50%' if has_comprehensive_history else '30%'} medical history, {'50%' if has_comprehensive_history else '70%'} current symptoms\n"
             "- Prioritize conditions that are:\n"
@@ -426,104 +646,66 @@ Please provide your differential diagnosis with the top 5 most likely conditions
         """)
     ]
 
-    # Call the model for diagnosis
-    response = model.invoke(messages)
-
-    # Extract text content: some providers return structured content blocks
-    raw_content = getattr(response, "content", None)
-    diagnosis_text: Optional[str] = None
-
-    if isinstance(raw_content, list):
-        # Look for a block with a 'text' field
-        for block in raw_content:
-            if isinstance(block, dict):
-                text_val = block.get("text")
-                if isinstance(text_val, str):
-                    diagnosis_text = text_val
-                    break
-    elif isinstance(raw_content, dict):
-        # Single block dict with text
-        text_val = raw_content.get("text")
-        if isinstance(text_val, str):
-            diagnosis_text = text_val
-    elif isinstance(raw_content, (str, bytes, bytearray)):
-        diagnosis_text = raw_content.decode() if isinstance(raw_content, (bytes, bytearray)) else raw_content
-
-    if not diagnosis_text:
-        # Fallback to stringifying whatever we got, or default message
-        diagnosis_text = str(raw_content) if raw_content is not None else "Unable to generate diagnosis."
-
-    # Normalize urgency to numeric if model didn't strictly follow schema
-    try:
-        payload = json.loads(diagnosis_text)
-
-        def map_urgency_to_level(urgency_value) -> int:
-            # Already numeric and in range
-            if isinstance(urgency_value, (int, float)):
-                lvl = int(urgency_value)
-                if 1 <= lvl <= 5:
-                    return lvl
-            # Map strings to numeric
-            if isinstance(urgency_value, str):
-                w = urgency_value.strip().lower()
-                if w in {"emergency", "critical", "immediate", "life-threatening"}:
-                    return 1
-                if w in {"high", "urgent", "very high"}:
-                    return 2
-                if w in {"moderate", "medium"}:
-                    return 3
-                if w in {"low", "minor"}:
-                    return 4
-                if w in {"routine", "non-urgent", "nonurgent"}:
-                    return 5
-            # Default
-            return 3
-
-        # Ensure 'urgency_level' numeric and 'urgency_level_text' coherent
-        if isinstance(payload, dict):
-            numeric = None
-            if "urgency_level" in payload:
-                numeric = map_urgency_to_level(payload.get("urgency_level"))
-            elif "urgency" in payload:
-                numeric = map_urgency_to_level(payload.get("urgency"))
-            elif "urgency_level_text" in payload:
-                numeric = map_urgency_to_level(payload.get("urgency_level_text"))
-            else:
-                numeric = 3
-
-            payload["urgency_level"] = int(numeric)
-
-            # Keep/update a consistent text label
-            text_map = {
-                1: "Emergency",
-                2: "High",
-                3: "Moderate",
-                4: "Low",
-                5: "Routine",
-            }
-            payload["urgency_level_text"] = text_map.get(int(numeric), "Moderate")
-
-            # Re-serialize
-            diagnosis_text = json.dumps(payload)
-    except Exception:
-        # If parsing fails, return raw text
-        pass
-
-    return {"diagnosis": diagnosis_text}
+    # The response format constrains the shape; validate it once into the typed model.
+    # A refusal or a truncated reply gets one more try, then a marked fallback.
+    text = ""
+    for attempt in range(1 + DIAGNOSIS_RETRIES):
+        response = timed_invoke(
+            model, messages, "final_output", model_name, _graph_thread_id(),
+            config={"callbacks": llm_callbacks("final_output", model_name)},
+        )
+        text = _message_text(response) or ""
+        try:
+            return {"diagnosis": diagnosis_schema.parse(text)}
+        except ValidationError as e:
+            logger.warning(
+                "Diagnosis reply did not validate",
+                extra={"attempt": attempt + 1, "errors": e.error_count(), "reply_chars": len(text)},
+            )
+    return {"diagnosis": diagnosis_schema.unvalidated(text, state.get("provisional_urgency"))}
+
+
+def checkpoint_store_size(checkpointer) -> tuple:
+    """(threads, serialized bytes) held by an in-memory checkpointer; (0, 0) for other savers."""
+    storage = getattr(checkpointer, "storage", None)
+    if storage is None:
+        return 0, 0
+    total = 0
+    for namespaces in list(storage.values()):
+        for checkpoints in list(namespaces.values()):
+            for checkpoint, metadata, _parent in list(checkpoints.values()):
+                total += len(checkpoint[1]) + len(metadata[1])
+    for _type, blob in list(getattr(checkpointer, "blobs", {}).values()):
+        total += len(blob)
+    for writes in list(getattr(checkpointer, "writes", {}).values()):
+        for _task, _channel, value, _path in list(writes.values()):
+            total += len(value[1])
+    return len(storage), total
 
 
 def build_app():
+    interview_trees.load_configured()
     builder = StateGraph(State)
-    builder.add_node("agent", agent_node)
-    builder.add_node("final_output", final_output_node)
+    builder.add_node("agent", timed_node("agent", usage_node(agent_node)))
+    builder.add_node("final_output", timed_node("final_output", usage_node(final_output_node)))
+    builder.add_node("urgency", timed_node("urgency", urgency_node))
 
+    # The urgency branch runs in the same step as the agent: here for the
+    # presenting symptoms, then after every answer (ask_user_for_input)
     builder.set_entry_point("agent")
+    builder.add_edge(START, "urgency")
+    builder.add_edge("urgency", END)
     builder.add_edge("final_output", END)
 
-    return builder.compile(checkpointer=MemorySaver())
+    # Idle sessions hibernate to disk unless TRIAGE_HIBERNATE_AFTER_SECONDS=0
+    # LangGraph's ormsgpack serde, reviving only its own safe types (messages, Interrupt, Command)
+    serde = JsonPlusSerializer(allowed_msgpack_modules=None)
+    checkpointer = HibernatingSaver(serde=serde) if HIBERNATE_AFTER_SECONDS > 0 else MemorySaver(serde=serde)
+    return builder.compile(checkpointer=checkpointer)
 
 
 def main():
+    configure_logging()
     app = build_app()
     thread_id = "medical-diagnosis-1"
     config = {"configurable": {"thread_id": thread_id}}
@@ -536,8 +718,6 @@ def main():
             "mild nausea"
         ],
         "medical_records": "28-year-old female with history of migraines, currently taking sumatriptan PRN and propranolol 40mg daily for migraine prevention. Previous episodes typically triggered by stress and lack of sleep, characterized by unilateral throbbing headache with nausea and light sensitivity. Last severe episode was 3 months ago.",
-        "questions_asked": [],
-        "responses": []
     }
     
     print("Medical Diagnosis System Starting...")
@@ -558,7 +738,7 @@ def main():
             prompt = payload.get("message", "Proceed to diagnosis? (y/N)")
             user_value = input(f"\n{prompt} ").strip() or "n"
 
-            # Resume without altering Q/A lists
+            # Resume without adding a transcript row (the tool records the confirmation)
             result = app.invoke(Command(resume=user_value), config=config)
             continue
 
@@ -621,21 +801,11 @@ def main():
 
         print(f"   Response recorded: {user_value}")
 
-        # Update the responses and questions_asked in state and resume
-        current_state = app.get_state(config)
-        current_responses = current_state.values.get('responses', [])
-        current_questions = current_state.values.get('questions_asked', [])
-
-        updated_responses = current_responses + [user_value]
-        updated_questions = current_questions + [query]
-
+        # Record the answer in the transcript and resume
         result = app.invoke(
             Command(
                 resume=user_value,
-                update={
-                    "responses": updated_responses,
-                    "questions_asked": updated_questions,
-                },
+                update={"transcript": [transcript.question_row(query, user_value, question_type, options)]},
             ),
             config=config,
         )
@@ -645,24 +815,7 @@ def main():
         print("\n" + "="*60)
         print("🏥 DIFFERENTIAL DIAGNOSIS (JSON)")
         print("="*60)
-
-        diagnosis_payload = result["diagnosis"]
-        
-        # If the model returned a list/dict directly, pretty-print it
-        if isinstance(diagnosis_payload, (list, dict)):
-            print(json.dumps(diagnosis_payload, indent=2, ensure_ascii=False))
-        else:
-            try:
-                # Ensure we have a string for json.loads
-                if not isinstance(diagnosis_payload, (str, bytes, bytearray)):
-                    diagnosis_payload = str(diagnosis_payload)
-                # Try to parse as JSON for pretty printing
-                diagnosis_json = json.loads(diagnosis_payload)
-                print(json.dumps(diagnosis_json, indent=2, ensure_ascii=False))
-            except (json.JSONDecodeError, TypeError):
-                # Fallback to raw text if not valid JSON
-                print("Raw output (not valid JSON):")
-                print(diagnosis_payload)
+        print(json.dumps(result["diagnosis"], indent=2, ensure_ascii=False))
     else:
         print("Unexpected result:", result)
 
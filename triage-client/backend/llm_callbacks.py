@@ -0,0 +1,94 @@
+"""
+LangChain callbacks attached to the graph's model calls.
+
+Kept apart from `metrics` and `session_recorder` so the API can import those
+without loading langchain_core; only the graph module needs these.
+"""
+
+import time
+from typing import Dict, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessageChunk, message_chunk_to_message, message_to_dict
+
+import metrics
+import session_recorder
+from triage_logging import current_thread_id
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """LangChain callback recording time-to-first-token, total time and token usage for one node.
+
+    Create one per node/model and pass it via ``config={"callbacks": [...]}``; runs
+    are tracked by ``run_id`` so concurrent calls from different sessions don't mix.
+    Time-to-first-token is only observed when the model streams.
+    """
+
+    run_inline = True
+
+    def __init__(self, node: str, model: str):
+        self.node = node
+        self._ttft = metrics.LLM_TIME_TO_FIRST_TOKEN.labels(node, model)
+        self._duration = metrics.LLM_DURATION.labels(node, model)
+        self._prompt_tokens = metrics.LLM_TOKENS.labels(node, model, "prompt")
+        self._completion_tokens = metrics.LLM_TOKENS.labels(node, model, "completion")
+        self._cached_tokens = metrics.LLM_TOKENS.labels(node, model, "cached")
+        self._reasoning_tokens = metrics.LLM_TOKENS.labels(node, model, "reasoning")
+        self._started: Dict[object, list] = {}  # run_id -> [start, first_token_seen]
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = [time.perf_counter(), False]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = [time.perf_counter(), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        entry = self._started.get(run_id)
+        if entry is not None and not entry[1]:
+            entry[1] = True
+            self._ttft.observe(time.perf_counter() - entry[0])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        entry = self._started.pop(run_id, None)
+        if entry is not None:
+            self._duration.observe(time.perf_counter() - entry[0])
+        usage = _usage_from_result(response)
+        if usage:
+            self._prompt_tokens.inc(usage.get("input_tokens", 0) or 0)
+            self._completion_tokens.inc(usage.get("output_tokens", 0) or 0)
+            self._cached_tokens.inc((usage.get("input_token_details") or {}).get("cache_read", 0) or 0)
+            self._reasoning_tokens.inc((usage.get("output_token_details") or {}).get("reasoning", 0) or 0)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        entry = self._started.pop(run_id, None)
+        if entry is not None:
+            self._duration.observe(time.perf_counter() - entry[0])
+
+
+def _usage_from_result(response) -> Optional[dict]:
+    """Pull LangChain ``usage_metadata`` off the first generation of an LLMResult."""
+    try:
+        message = response.generations[0][0].message
+    except (AttributeError, IndexError, TypeError):
+        return None
+    return getattr(message, "usage_metadata", None)
+
+
+class RecordingCallback(BaseCallbackHandler):
+    """Records each model response for the session bound in the logging context."""
+
+    run_inline = True
+
+    def __init__(self, node: str):
+        self.node = node
+
+    def on_llm_end(self, response, **kwargs):
+        if not session_recorder.recording_enabled():
+            return
+        try:
+            message = response.generations[0][0].message
+        except (AttributeError, IndexError, TypeError):
+            return
+        if isinstance(message, BaseMessageChunk):
+            message = message_chunk_to_message(message)
+        session_recorder.record(current_thread_id(), {"event": "model", "node": self.node, "message": message_to_dict(message)})
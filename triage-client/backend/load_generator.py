@@ -0,0 +1,226 @@
+"""
+Concurrent virtual-patient load generator for the Medical Diagnosis API.
+
+Drives N simulated patients through /start -> /resume -> /confirm using the
+same `smart_response_selector` as test_api.py, with constant, Poisson or surge
+arrivals, and prints a machine-readable JSON summary (throughput, per-endpoint
+p50/p95/p99, error rates, session completion times).
+
+Pair it with TRIAGE_LLM_PROVIDER=fake on the server for repeatable runs:
+
+    TRIAGE_LLM_PROVIDER=fake python start_server.py --no-reload
+    python load_generator.py --patients 200 --rate 10 --arrival poisson --output summary.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from test_api import BASE_URL, smart_response_selector
+
+SCENARIOS = [
+    {
+        "symptoms": ["severe headache", "neck stiffness", "fever", "sensitivity to light"],
+        "medical_records": "22-year-old female, no significant medical history, college student, no known allergies",
+    },
+    {
+        "symptoms": ["chest pain", "shortness of breath", "sweating"],
+        "medical_records": "58-year-old male, hypertension, type 2 diabetes, smoker for 30 years",
+    },
+    {
+        "symptoms": ["abdominal pain", "nausea", "vomiting"],
+        "medical_records": "34-year-old female, no significant medical history",
+    },
+    {
+        "symptoms": ["cough", "fever", "fatigue"],
+        "medical_records": "71-year-old male, COPD, taking inhaled steroids",
+    },
+]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile; None for an empty sample."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), int(round(pct / 100.0 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def arrival_offsets(count: int, mode: str, rate: float, rng: random.Random,
+                    surge_factor: float = 5.0, surge_start: float = 0.0, surge_duration: float = 10.0) -> List[float]:
+    """Start times (seconds from t=0) for each virtual patient."""
+    offsets = []
+    t = 0.0
+    for _ in range(count):
+        offsets.append(t)
+        current = rate
+        if mode == "surge" and surge_start <= t < surge_start + surge_duration:
+            current = rate * surge_factor
+        if mode == "constant":
+            t += 1.0 / current
+        else:  # poisson and surge both draw exponential gaps
+            t += rng.expovariate(current)
+    return offsets
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.session_times: List[float] = []
+        self.sessions_completed = 0
+        self.sessions_failed = 0
+        self.questions: List[int] = []
+
+    def summary(self, wall_time: float, args) -> dict:
+        endpoints = {}
+        total_requests = 0
+        total_errors = 0
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            samples = self.latencies.get(endpoint, [])
+            errors = self.errors.get(endpoint, 0)
+            total_requests += len(samples)
+            total_errors += errors
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": errors / len(samples) if samples else 0.0,
+                "p50_ms": _ms(percentile(samples, 50)),
+                "p95_ms": _ms(percentile(samples, 95)),
+                "p99_ms": _ms(percentile(samples, 99)),
+                "max_ms": _ms(max(samples) if samples else None),
+            }
+        sessions = self.sessions_completed + self.sessions_failed
+        return {
+            "config": {
+                "base_url": args.base_url,
+                "patients": args.patients,
+                "arrival": args.arrival,
+                "rate_per_sec": args.rate,
+                "seed": args.seed,
+            },
+            "wall_time_s": round(wall_time, 3),
+            "throughput": {
+                "requests_per_sec": round(total_requests / wall_time, 3) if wall_time else None,
+                "sessions_per_sec": round(self.sessions_completed / wall_time, 3) if wall_time else None,
+            },
+            "requests": total_requests,
+            "errors": total_errors,
+            "error_rate": total_errors / total_requests if total_requests else 0.0,
+            "endpoints": endpoints,
+            "sessions": {
+                "started": sessions,
+                "completed": self.sessions_completed,
+                "failed": self.sessions_failed,
+                "completion_p50_ms": _ms(percentile(self.session_times, 50)),
+                "completion_p95_ms": _ms(percentile(self.session_times, 95)),
+                "completion_p99_ms": _ms(percentile(self.session_times, 99)),
+                "mean_questions": round(sum(self.questions) / len(self.questions), 2) if self.questions else None,
+            },
+        }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+async def _call(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, body: dict) -> Optional[dict]:
+    start = time.perf_counter()
+    try:
+        response = await client.post(endpoint, json=body)
+        elapsed = time.perf_counter() - start
+        recorder.latencies[endpoint].append(elapsed)
+        result = response.json() if response.status_code == 200 else None
+        if result is None or result.get("type") == "error":
+            recorder.errors[endpoint] += 1
+            return None
+        return result
+    except (httpx.HTTPError, ValueError):
+        recorder.latencies[endpoint].append(time.perf_counter() - start)
+        recorder.errors[endpoint] += 1
+        return None
+
+
+async def virtual_patient(client: httpx.AsyncClient, recorder: Recorder, index: int, run_id: str,
+                          delay: float, max_turns: int):
+    await asyncio.sleep(delay)
+    scenario = SCENARIOS[index % len(SCENARIOS)]
+    thread_id = f"load-{run_id}-{index}"
+    start = time.perf_counter()
+    questions = 0
+
+    result = await _call(client, recorder, "/start", {"thread_id": thread_id, **scenario})
+    for _ in range(max_turns):
+        if result is None:
+            break
+        if result.get("type") == "question":
+            questions += 1
+            query = result.get("query", "")
+            answer = smart_response_selector(query, result.get("options"))
+            result = await _call(client, recorder, "/resume", {"thread_id": thread_id, "response": answer, "question": query})
+        elif result.get("type") == "confirm":
+            result = await _call(client, recorder, "/confirm", {"thread_id": thread_id, "confirm": True, "full_name": f"Load Patient {index}"})
+        else:
+            break
+
+    if result is not None and result.get("type") == "diagnosis":
+        recorder.sessions_completed += 1
+        recorder.session_times.append(time.perf_counter() - start)
+        recorder.questions.append(questions)
+    else:
+        recorder.sessions_failed += 1
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    offsets = arrival_offsets(args.patients, args.arrival, args.rate, rng,
+                              args.surge_factor, args.surge_start, args.surge_duration)
+    recorder = Recorder()
+    run_id = f"{int(time.time())}-{args.seed}"
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            virtual_patient(client, recorder, i, run_id, offset, args.max_turns)
+            for i, offset in enumerate(offsets)
+        ))
+        wall_time = time.perf_counter() - start
+    return recorder.summary(wall_time, args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent virtual-patient load generator")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--patients", "-n", type=int, default=50, help="Virtual patients to run")
+    parser.add_argument("--arrival", choices=["constant", "poisson", "surge"], default="poisson")
+    parser.add_argument("--rate", type=float, default=5.0, help="Mean arrivals per second")
+    parser.add_argument("--surge-factor", type=float, default=5.0, help="Rate multiplier during the surge window")
+    parser.add_argument("--surge-start", type=float, default=0.0, help="Surge window start (seconds)")
+    parser.add_argument("--surge-duration", type=float, default=10.0, help="Surge window length (seconds)")
+    parser.add_argument("--max-turns", type=int, default=20, help="Give up on a session after this many steps")
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (seconds)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", "-o", help="Write the JSON summary here instead of stdout")
+    args = parser.parse_args(argv)
+
+    summary = asyncio.run(run(args))
+    text = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if summary["sessions"]["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,60 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from langgraph.types import Command
-from langgraph_model_medical import build_app
+import session_recorder
+import metrics
+import patient_store
+import profiling
+import queue_feed
+import queue_order
+import serialization
+import token_usage
+import transcript
+from triage_logging import bind_thread_id, configure_logging, get_logger
+import asyncio
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import dotenv
 
 dotenv.load_dotenv()
+configure_logging()
+logger = get_logger("api")
+
+# Heavy dependencies (langgraph, langchain_openai, pymongo) are imported on first
+# use, normally by the startup warmup, so the app module loads fast and /livez
+# answers while the process is still warming up.
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    _start_warmup()
+    hibernation = asyncio.create_task(_hibernation_loop())
+    feed = asyncio.create_task(queue_feed.FEED.run())
+    rebalance = asyncio.create_task(_queue_rebalance_loop())
+    yield
+    hibernation.cancel()
+    feed.cancel()
+    rebalance.cancel()
+    queue_feed.FEED.stop_watching()
+    await _drain()
 
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
 
 app = FastAPI(
     title="Medical Diagnosis API",
     description="AI-powered medical diagnosis system with interactive questioning",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=serialization.JSONResponseClass,
 )
 
 app.add_middleware(
@@ -28,194 +65,188 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-graph = build_app()
+app.add_middleware(metrics.RequestMetricsMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """The compiled triage graph, built on first use (normally by the startup warmup)."""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                import langgraph_model_medical
+                langgraph_model_medical.PROVISIONAL_URGENCY_SINK = _queue_provisional
+                _graph = langgraph_model_medical.build_app()
+    return _graph
+
+
+def __getattr__(name):
+    # `medical_api.graph` predates lazy construction; keep it working for scripts
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _checkpoint_size() -> tuple:
+    if _graph is None:
+        return 0, 0
+    from langgraph_model_medical import checkpoint_store_size
+    return checkpoint_store_size(_graph.checkpointer)
+
+
+metrics.computed_gauge(
+    "triage_checkpoint_threads",
+    "Sessions held by the in-memory checkpointer.",
+    lambda: _checkpoint_size()[0],
+)
+metrics.computed_gauge(
+    "triage_checkpoint_bytes",
+    "Serialized bytes held by the in-memory checkpointer.",
+    lambda: _checkpoint_size()[1],
+)
+
+HIBERNATE_SWEEP_SECONDS = float(os.getenv("TRIAGE_HIBERNATE_SWEEP_SECONDS", "5"))
 
-# Sentinel token used by frontend to indicate the user skipped a question
-SKIP_TOKEN = "__skip__"
 
+async def _hibernation_loop():
+    """Move idle sessions out of memory (see session_hibernation.py)."""
+    while True:
+        await asyncio.sleep(HIBERNATE_SWEEP_SECONDS)
+        checkpointer = getattr(_graph, "checkpointer", None)
+        if hasattr(checkpointer, "hibernate_idle"):
+            try:
+                await asyncio.to_thread(checkpointer.hibernate_idle)
+            except Exception:
+                logger.exception("Session hibernation sweep failed")
 
 # --- MongoDB helpers ---
-_mongo_client: Optional[MongoClient] = None
+_mongo_client = None
 
-def _get_mongo_client() -> Optional[MongoClient]:
+def _get_mongo_client():
     global _mongo_client
     if _mongo_client is not None:
         return _mongo_client
     uri = os.getenv("TRIAGE_MONGO_URI") or os.getenv("MONGO_URI")
     if not uri:
-        print("[triage-client] No TRIAGE_MONGO_URI/MONGO_URI configured; skipping DB writes.")
+        logger.info("No TRIAGE_MONGO_URI/MONGO_URI configured; skipping DB writes.")
         return None
     try:
-        print("[triage-client] Found Mongo URI in environment.")
-        _mongo_client = MongoClient(uri, server_api=ServerApi("1"))
+        logger.info("Found Mongo URI in environment.")
+        from pymongo.mongo_client import MongoClient
+        from pymongo.server_api import ServerApi
+        _mongo_client = MongoClient(uri, server_api=ServerApi("1"), **serialization.MONGO_CLIENT_OPTIONS)
         return _mongo_client
     except Exception:
-        print("[triage-client] Failed to initialize MongoClient; DB writes disabled.")
+        logger.exception("Failed to initialize MongoClient; DB writes disabled.")
         return None
 
-def _map_urgency_to_level(urgency_value) -> int:
-    if isinstance(urgency_value, (int, float)):
-        lvl = int(urgency_value)
-        if 1 <= lvl <= 5:
-            return lvl
-    if isinstance(urgency_value, str):
-        w = urgency_value.strip().lower()
-        if w in {"emergency", "critical", "immediate", "life-threatening"}:
-            return 1
-        if w in {"high", "urgent", "very high"}:
-            return 2
-        if w in {"moderate", "medium"}:
-            return 3
-        if w in {"low", "minor"}:
-            return 4
-        if w in {"routine", "non-urgent", "nonurgent"}:
-            return 5
-    return 3
-
-def _map_level_to_text(level: int) -> str:
-    mapping = {
-        1: "Emergency",
-        2: "High",
-        3: "Moderate",
-        4: "Low",
-        5: "Routine",
-    }
-    return mapping.get(int(level) if isinstance(level, (int, float, str)) and str(level).isdigit() else 3, "Moderate")
+# Differential fields kept in the patient record (the history notes stay in the API response)
+RECORD_DIFFERENTIAL_FIELDS = ("rank", "diagnosis", "probability_percent", "reasoning", "key_features", "next_steps")
 
-def _parse_probability_to_percent(value) -> int:
-    """Coerce probability to integer percent (0-100). Accepts numbers or strings like '35%' or '0.35'."""
-    if value is None:
-        return 0
-    try:
-        if isinstance(value, (int, float)):
-            # Interpret <=1 as ratio, >1 as percent
-            return int(round(value * 100)) if 0 <= value <= 1 else int(round(value))
-        if isinstance(value, str):
-            s = value.strip().replace("%", "")
-            if "/" in s:  # e.g., '1/3'
-                num, den = s.split("/", 1)
-                num_f, den_f = float(num), float(den)
-                return int(round((num_f / den_f) * 100)) if den_f else 0
-            f = float(s)
-            return int(round(f * 100)) if 0 <= f <= 1 else int(round(f))
-    except Exception:
-        return 0
-    return 0
+def _patient_document(thread_id: str, state_values: dict, diagnosis_payload: dict, patient_name: Optional[str] = None) -> dict:
+    """Patient record for MongoDB; every value is BSON-native, so pymongo encodes it as is."""
+    symptoms = state_values.get("symptoms", []) or []
+    symptoms_str = ", ".join(symptoms) if isinstance(symptoms, list) else str(symptoms)
+
+    # The diagnosis was validated against diagnosis_schema.Diagnosis in the graph,
+    # or is the marked fallback for a reply that never validated
+    usage_calls = state_values.get("usage") or []
+    doc = {
+        "name": patient_name or thread_id,  # use provided patient name or fallback to thread_id
+        "thread_id": thread_id,
+        "symptoms": symptoms_str,
+        "differential_diagnosis": [
+            {field: item[field] for field in RECORD_DIFFERENTIAL_FIELDS}
+            for item in diagnosis_payload["differential_diagnosis"]
+        ],
+        "clinical_summary": diagnosis_payload["clinical_summary"],
+        "urgency_level": diagnosis_payload["urgency_level"],
+        "urgency_level_text": diagnosis_payload["urgency_level_text"],
+        "disclaimer": diagnosis_payload["disclaimer"],
+        "validated": diagnosis_payload.get("validated", True),
+        "provisional": False,
+        # Token usage and cost across every model call of the session
+        "usage": {
+            **token_usage.summarize(usage_calls),
+            "calls": usage_calls,
+            "finished_at": datetime.now(timezone.utc),
+        },
+    }
+    # Optional age, read by the admin dashboard
+    if diagnosis_payload.get("age") is not None:
+        doc["age"] = diagnosis_payload["age"]
+    return doc
 
-def _coerce_differential_list(raw) -> list:
-    """Attempt to coerce a free-form list of differentials to the required schema.
-    Expected output items with keys: rank, diagnosis, probability_percent, reasoning, key_features, next_steps.
-    """
-    if not raw:
-        return []
-    items = []
-    # Accept either list of dicts or a dict with a key that contains a list
-    if isinstance(raw, dict):
-        # try common keys
-        for key in ["differential_diagnosis", "differentials", "diagnoses", "top_conditions", "items", "list"]:
-            if isinstance(raw.get(key), list):
-                raw = raw.get(key)
-                break
-    if not isinstance(raw, list):
-        return []
-    for idx, entry in enumerate(raw, start=1):
-        if not isinstance(entry, dict):
-            continue
-        diagnosis = entry.get("diagnosis") or entry.get("name") or entry.get("condition") or entry.get("label")
-        if not diagnosis:
-            # try to stringify
-            diagnosis = str(entry)
-        prob = entry.get("probability_percent") or entry.get("probability") or entry.get("prob") or entry.get("likelihood")
-        probability_percent = _parse_probability_to_percent(prob)
-        reasoning = entry.get("reasoning") or entry.get("rationale") or ""
-        key_features = entry.get("key_features") or entry.get("features") or []
-        next_steps = entry.get("next_steps") or entry.get("plan") or entry.get("actions") or []
-        # Coerce arrays
-        if isinstance(key_features, str):
-            key_features = [key_features]
-        if isinstance(next_steps, str):
-            next_steps = [next_steps]
-        # Rank: prefer explicit rank; else use loop index
-        rank = entry.get("rank")
-        try:
-            rank = int(rank) if rank is not None else idx
-        except Exception:
-            rank = idx
-        items.append({
-            "rank": rank,
-            "diagnosis": diagnosis,
-            "probability_percent": probability_percent,
-            "reasoning": reasoning,
-            "key_features": key_features if isinstance(key_features, list) else [],
-            "next_steps": next_steps if isinstance(next_steps, list) else [],
-        })
-    # Ensure sorted by rank ascending
-    items.sort(key=lambda x: x.get("rank", 0))
-    return items
 
 def _push_patient_record(thread_id: str, state_values: dict, diagnosis_payload: dict, patient_name: Optional[str] = None):
     client = _get_mongo_client()
     if not client:
         return  # silently skip if no DB configured
-    db_name = os.getenv("TRIAGE_DB_NAME", "test")
-    coll_name = os.getenv("TRIAGE_COLLECTION", "patients")
 
     try:
-        db = client[db_name]
-        coll = db[coll_name]
-        print(f"[triage-client] Using MongoDB {db_name}.{coll_name}")
-        symptoms = state_values.get("symptoms", []) or []
-        symptoms_str = ", ".join(symptoms) if isinstance(symptoms, list) else str(symptoms)
-
-        # Extract fields from diagnosis payload as available
-        diag = diagnosis_payload or {}
-        urgency_value = diag.get("urgency_level") or diag.get("urgency")
-        urgency_level = _map_urgency_to_level(urgency_value)
-        urgency_level_text = _map_level_to_text(urgency_level)
-
-        # Differential diagnosis list
-        dd_list = _coerce_differential_list(diag.get("differential_diagnosis") or diag.get("differentials") or diag.get("diagnoses") or diag)
-
-        # Clinical summary
-        clinical_summary = (
-            diag.get("clinical_summary") or
-            diag.get("summary") or
-            f"Symptoms: {symptoms_str}"
+        coll = patient_store.collection(client)
+        doc = _patient_document(thread_id, state_values, diagnosis_payload, patient_name)
+
+        start = time.perf_counter()
+        with metrics.MONGO_WRITE_LATENCY.time():
+            # Keyed by thread_id, so a retried /confirm updates the same record;
+            # the record is slotted by its final urgency (never moved down)
+            rank = queue_order.arrival_rank(coll, doc["urgency_level"])
+            res = patient_store.upsert_patient(coll, doc, rank=rank)
+        logger.info(
+            "Upserted patient doc",
+            extra={
+                "thread_id": thread_id,
+                "collection": f"{patient_store.DB_NAME}.{patient_store.COLLECTION}",
+                "created": res.upserted_id is not None,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+            },
         )
+        queue_feed.FEED.publish_write(coll, {**doc, "queue_rank": rank} if res.upserted_id is not None else doc, res)
+    except Exception:
+        # avoid raising; API response should not fail due to DB write
+        logger.exception("Error writing patient doc", extra={"thread_id": thread_id})
 
-        # Optional age (if provided and numeric)
-        age_val = diag.get("age")
-        try:
-            age = int(age_val) if age_val is not None and str(age_val).strip() != "" else None
-        except Exception:
-            age = None
 
-        disclaimer = (
-            diag.get("disclaimer")
-            or "This AI output is for informational purposes only and is not a substitute for professional medical advice."
-        )
+# --- Provisional queue entries ---
+# The graph's urgency branch re-scores a session after every answer; when the
+# level changes, the entry is upserted here on one background thread so the
+# interview never waits for MongoDB.
+_provisional_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="triage-provisional")
+# Set by the Mongo warmup once the unique thread_id index exists (see patient_store.upsert_provisional)
+_provisional_ready = threading.Event()
 
-        # Build document per new schema
-        doc = {
-            "name": patient_name or thread_id,  # use provided patient name or fallback to thread_id
-            "thread_id": thread_id,
-            "symptoms": symptoms_str,
-            "differential_diagnosis": dd_list,  # required array; may be empty
-            "clinical_summary": clinical_summary,
-            "urgency_level": int(urgency_level),
-            "urgency_level_text": urgency_level_text,
-            "disclaimer": disclaimer,
-        }
-        if age is not None:
-            doc["age"] = age
 
-        res = coll.insert_one(doc)
-        print(f"[triage-client] Inserted patient doc into {db_name}.{coll_name} _id={res.inserted_id}")
+def _write_provisional(thread_id: str, fields: dict, rising: bool):
+    try:
+        coll = patient_store.collection(_mongo_client)
+        with metrics.MONGO_WRITE_LATENCY.time():
+            rank = queue_order.arrival_rank(coll, fields["urgency_level"]) if rising else None
+            entry = patient_store.upsert_provisional(coll, thread_id, fields, rank=rank)
+        if entry is not None and not queue_feed.FEED.watching:
+            queue_feed.FEED.publish(entry["_id"], entry)
     except Exception:
-        # avoid raising; API response should not fail due to DB insert
-        import traceback
-        print("[triage-client] Error inserting patient doc:")
-        traceback.print_exc()
+        logger.exception("Error writing provisional queue entry", extra={"thread_id": thread_id})
+
+
+def _queue_provisional(thread_id: str, estimate, previous: Optional[int], state_values: dict):
+    """langgraph_model_medical.PROVISIONAL_URGENCY_SINK: queue the write and return at once."""
+    if not _provisional_ready.is_set():
+        return  # no MongoDB configured, or its indexes are not built yet
+    symptoms = state_values.get("symptoms") or []
+    fields = {
+        "symptoms": ", ".join(symptoms) if isinstance(symptoms, list) else str(symptoms),
+        "urgency_level": estimate.level,
+        "urgency_level_text": estimate.text,
+        "provisional_reasons": estimate.reasons,
+    }
+    # Rising risk (or a first estimate) re-slots the patient; falling risk keeps their place
+    rising = previous is None or estimate.level < previous
+    _provisional_executor.submit(_write_provisional, thread_id, fields, rising)
 
 
 @app.get("/")
@@ -223,7 +254,7 @@ def read_root():
     return {
         "message": "Medical Diagnosis API", 
         "status": "running", 
-        "endpoints": ["/start", "/resume", "/confirm", "/health", "/docs"],
+        "endpoints": ["/start", "/resume", "/confirm", "/batch/start", "/batch/resume", "/ws/session/{thread_id}", "/health", "/livez", "/readyz", "/metrics", "/usage/summary", "/admin/profiles", "/docs"],
         "description": "AI-powered medical diagnosis with interactive questioning"
     }
 
@@ -243,6 +274,16 @@ class ConfirmRequest(BaseModel):
     confirm: bool
     full_name: Optional[str] = None
 
+class BatchRequest(BaseModel):
+    # Items are validated one by one so a malformed session fails alone
+    sessions: List[Any]
+
+class MoveRequest(BaseModel):
+    patient_id: str
+    # The patients it goes between, as shown in the list; either may be omitted
+    after_id: Optional[str] = None
+    before_id: Optional[str] = None
+
 
 def serialize_result(result: dict):
     """Convert graph result to API-friendly format."""
@@ -269,24 +310,13 @@ def serialize_result(result: dict):
         }
     
     if isinstance(result, dict) and "diagnosis" in result:
-        diagnosis_content = result["diagnosis"]
-        
-        # Try to parse as JSON for structured response
-        try:
-            diagnosis_json = json.loads(diagnosis_content)
-            return {
-                "type": "diagnosis",
-                "diagnosis": diagnosis_json,
-                "status": "completed"
-            }
-        except json.JSONDecodeError:
-            # Fallback to text format
-            return {
-                "type": "diagnosis",
-                "diagnosis": {"raw_text": diagnosis_content},
-                "status": "completed"
-            }
-    
+        # Already a validated dict (see diagnosis_schema.py)
+        return {
+            "type": "diagnosis",
+            "diagnosis": result["diagnosis"],
+            "status": "completed"
+        }
+
     return {
         "type": "error",
         "error": "Unexpected result from medical diagnosis system",
@@ -294,35 +324,112 @@ def serialize_result(result: dict):
     }
 
 
-@app.post("/start")
-def start_diagnosis(req: StartRequest):
+def _session_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+# --- Open sessions ---
+# Sessions waiting on the patient in this process, for triage_active_sessions. A
+# step that asks something marks its session open and the diagnosis closes it; a
+# session idle for ACTIVE_SESSION_IDLE_SECONDS counts as abandoned and drops out.
+ACTIVE_SESSION_IDLE_SECONDS = float(os.getenv("TRIAGE_ACTIVE_SESSION_IDLE_SECONDS", "1800"))
+
+_open_sessions: "OrderedDict[str, float]" = OrderedDict()  # thread_id -> last step (monotonic)
+_open_sessions_guard = threading.Lock()
+
+
+def _touch_session(thread_id: str):
+    with _open_sessions_guard:
+        _open_sessions[thread_id] = time.monotonic()
+        _open_sessions.move_to_end(thread_id)
+
+
+def _close_session(thread_id: str) -> bool:
+    """Drop a session from the open table; True only on its first transition to done."""
+    with _open_sessions_guard:
+        return _open_sessions.pop(thread_id, None) is not None
+
+
+def _active_session_count() -> int:
+    cutoff = time.monotonic() - ACTIVE_SESSION_IDLE_SECONDS
+    with _open_sessions_guard:
+        # Touches move a session to the end, so the idle ones are at the front
+        while _open_sessions and next(iter(_open_sessions.values())) < cutoff:
+            _open_sessions.popitem(last=False)
+        return len(_open_sessions)
+
+
+metrics.computed_gauge(
+    "triage_active_sessions",
+    "Sessions in this process waiting on the patient (idle ones expire).",
+    _active_session_count,
+)
+
+
+def _record_if_diagnosis(thread_id: str, config: dict, payload: dict, patient_name: Optional[str] = None):
+    """Track a step's outcome: keep a waiting session open, and once it reaches its
+    final diagnosis push the patient record synchronously.
+
+    The per-session metrics are taken on the first transition to done only; a
+    repeated /confirm pushes the record again but does not count twice.
     """
-    Start a new medical diagnosis session.
-    
-    - **thread_id**: Unique identifier for this diagnosis session
-    - **symptoms**: List of patient symptoms
-    - **medical_records**: Optional medical history and patient information
+    if payload.get("type") in ("question", "confirm"):
+        _touch_session(thread_id)
+        return
+    if payload.get("type") != "diagnosis":
+        return
+    first = _close_session(thread_id)
+    try:
+        diagnosis_payload = payload["diagnosis"]
+        # Get the latest state to capture final symptoms list
+        with profiling.span("get_state"):
+            latest_state = get_graph().get_state(config)
+        values = latest_state.values or {}
+        if first:
+            metrics.QUESTIONS_PER_SESSION.observe(transcript.question_count(values))
+            token_usage.record_session(
+                thread_id,
+                token_usage.summarize(values.get("usage") or []),
+                datetime.now(timezone.utc),
+            )
+        with profiling.span("_push_patient_record"):
+            _push_patient_record(thread_id, values, diagnosis_payload, patient_name)
+    except Exception:
+        logger.exception("Error recording final diagnosis", extra={"thread_id": thread_id})
+
+
+def _resume_update(response: str, question: Optional[str] = None, pending: Optional[dict] = None):
+    """Build the resume value and the transcript row for an answer to the pending question.
+
+    ``pending`` is the question payload being answered (query, question_type,
+    options); a ``question`` sent by the client takes precedence for the text.
     """
-    config = {"configurable": {"thread_id": req.thread_id}}
-    
+    return transcript.recorded_answer(response), {"transcript": [transcript.answer_row(response, question, pending)]}
+
+
+def _pending_question(snapshot) -> dict:
+    """The question payload a session is waiting on, from a state snapshot ({} if none)."""
+    for pending in snapshot.interrupts or ():
+        if isinstance(pending.value, dict) and "query" in pending.value:
+            return pending.value
+    return {}
+
+
+def _run_start(thread_id: str, symptoms: List[str], medical_records: Optional[str] = None) -> dict:
+    config = _session_config(thread_id)
     initial_state = {
-        "symptoms": req.symptoms,
-        "medical_records": req.medical_records or "",
-        "questions_asked": [],
-        "responses": []
+        "symptoms": transcript.intern_symptoms(symptoms),
+        "medical_records": medical_records or "",
     }
-    
     try:
-        result = graph.invoke(initial_state, config=config)
-        payload = serialize_result(result)
-        # If immediate final diagnosis (unlikely), push to DB synchronously
-        if payload.get("type") == "diagnosis":
-            try:
-                diagnosis_payload = payload.get("diagnosis") if isinstance(payload.get("diagnosis"), dict) else {}
-                state = graph.get_state(config)
-                _push_patient_record(req.thread_id, state.values or {}, diagnosis_payload, None)
-            except Exception:
-                pass
+        session_recorder.begin_session(thread_id)
+        with profiling.span("graph.invoke"):
+            result = get_graph().invoke(initial_state, config=config)
+        with profiling.span("serialize_result"):
+            payload = serialize_result(result)
+        session_recorder.record_step(thread_id, "start", {"symptoms": symptoms, "medical_records": medical_records}, payload)
+        # Opens the session; an immediate final diagnosis (unlikely) is pushed to DB synchronously
+        _record_if_diagnosis(thread_id, config, payload)
         return payload
     except Exception as e:
         return {
@@ -332,88 +439,355 @@ def start_diagnosis(req: StartRequest):
         }
 
 
-@app.post("/resume")
-def resume_diagnosis(req: ResumeRequest):
-    """
-    Resume a diagnosis session by providing an answer to the current question.
-    
-    - **thread_id**: The session identifier
-    - **response**: Patient's response to the diagnostic question
-    """
-    config = {"configurable": {"thread_id": req.thread_id}}
-    
+def _run_resume(thread_id: str, response: str, question: Optional[str] = None, pending: Optional[dict] = None) -> dict:
+    """Answer the pending question. Callers that already hold the pending question
+    payload (the last event sent) can pass it as ``pending`` to skip the checkpoint read."""
+    from langgraph.types import Command
+    config = _session_config(thread_id)
     try:
-        # Get current state to update responses and questions
-        current_state = graph.get_state(config)
-        current_responses = current_state.values.get('responses', [])
-        current_questions = current_state.values.get('questions_asked', [])
-
-        # Convert skip token to a friendly recorded response
-        recorded_response = "No Response" if (req.response or "").strip() == SKIP_TOKEN else req.response
-
-        updated_responses = current_responses + [recorded_response]
-        updated_questions = current_questions + ([req.question] if req.question else [])
+        if pending is None:
+            with profiling.span("get_state"):
+                pending = _pending_question(get_graph().get_state(config))
+        recorded_response, update_payload = _resume_update(response, question, pending)
+        with profiling.span("graph.invoke"):
+            result = get_graph().invoke(
+                Command(resume=recorded_response, update=update_payload),
+                config=config,
+            )
+        with profiling.span("serialize_result"):
+            payload = serialize_result(result)
+        session_recorder.record_step(thread_id, "resume", {"response": response, "question": question}, payload)
+        # On final diagnosis, push to MongoDB synchronously
+        _record_if_diagnosis(thread_id, config, payload)
+        return payload
+    except Exception as e:
+        return {
+            "type": "error",
+            "error": f"Failed to resume diagnosis: {str(e)}",
+            "status": "error"
+        }
 
-        # Resume with the response and update state (include questions if provided)
-        update_payload = {"responses": updated_responses}
-        if req.question:
-            update_payload["questions_asked"] = updated_questions
 
-        result = graph.invoke(
-            Command(resume=recorded_response, update=update_payload),
-            config=config,
-        )
-        payload = serialize_result(result)
+def _run_confirm(thread_id: str, confirm: bool, full_name: Optional[str] = None) -> dict:
+    from langgraph.types import Command
+    config = _session_config(thread_id)
+    try:
+        resume_token = "yes" if confirm else "no"
+        with profiling.span("graph.invoke"):
+            result = get_graph().invoke(Command(resume=resume_token), config=config)
+        with profiling.span("serialize_result"):
+            payload = serialize_result(result)
+        session_recorder.record_step(thread_id, "confirm", {"confirm": confirm, "full_name": full_name}, payload)
         # On final diagnosis, push to MongoDB synchronously
-        if payload.get("type") == "diagnosis":
-            try:
-                diagnosis_payload = payload.get("diagnosis") if isinstance(payload.get("diagnosis"), dict) else {}
-                # Get the latest state to capture final symptoms list
-                latest_state = graph.get_state(config)
-                _push_patient_record(req.thread_id, latest_state.values or {}, diagnosis_payload, None)
-            except Exception:
-                pass
+        _record_if_diagnosis(thread_id, config, payload, full_name)
         return payload
     except Exception as e:
         return {
             "type": "error",
-            "error": f"Failed to resume diagnosis: {str(e)}",
+            "error": f"Failed to confirm diagnosis: {str(e)}",
             "status": "error"
         }
 
 
+# --- Per-session serialization and idempotency ---
+# Graph steps for one thread_id never run concurrently: a retried or double-tapped
+# request waits for the in-flight step, and with an Idempotency-Key it gets that
+# step's result back instead of advancing the session again.
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "300"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+_session_locks: Dict[str, list] = {}  # thread_id -> [lock, holders/waiters]
+_session_locks_guard = threading.Lock()
+_idempotent_results: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires_at, payload)
+_idempotent_results_guard = threading.Lock()
+
+
+@contextmanager
+def _serialized(thread_id: str):
+    """Hold the per-session lock; the entry is dropped once nobody holds or waits on it."""
+    with _session_locks_guard:
+        entry = _session_locks.get(thread_id)
+        if entry is None:
+            entry = _session_locks[thread_id] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _session_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _session_locks[thread_id]
+
+
+def _idempotent_lookup(key: tuple) -> Optional[dict]:
+    with _idempotent_results_guard:
+        hit = _idempotent_results.get(key)
+        if hit is None:
+            return None
+        if hit[0] < time.monotonic():
+            del _idempotent_results[key]
+            return None
+        return hit[1]
+
+
+def _idempotent_store(key: tuple, payload: dict):
+    now = time.monotonic()
+    with _idempotent_results_guard:
+        _idempotent_results[key] = (now + IDEMPOTENCY_TTL_SECONDS, payload)
+        _idempotent_results.move_to_end(key)
+        # Entries share one TTL, so insertion order is expiry order
+        while _idempotent_results:
+            oldest_key, (expires_at, _) = next(iter(_idempotent_results.items()))
+            if expires_at >= now and len(_idempotent_results) <= IDEMPOTENCY_MAX_ENTRIES:
+                break
+            del _idempotent_results[oldest_key]
+
+
+def _run_serialized_step(thread_id: str, step: str, idempotency_key: Optional[str], fn, *args):
+    """Run one graph step under the session lock, replaying a cached result for a repeated key.
+
+    Returns (payload, replayed).
+    """
+    key = (thread_id, step, idempotency_key) if idempotency_key else None
+    with _track_inflight(), bind_thread_id(thread_id), _serialized(thread_id):
+        if key is not None:
+            cached = _idempotent_lookup(key)
+            if cached is not None:
+                logger.info("Replayed idempotent step", extra={"step": step})
+                return cached, True
+        start = time.perf_counter()
+        # No-op unless the request opted into profiling (see profiling.py)
+        with profiling.profile_step(step, thread_id):
+            payload = fn(thread_id, *args)
+        logger.info(
+            "Step finished",
+            extra={
+                "step": step,
+                "result": payload.get("type"),
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+            },
+        )
+        # Errors are not cached so a retry can actually re-run the step
+        if key is not None and payload.get("type") != "error":
+            _idempotent_store(key, payload)
+        return payload, False
+
+
+def _run_serialized(thread_id: str, step: str, idempotency_key: Optional[str], fn, *args) -> dict:
+    return _run_serialized_step(thread_id, step, idempotency_key, fn, *args)[0]
+
+
+@app.post("/start")
+def start_diagnosis(req: StartRequest, idempotency_key: Optional[str] = Header(default=None)):
+    """
+    Start a new medical diagnosis session.
+    
+    - **thread_id**: Unique identifier for this diagnosis session
+    - **symptoms**: List of patient symptoms
+    - **medical_records**: Optional medical history and patient information
+    - **Idempotency-Key** (header): Optional; retries with the same key replay the first result
+    """
+    return serialization.JSONResponseClass(_run_serialized(req.thread_id, "start", idempotency_key, _run_start, req.symptoms, req.medical_records))
+
+
+@app.post("/resume")
+def resume_diagnosis(req: ResumeRequest, idempotency_key: Optional[str] = Header(default=None)):
+    """
+    Resume a diagnosis session by providing an answer to the current question.
+    
+    - **thread_id**: The session identifier
+    - **response**: Patient's response to the diagnostic question
+    - **Idempotency-Key** (header): Optional; retries with the same key replay the first result
+    """
+    return serialization.JSONResponseClass(_run_serialized(req.thread_id, "resume", idempotency_key, _run_resume, req.response, req.question))
+
+
 @app.post("/confirm")
-def confirm_diagnosis(req: ConfirmRequest):
+def confirm_diagnosis(req: ConfirmRequest, idempotency_key: Optional[str] = Header(default=None)):
     """
     Confirm or cancel proceeding to the final diagnosis after a confirmation interrupt.
 
     - **thread_id**: The session identifier
     - **confirm**: true to proceed, false to return to questioning
     - **full_name**: Optional patient full name extracted from medical data
+    - **Idempotency-Key** (header): Optional; retries with the same key replay the first result
     """
-    config = {"configurable": {"thread_id": req.thread_id}}
+    return serialization.JSONResponseClass(_run_serialized(req.thread_id, "confirm", idempotency_key, _run_confirm, req.confirm, req.full_name))
 
-    try:
-        resume_token = "yes" if req.confirm else "no"
-        result = graph.invoke(Command(resume=resume_token), config=config)
-        payload = serialize_result(result)
 
-        # On final diagnosis, push to MongoDB synchronously
-        if payload.get("type") == "diagnosis":
-            try:
-                diagnosis_payload = payload.get("diagnosis") if isinstance(payload.get("diagnosis"), dict) else {}
-                latest_state = graph.get_state(config)
-                _push_patient_record(req.thread_id, latest_state.values or {}, diagnosis_payload, req.full_name)
-            except Exception:
-                pass
+# --- Batch intake ---
+# Shared across batches so concurrent surges cannot oversubscribe the model/API quota.
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="triage-batch")
 
-        return payload
-    except Exception as e:
+
+def _batch_item(index: int, item: Any, model, step: str, run) -> dict:
+    try:
+        req = model(**item)
+    except (ValidationError, TypeError) as e:
         return {
+            "index": index,
+            "thread_id": item.get("thread_id") if isinstance(item, dict) else None,
             "type": "error",
-            "error": f"Failed to confirm diagnosis: {str(e)}",
+            "error": f"Invalid session: {str(e)}",
             "status": "error"
         }
+    try:
+        payload = run(req)
+    except Exception as e:
+        payload = {
+            "type": "error",
+            "error": f"Failed to {step} diagnosis: {str(e)}",
+            "status": "error"
+        }
+    return {"index": index, "thread_id": req.thread_id, **payload}
+
+
+def _stream_batch(sessions: List[Any], model, step: str, run):
+    """Yield one NDJSON line per session as soon as its graph step finishes."""
+    futures = [
+        _batch_executor.submit(_batch_item, index, item, model, step, run)
+        for index, item in enumerate(sessions)
+    ]
+    for future in as_completed(futures):
+        yield serialization.dumps(future.result()) + b"\n"
+
+
+@app.post("/batch/start")
+def batch_start_diagnosis(req: BatchRequest):
+    """
+    Start many diagnosis sessions at once (e.g. during a mass-casualty surge).
+
+    - **sessions**: Array of `/start` request bodies
+
+    Sessions run concurrently on a bounded worker pool (`BATCH_MAX_WORKERS`). The
+    response is NDJSON: one line per session, in completion order, carrying the
+    session's `index` in the batch, its `thread_id` and the usual `/start` payload.
+    """
+    run = lambda r: _run_serialized(r.thread_id, "start", None, _run_start, r.symptoms, r.medical_records)
+    return StreamingResponse(_stream_batch(req.sessions, StartRequest, "start", run), media_type="application/x-ndjson")
+
+
+@app.post("/batch/resume")
+def batch_resume_diagnosis(req: BatchRequest):
+    """
+    Answer the pending question for many sessions at once.
+
+    - **sessions**: Array of `/resume` request bodies
+
+    Streams NDJSON results like `/batch/start`.
+    """
+    run = lambda r: _run_serialized(r.thread_id, "resume", None, _run_resume, r.response, r.question)
+    return StreamingResponse(_stream_batch(req.sessions, ResumeRequest, "resume", run), media_type="application/x-ndjson")
+
+
+# --- WebSocket session channel ---
+# One open socket per patient session; a reconnect for the same thread_id takes over.
+_ws_sessions: Dict[str, WebSocket] = {}
+
+
+def _pending_event(thread_id: str):
+    """Rebuild the last event for a session from its checkpoint (used on (re)connect).
+
+    Returns (event, state_values); event is None when no session exists yet.
+    """
+    state = get_graph().get_state(_session_config(thread_id))
+    values = state.values or {}
+    if not values:
+        return None, values
+    if state.interrupts:
+        return serialize_result({"__interrupt__": list(state.interrupts)}), values
+    if values.get("diagnosis"):
+        return serialize_result({"diagnosis": values["diagnosis"]}), values
+    return {
+        "type": "error",
+        "error": "Session has no pending question",
+        "status": "error"
+    }, values
+
+
+@app.websocket("/ws/session/{thread_id}")
+async def session_channel(websocket: WebSocket, thread_id: str):
+    """
+    Drive a whole diagnosis session over one WebSocket.
+
+    Client messages (JSON):
+    - `{"type": "start", "symptoms": [...], "medical_records": "..."}`
+    - `{"type": "answer", "response": "...", "question": "..."}`
+    - `{"type": "confirm", "confirm": true, "full_name": "..."}`
+
+    Any message may carry an `idempotency_key`, with the same semantics as the
+    `Idempotency-Key` header on the HTTP endpoints.
+
+    The server pushes the same question/confirm/diagnosis/error payloads as the
+    HTTP endpoints. On (re)connect to an existing session the pending event is
+    replayed from the checkpoint.
+    """
+    await websocket.accept()
+    previous = _ws_sessions.get(thread_id)
+    _ws_sessions[thread_id] = websocket
+    if previous is not None:
+        try:
+            await previous.close(code=4000, reason="Session resumed on another connection")
+        except Exception:
+            pass
+
+    def question_payload(event: Optional[dict]) -> dict:
+        return event if event and event.get("type") == "question" else {}
+
+    try:
+        event, _ = await run_in_threadpool(_pending_event, thread_id)
+        if event is None:
+            await websocket.send_text(serialization.dumps_text({"type": "ready", "status": "awaiting_start"}))
+        else:
+            await websocket.send_text(serialization.dumps_text(event))
+        # The question the client is answering; lets each turn skip the checkpoint read
+        pending = question_payload(event)
+
+        while True:
+            try:
+                message = serialization.loads(await websocket.receive_text())
+            except (json.JSONDecodeError, KeyError):
+                await websocket.send_text(serialization.dumps_text({"type": "error", "error": "Invalid message", "status": "error"}))
+                continue
+            kind = message.get("type") if isinstance(message, dict) else None
+            idempotency_key = message.get("idempotency_key") if isinstance(message, dict) else None
+            replayed = False
+
+            if kind == "start":
+                event, replayed = await run_in_threadpool(
+                    _run_serialized_step, thread_id, "start", idempotency_key,
+                    _run_start, message.get("symptoms") or [], message.get("medical_records"),
+                )
+            elif kind == "answer":
+                response = str(message.get("response", ""))
+                question = message.get("question")
+                event, replayed = await run_in_threadpool(
+                    _run_serialized_step, thread_id, "resume", idempotency_key,
+                    _run_resume, response, question, pending,
+                )
+            elif kind == "confirm":
+                event, replayed = await run_in_threadpool(
+                    _run_serialized_step, thread_id, "confirm", idempotency_key,
+                    _run_confirm, bool(message.get("confirm")), message.get("full_name"),
+                )
+            else:
+                event = {"type": "error", "error": f"Unknown message type: {kind}", "status": "error"}
+
+            if replayed or (event.get("type") == "error" and kind in {"start", "answer", "confirm"}):
+                # A replayed result may be older than the session, and a failed step may or
+                # may not have advanced it; reload the pending question
+                current, _ = await run_in_threadpool(_pending_event, thread_id)
+                pending = question_payload(current)
+            elif kind in {"start", "answer", "confirm"}:
+                pending = question_payload(event)
+            await websocket.send_text(serialization.dumps_text(event))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if _ws_sessions.get(thread_id) is websocket:
+            del _ws_sessions[thread_id]
 
 
 @app.get("/session/{thread_id}/status")
@@ -424,7 +798,7 @@ def get_session_status(thread_id: str):
     config = {"configurable": {"thread_id": thread_id}}
     
     try:
-        state = graph.get_state(config)
+        state = get_graph().get_state(config)
         if not state.values:
             return {
                 "status": "not_found",
@@ -434,7 +808,7 @@ def get_session_status(thread_id: str):
         return {
             "status": "active",
             "symptoms": state.values.get('symptoms', []),
-            "questions_asked": len(state.values.get('questions_asked', [])),
+            "questions_asked": transcript.question_count(state.values),
             "has_diagnosis": bool(state.values.get('diagnosis')),
             "medical_records_provided": bool(state.values.get('medical_records'))
         }
@@ -445,16 +819,403 @@ def get_session_status(thread_id: str):
         }
 
 
+@app.get("/queue/stream")
+def queue_stream(request: Request, cursor: Optional[str] = None):
+    """Server-Sent Events feed of patient-queue deltas (see queue_feed.py); resumes from ``Last-Event-ID``."""
+    cursor = request.headers.get("last-event-id") or cursor
+    return StreamingResponse(
+        queue_feed.FEED.subscribe(cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Patient queue reads ---
+# The list view pages through waiting patients with only the row fields
+# (patient_store.queue_page); a record's diagnosis is loaded on demand. Reads are
+# cached for TRIAGE_QUEUE_CACHE_TTL_SECONDS, and any write the queue feed sees
+# (this worker's upserts, or every write when following the change stream)
+# invalidates them.
+QUEUE_PAGE_DEFAULT = 50
+QUEUE_PAGE_MAX = int(os.getenv("TRIAGE_QUEUE_PAGE_MAX", "200"))
+QUEUE_CACHE_TTL_SECONDS = float(os.getenv("TRIAGE_QUEUE_CACHE_TTL_SECONDS", "2"))
+QUEUE_CACHE_MAX_ENTRIES = 512
+
+_queue_cache: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires_at, feed version, JSON body)
+_queue_cache_lock = threading.Lock()
+
+
+def _queue_cached(key: tuple, load) -> Optional[bytes]:
+    """JSON body of ``load()`` (None if it returned None), encoded once per cache fill."""
+    version = queue_feed.FEED.version
+    now = time.monotonic()
+    with _queue_cache_lock:
+        entry = _queue_cache.get(key)
+        if entry is not None and entry[0] > now and entry[1] == version:
+            _queue_cache.move_to_end(key)
+            return entry[2]
+    value = load()
+    if value is not None:
+        value = serialization.dumps(value)
+    with _queue_cache_lock:
+        _queue_cache[key] = (now + QUEUE_CACHE_TTL_SECONDS, version, value)
+        _queue_cache.move_to_end(key)
+        while len(_queue_cache) > QUEUE_CACHE_MAX_ENTRIES:
+            _queue_cache.popitem(last=False)
+    return value
+
+
+def _load_queue_page(coll, limit: int, after: Optional[list]) -> dict:
+    # Taken before the read: resuming /queue/stream here may replay a change the page already has, never miss one
+    feed_cursor = queue_feed.FEED.cursor
+    rows, next_values = patient_store.queue_page(coll, limit, after)
+    return {
+        "patients": rows,
+        "next_cursor": patient_store.encode_cursor(next_values) if next_values else None,
+        "feed_cursor": feed_cursor,
+    }
+
+
+@app.get("/queue")
+def queue_summary(limit: int = QUEUE_PAGE_DEFAULT, cursor: Optional[str] = None):
+    """One page of waiting patients in queue order, list-view fields only."""
+    client = _get_mongo_client()
+    if client is None:
+        return {"type": "error", "error": "No MongoDB configured", "status": "error"}
+    limit = max(1, min(limit, QUEUE_PAGE_MAX))
+    try:
+        after = patient_store.decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return {"type": "error", "error": str(e), "status": "error"}
+    coll = patient_store.collection(client)
+    try:
+        body = _queue_cached(("page", cursor, limit), lambda: _load_queue_page(coll, limit, after))
+    except Exception as e:
+        logger.exception("Failed to load patient queue")
+        return {"type": "error", "error": f"Failed to load patient queue: {str(e)}", "status": "error"}
+    return Response(content=body, media_type="application/json")
+
+
+@app.get("/queue/patients/{patient_id}")
+def queue_patient_detail(patient_id: str):
+    """One patient record with its full diagnosis."""
+    client = _get_mongo_client()
+    if client is None:
+        return {"type": "error", "error": "No MongoDB configured", "status": "error"}
+    coll = patient_store.collection(client)
+    try:
+        body = _queue_cached(("patient", patient_id), lambda: patient_store.patient_detail(coll, patient_id))
+    except Exception as e:
+        logger.exception("Failed to load patient record")
+        return {"type": "error", "error": f"Failed to load patient record: {str(e)}", "status": "error"}
+    if body is None:
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found")
+    return Response(content=body, media_type="application/json")
+
+
+@app.post("/queue/move")
+def queue_move(req: MoveRequest):
+    """Move a waiting patient between two others; writes only that patient's record."""
+    client = _get_mongo_client()
+    if client is None:
+        return {"type": "error", "error": "No MongoDB configured", "status": "error"}
+    coll = patient_store.collection(client)
+    try:
+        patient_id = patient_store.object_id(req.patient_id)
+        after_id = patient_store.object_id(req.after_id) if req.after_id else None
+        before_id = patient_store.object_id(req.before_id) if req.before_id else None
+        rank = queue_order.move(coll, patient_id, after_id, before_id)
+    except ValueError as e:
+        return {"type": "error", "error": str(e), "status": "error"}
+    except Exception as e:
+        logger.exception("Failed to move patient")
+        return {"type": "error", "error": f"Failed to move patient: {str(e)}", "status": "error"}
+    if rank is None:
+        raise HTTPException(status_code=404, detail=f"Patient {req.patient_id} is not in the waiting queue")
+    if not queue_feed.FEED.watching:
+        queue_feed.FEED.publish(patient_id, {"queue_rank": rank})
+    return {"patient_id": req.patient_id, "queue_rank": rank, "status": "moved"}
+
+
+def _rebalance_queue():
+    if _mongo_client is None:
+        return  # not configured, or not connected by the warmup yet
+    coll = patient_store.collection(_mongo_client)
+    if not queue_order.needs_rebalance(coll):
+        return
+    for record_id, rank in queue_order.rebalance(coll):
+        if not queue_feed.FEED.watching:
+            queue_feed.FEED.publish(record_id, {"queue_rank": rank})
+
+
+async def _queue_rebalance_loop():
+    """Keep queue rank keys short and give unranked records one (see queue_order.py)."""
+    while True:
+        await asyncio.sleep(queue_order.REBALANCE_SECONDS)
+        try:
+            await asyncio.to_thread(_rebalance_queue)
+        except Exception:
+            logger.exception("Queue rebalance failed")
+
+
+# --- Startup warmup and probes ---
+# Warmup runs in a background thread at startup: it compiles the graph, opens the
+# LLM client's connection pool with one zero-token call, and pings MongoDB.
+# /livez only says the process is up; /readyz says every dependency is warm.
+WARMUP_RETRY_SECONDS = float(os.getenv("TRIAGE_WARMUP_RETRY_SECONDS", "15"))
+
+_warmup_state: Dict[str, dict] = {name: {"status": "pending"} for name in ("graph", "llm", "mongo")}
+_warmup_lock = threading.Lock()
+_warmup_running = False
+_warmup_last_attempt = 0.0
+
+
+def _warm_graph():
+    get_graph()
+
+
+def _warm_llm():
+    if os.getenv("TRIAGE_WARMUP_LLM", "1").strip().lower() in {"0", "false", "no"}:
+        return "skipped"
+    from langgraph_model_medical import chat_model
+    model = chat_model(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"), temperature=0)
+    root_client = getattr(model, "root_client", None)
+    if root_client is not None:
+        # Zero-token round trip: checks key and model, and opens the HTTP pool the nodes share
+        root_client.models.retrieve(model.model_name)
+    else:
+        model.invoke("ping")
+
+
+def _warm_mongo():
+    client = _get_mongo_client()
+    if client is None:
+        return "skipped"
+    client.admin.command("ping")
+    coll = patient_store.collection(client)
+    ready = patient_store.ensure_indexes(coll)
+    if patient_store.THREAD_ID_INDEX in ready:
+        _provisional_ready.set()
+    else:
+        logger.warning("Provisional queue entries are off until the unique thread_id index is built")
+    queue_feed.FEED.start_watching(coll)
+
+
+_WARMUP_STEPS = (("graph", _warm_graph), ("llm", _warm_llm), ("mongo", _warm_mongo))
+
+
+def warmup() -> Dict[str, dict]:
+    """Warm every component synchronously and return their status (the launcher's self-check)."""
+    global _warmup_running, _warmup_last_attempt
+    with _warmup_lock:
+        _warmup_running = True
+        _warmup_last_attempt = time.monotonic()
+    _run_warmup(set(_warmup_state))
+    with _warmup_lock:
+        return {name: dict(entry) for name, entry in _warmup_state.items()}
+
+
+def _run_warmup(names):
+    global _warmup_running
+    try:
+        for name, step in _WARMUP_STEPS:
+            if name not in names:
+                continue
+            start = time.perf_counter()
+            try:
+                status = step() or "ready"
+                entry = {"status": status}
+            except Exception as e:
+                entry = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+            entry["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            with _warmup_lock:
+                _warmup_state[name] = entry
+            log = logger.warning if entry["status"] == "failed" else logger.info
+            log("Warmup step finished", extra={"component": name, **entry})
+    finally:
+        with _warmup_lock:
+            _warmup_running = False
+
+
+def _start_warmup(names=None) -> bool:
+    """Warm the given components (default: all) in a background thread; False if already running."""
+    global _warmup_running, _warmup_last_attempt
+    with _warmup_lock:
+        if _warmup_running:
+            return False
+        _warmup_running = True
+        _warmup_last_attempt = time.monotonic()
+        names = set(names or _warmup_state)
+        for name in names:
+            # A component being retried keeps reporting its last failure until the retry finishes
+            if _warmup_state[name]["status"] != "failed":
+                _warmup_state[name] = {"status": "pending"}
+    threading.Thread(target=_run_warmup, args=(names,), name="triage-warmup", daemon=True).start()
+    return True
+
+
+# --- Graceful drain ---
+# On shutdown the server stops accepting connections; graph steps already running
+# (including ones whose HTTP request timed out) get up to TRIAGE_DRAIN_TIMEOUT_SECONDS
+# to finish and write their patient record before the process exits.
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("TRIAGE_DRAIN_TIMEOUT_SECONDS", "30"))
+
+_draining = False
+_inflight_steps = 0
+_inflight_cond = threading.Condition()
+
+
+@contextmanager
+def _track_inflight():
+    global _inflight_steps
+    with _inflight_cond:
+        _inflight_steps += 1
+    try:
+        yield
+    finally:
+        with _inflight_cond:
+            _inflight_steps -= 1
+            if _inflight_steps == 0:
+                _inflight_cond.notify_all()
+
+
+def _wait_for_inflight(timeout: float) -> int:
+    """Block until no graph step is running or ``timeout`` passes; returns the steps still running."""
+    with _inflight_cond:
+        _inflight_cond.wait_for(lambda: _inflight_steps == 0, timeout=timeout)
+        return _inflight_steps
+
+
+async def _drain():
+    global _draining
+    _draining = True
+    start = time.perf_counter()
+    remaining = await asyncio.to_thread(_wait_for_inflight, DRAIN_TIMEOUT_SECONDS)
+    _batch_executor.shutdown(wait=False, cancel_futures=True)
+    _provisional_executor.shutdown(wait=False, cancel_futures=True)
+    checkpointer = getattr(_graph, "checkpointer", None)
+    if hasattr(checkpointer, "close"):
+        checkpointer.close()
+    extra = {"duration_ms": round((time.perf_counter() - start) * 1000, 2), "abandoned_steps": remaining}
+    if remaining:
+        logger.warning("Drain timed out with graph steps still running", extra=extra)
+    else:
+        logger.info("Drained in-flight graph steps", extra=extra)
+
+
+@app.get("/livez")
+def liveness():
+    """Process is up and serving requests (no dependency checks)."""
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+def readiness():
+    """Ready once the graph is compiled and the LLM and MongoDB (if configured) are warm; 503 otherwise."""
+    with _warmup_lock:
+        components = {name: dict(entry) for name, entry in _warmup_state.items()}
+        retry_due = not _warmup_running and time.monotonic() - _warmup_last_attempt >= WARMUP_RETRY_SECONDS
+    failed = [name for name, entry in components.items() if entry["status"] == "failed"]
+    if failed and retry_due:
+        # Dependency may have come back; re-check it in the background
+        _start_warmup(failed)
+    ready = not _draining and all(entry["status"] in ("ready", "skipped") for entry in components.values())
+    body = {"status": "ready" if ready else ("draining" if _draining else "not_ready"), "components": components}
+    if ready:
+        return body
+    return serialization.JSONResponseClass(body, status_code=503)
+
+
 @app.get("/health")
 def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
         "service": "Medical Diagnosis API",
-        "graph_status": "ready"
+        "graph_status": "ready" if _graph is not None else "cold"
     }
 
 
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics in the text exposition format."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _usage_sessions_since(since: datetime):
+    """Finished-session usage summaries since ``since``: from MongoDB when configured, else this process."""
+    client = _get_mongo_client()
+    if not client:
+        return "memory", token_usage.ledger_sessions(since)
+    coll = patient_store.collection(client)
+    cursor = coll.find(
+        {"usage.finished_at": {"$gte": since}},
+        {"_id": 0, "thread_id": 1, "usage.totals": 1, "usage.by_model": 1, "usage.finished_at": 1},
+    )
+    # The client reads datetimes back timezone-aware (serialization.MONGO_CLIENT_OPTIONS)
+    return "mongo", [{"thread_id": doc.get("thread_id"), **(doc.get("usage") or {})} for doc in cursor]
+
+
+@app.get("/usage/summary")
+def usage_summary(windows: str = "1h,24h,7d", top: int = 10):
+    """Token usage and cost per model and per session over each time window."""
+    try:
+        window_seconds = {w.strip(): token_usage.parse_window(w) for w in windows.split(",") if w.strip()}
+    except ValueError as e:
+        return {"type": "error", "error": str(e), "status": "error"}
+    if not window_seconds:
+        return {"type": "error", "error": "At least one window is required", "status": "error"}
+
+    now = datetime.now(timezone.utc)
+    try:
+        source, sessions = _usage_sessions_since(now - timedelta(seconds=max(window_seconds.values())))
+    except Exception as e:
+        logger.exception("Failed to load usage records")
+        return {"type": "error", "error": f"Failed to load usage records: {str(e)}", "status": "error"}
+
+    report = {}
+    for name, seconds in window_seconds.items():
+        since = now - timedelta(seconds=seconds)
+        in_window = [s for s in sessions if isinstance(s.get("finished_at"), datetime) and s["finished_at"] >= since]
+        report[name] = token_usage.aggregate(in_window, top=max(top, 0))
+    return {"source": source, "generated_at": now.isoformat(timespec="seconds"), "windows": report}
+
+
+def _require_admin(token: Optional[str]):
+    if not profiling.admin_token_valid(token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.get("/admin/profiles")
+def list_request_profiles(x_admin_token: Optional[str] = Header(default=None)):
+    """Most recent request profiles (newest first); requires X-Admin-Token."""
+    _require_admin(x_admin_token)
+    return {"profiles": profiling.list_profiles()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+def get_request_profile(profile_id: str, format: str = "speedscope", x_admin_token: Optional[str] = Header(default=None)):
+    """Download one profile as speedscope JSON (default), collapsed stacks, or a span summary."""
+    _require_admin(x_admin_token)
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found (it may have been evicted)")
+    if format == "collapsed":
+        return PlainTextResponse(
+            profiling.to_collapsed(profile),
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'},
+        )
+    if format == "summary":
+        return profile.summary()
+    if format != "speedscope":
+        raise HTTPException(status_code=400, detail="format must be one of: speedscope, collapsed, summary")
+    return Response(
+        content=serialization.dumps(profiling.to_speedscope(profile)),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'},
+    )
+
+
 @app.get("/example")
 def get_example_request():
     """
@@ -0,0 +1,157 @@
+"""
+Prometheus metrics for the Medical Diagnosis API.
+
+Collectors come from ``prometheus_client`` and live in this module's own
+`REGISTRY`; `render()` produces the text exposition format served by
+``/metrics``. Label children are bound once and reused: callers keep the
+child from ``labels(...)`` (see llm_callbacks.py and ``timed_node``), and
+`RequestMetricsMiddleware` caches one child per route and method, so the hot
+path only bumps a value.
+"""
+
+import math
+import time
+from typing import Callable, Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, disable_created_metrics, generate_latest
+
+# Only the series a dashboard reads; no *_created timestamps
+disable_created_metrics()
+
+REGISTRY = CollectorRegistry()
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Seconds; spans fast in-process work up to slow reasoning-model calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+# Seconds; in-process work that is usually well under a millisecond
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def render() -> bytes:
+    """Every metric in `REGISTRY`, in the Prometheus text format."""
+    return generate_latest(REGISTRY)
+
+
+def computed_gauge(name: str, documentation: str, fn: Callable[[], float]) -> Gauge:
+    """Gauge whose value ``fn`` computes at scrape time (NaN if it raises)."""
+    def value() -> float:
+        try:
+            return float(fn())
+        except Exception:
+            return math.nan
+
+    gauge = Gauge(name, documentation, registry=REGISTRY)
+    gauge.set_function(value)
+    return gauge
+
+
+# --- Triage metrics ---
+
+REQUEST_LATENCY = Histogram(
+    "triage_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ["endpoint", "method"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+NODE_LATENCY = Histogram(
+    "triage_graph_node_duration_seconds",
+    "Wall time spent in each LangGraph node.",
+    ["node"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "triage_llm_time_to_first_token_seconds",
+    "Time from sending an LLM request to receiving its first streamed token.",
+    ["node", "model"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+LLM_DURATION = Histogram(
+    "triage_llm_duration_seconds",
+    "Total LLM call time.",
+    ["node", "model"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+LLM_TOKENS = Counter(
+    "triage_llm_tokens",
+    "LLM tokens consumed, by kind (prompt, completion, cached, reasoning).",
+    ["node", "model", "kind"],
+    registry=REGISTRY,
+)
+QUESTIONS_PER_SESSION = Histogram(
+    "triage_questions_per_session",
+    "Questions asked before a session reached its diagnosis.",
+    buckets=COUNT_BUCKETS,
+    registry=REGISTRY,
+)
+SESSION_HIBERNATE_LATENCY = Histogram(
+    "triage_session_hibernate_duration_seconds",
+    "Time to serialize, compress and store one idle session and drop it from memory.",
+    buckets=FAST_BUCKETS,
+    registry=REGISTRY,
+)
+SESSION_REHYDRATE_LATENCY = Histogram(
+    "triage_session_rehydrate_duration_seconds",
+    "Time to load a hibernated session back into memory on its next request.",
+    buckets=FAST_BUCKETS,
+    registry=REGISTRY,
+)
+HIBERNATED_SESSIONS = Gauge(
+    "triage_hibernated_sessions",
+    "Sessions currently hibernated to disk.",
+    registry=REGISTRY,
+)
+HIBERNATED_BYTES = Gauge(
+    "triage_hibernated_bytes",
+    "Compressed bytes of hibernated sessions on disk.",
+    registry=REGISTRY,
+)
+MONGO_WRITE_LATENCY = Histogram(
+    "triage_mongo_write_duration_seconds",
+    "Latency of patient record writes to MongoDB.",
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+QUEUE_FEED_SUBSCRIBERS = Gauge(
+    "triage_queue_feed_subscribers",
+    "Open /queue/stream connections.",
+    registry=REGISTRY,
+)
+QUEUE_FEED_EVENTS = Counter(
+    "triage_queue_feed_events",
+    "Coalesced queue-change events published to /queue/stream.",
+    registry=REGISTRY,
+)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing every HTTP request under its route template (bounded cardinality)."""
+
+    def __init__(self, app):
+        self.app = app
+        self._latency: Dict[str, Dict[str, object]] = {}  # route template -> method -> REQUEST_LATENCY child
+
+    def _child(self, endpoint: str, method: str):
+        by_method = self._latency.get(endpoint)
+        if by_method is None:
+            by_method = self._latency.setdefault(endpoint, {})
+        child = by_method.get(method)
+        if child is None:
+            child = by_method.setdefault(method, REQUEST_LATENCY.labels(endpoint, method))
+        return child
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            self._child(endpoint, scope.get("method", "")).observe(time.perf_counter() - start)
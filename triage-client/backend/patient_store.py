@@ -0,0 +1,250 @@
+"""
+MongoDB patient records: index bootstrap and idempotent writes.
+
+`ensure_indexes` runs in the startup warmup of every worker (creating an index
+that already exists is a no-op) and keeps every query on the collection
+index-backed:
+
+- ``thread_id_unique``: one record per session. Older records without a string
+  ``thread_id`` are left out by a partial filter.
+- ``queue_order``: the admin dashboard's sort ``{priority_order, urgency_level, level}``.
+- ``waiting_queue``: queue order (``queue_rank``, see queue_order.py) over
+  waiting patients only; partial on ``discharged: false``, so discharged
+  records leave it.
+- ``waiting_urgency_rank``: the same records by urgency, to slot new arrivals.
+- ``usage_finished_at``: the ``/usage/summary`` time-window scan.
+- ``discharged_ttl``: deletes a record ``TRIAGE_DISCHARGED_TTL_SECONDS`` after
+  its ``discharged_at``; only created when that is set (records are kept by default).
+
+`upsert_patient` writes with ``update_one(upsert=True)`` keyed by ``thread_id``,
+so a retried ``/confirm`` updates the same document instead of adding another.
+Fields owned by the dashboard (``priority_order``, ``queue_rank``, discharge)
+are never overwritten. pymongo is imported lazily, like everywhere else in the API.
+
+`upsert_provisional` keeps a queue entry for a session still being
+interviewed (``provisional: true``) with its provisional urgency; the final
+record replaces it in place, moving it up if the final urgency is higher.
+
+`queue_page` reads the waiting queue one page at a time, in ``waiting_queue``
+order. It projects only `QUEUE_FIELDS` and continues after the last row of
+the previous page (keyset pagination), so each page costs the same number of
+index entries however long the queue is. `patient_detail` loads one full
+record.
+"""
+
+import base64
+import os
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import serialization
+from triage_logging import get_logger
+
+logger = get_logger("patient_store")
+
+DB_NAME = os.getenv("TRIAGE_DB_NAME", "test")
+COLLECTION = os.getenv("TRIAGE_COLLECTION", "patients")
+DISCHARGED_TTL_SECONDS = int(os.getenv("TRIAGE_DISCHARGED_TTL_SECONDS", "0"))
+
+WAITING = {"discharged": False}
+
+# Fields of a queue row: the paginated queue and the live feed send only these
+QUEUE_FIELDS = ("name", "thread_id", "symptoms", "urgency_level", "urgency_level_text", "provisional", "queue_rank", "priority_order")
+# Written for an unfinished session only; the final record drops them
+PROVISIONAL_ONLY_FIELDS = ("provisional_reasons",)
+# Queue order, served by the waiting_queue index; _id makes it total
+QUEUE_SORT = (("queue_rank", 1), ("_id", 1))
+
+# One record per session; provisional upserts rely on it (see upsert_provisional)
+THREAD_ID_INDEX = "thread_id_unique"
+
+INDEXES = (
+    ([("thread_id", 1)], {
+        "name": THREAD_ID_INDEX,
+        "unique": True,
+        "partialFilterExpression": {"thread_id": {"$type": "string"}},
+    }),
+    ([("priority_order", 1), ("urgency_level", 1), ("level", 1)], {"name": "queue_order"}),
+    ([("queue_rank", 1), ("_id", 1)], {
+        "name": "waiting_queue",
+        "partialFilterExpression": WAITING,
+    }),
+    ([("urgency_level", 1), ("queue_rank", 1)], {
+        "name": "waiting_urgency_rank",
+        "partialFilterExpression": WAITING,
+    }),
+    ([("usage.finished_at", 1)], {"name": "usage_finished_at"}),
+)
+
+# MongoDB error codes handled during the bootstrap
+_DUPLICATE_KEY = 11000
+_INDEX_OPTIONS_CONFLICT = 85
+_INDEX_KEY_SPECS_CONFLICT = 86
+
+
+def collection(client):
+    return client[DB_NAME][COLLECTION]
+
+
+def _index_specs() -> list:
+    specs = list(INDEXES)
+    if DISCHARGED_TTL_SECONDS > 0:
+        specs.append(([("discharged_at", 1)], {"name": "discharged_ttl", "expireAfterSeconds": DISCHARGED_TTL_SECONDS}))
+    return specs
+
+
+def ensure_indexes(coll) -> List[str]:
+    """Create the patient indexes; returns the names that exist afterwards.
+
+    A unique index cannot be built over duplicates left by earlier blind inserts;
+    that is logged with the offending thread ids and the other indexes are still
+    created. Records are never deleted here. An index whose definition changed
+    is dropped and rebuilt (a TTL change is applied in place).
+    """
+    from pymongo.errors import OperationFailure
+
+    ready = []
+    for keys, options in _index_specs():
+        name = options["name"]
+        try:
+            coll.create_index(keys, **options)
+            ready.append(name)
+        except OperationFailure as e:
+            if e.code == _INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in options:
+                # TTL changed since the index was built; update it in place
+                coll.database.command("collMod", coll.name, index={"name": name, "expireAfterSeconds": options["expireAfterSeconds"]})
+                ready.append(name)
+            elif e.code in (_INDEX_OPTIONS_CONFLICT, _INDEX_KEY_SPECS_CONFLICT) and name in coll.index_information():
+                logger.info("Rebuilding changed patient index", extra={"index": name})
+                coll.drop_index(name)
+                coll.create_index(keys, **options)
+                ready.append(name)
+            elif e.code == _DUPLICATE_KEY:
+                logger.error(
+                    "Duplicate patient records block the unique index; merge them and restart",
+                    extra={"index": name, "thread_ids": duplicate_thread_ids(coll)},
+                )
+            else:
+                logger.error("Failed to create patient index", extra={"index": name, "error": str(e)})
+    return ready
+
+
+def duplicate_thread_ids(coll, limit: int = 20) -> List[str]:
+    pipeline = [
+        {"$match": {"thread_id": {"$type": "string"}}},
+        {"$group": {"_id": "$thread_id", "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+        {"$limit": limit},
+    ]
+    return [row["_id"] for row in coll.aggregate(pipeline)]
+
+
+def upsert_patient(coll, doc: dict, now: Optional[datetime] = None, rank: Optional[str] = None):
+    """Insert or update the record for ``doc["thread_id"]``; returns the pymongo `UpdateResult`.
+
+    ``rank`` is the queue position for the final urgency (`queue_order.arrival_rank`).
+    Like in `upsert_provisional` it can only move an existing record earlier
+    (``$min``): a provisional entry moves up when the final urgency is higher,
+    and a manual move is never undone. The provisional-only fields are removed.
+    """
+    fields = {k: v for k, v in doc.items() if k != "thread_id"}
+    update = {
+        "$set": fields,
+        "$setOnInsert": {"discharged": False, "created_at": now or datetime.now(timezone.utc)},
+        "$unset": {field: "" for field in PROVISIONAL_ONLY_FIELDS},
+    }
+    if rank is not None:
+        update["$min"] = {"queue_rank": rank}
+    return coll.update_one({"thread_id": doc["thread_id"]}, update, upsert=True)
+
+
+def upsert_provisional(coll, thread_id: str, fields: dict, rank: Optional[str] = None, now: Optional[datetime] = None) -> Optional[dict]:
+    """Create or update the provisional entry of an unfinished session; returns its queue fields.
+
+    ``rank`` can only move the entry earlier (``$min``), so rising risk moves a
+    patient up but never undoes a manual move. Returns None once the final
+    record exists; it is never overwritten.
+
+    That relies on the `THREAD_ID_INDEX` unique index: without it the upsert
+    would add a second document next to the final record. Write provisional
+    entries only once `ensure_indexes` reports it built.
+    """
+    from pymongo import ReturnDocument
+    from pymongo.errors import DuplicateKeyError
+
+    update = {
+        "$set": {**fields, "provisional": True},
+        "$setOnInsert": {"name": thread_id, "discharged": False, "created_at": now or datetime.now(timezone.utc)},
+    }
+    if rank is not None:
+        update["$min"] = {"queue_rank": rank}
+    try:
+        return coll.find_one_and_update(
+            {"thread_id": thread_id, "provisional": {"$ne": False}},
+            update,
+            projection={field: 1 for field in QUEUE_FIELDS},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None  # the final record (provisional: false) already holds this thread_id
+
+
+def _sorts_after(values: list) -> dict:
+    """Filter for waiting records strictly after ``values`` in `QUEUE_SORT` order (missing values sort first)."""
+    clauses = []
+    for i, (field, _) in enumerate(QUEUE_SORT):
+        clause = {f: v for (f, _), v in zip(QUEUE_SORT[:i], values[:i])}
+        clause[field] = {"$ne": None} if values[i] is None else {"$gt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(serialization.dumps([*values[:-1], str(values[-1])])).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Sort values of a page cursor; raises ValueError if it was not made by `encode_cursor`."""
+    try:
+        values = serialization.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(QUEUE_SORT):
+            raise ValueError
+        return [*values[:-1], object_id(values[-1])]
+    except (ValueError, TypeError):
+        raise ValueError("Invalid queue cursor") from None
+
+
+def queue_page(coll, limit: int, after: Optional[list] = None) -> Tuple[List[dict], Optional[list]]:
+    """Up to ``limit`` waiting patients after the sort values ``after``; returns the rows and the next page's values."""
+    query = dict(WAITING)
+    if after:
+        query.update(_sorts_after(after))
+    rows = list(
+        coll.find(query, {field: 1 for field in QUEUE_FIELDS})
+        .sort(list(QUEUE_SORT))
+        .limit(limit + 1)
+    )
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, [rows[-1].get(field) for field, _ in QUEUE_SORT]
+
+
+def object_id(value: str):
+    """``_id`` of a record from its string form; raises ValueError if it is not one."""
+    from bson import ObjectId
+    from bson.errors import InvalidId
+
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Invalid patient id: {value}") from None
+
+
+def patient_detail(coll, patient_id: str) -> Optional[dict]:
+    """One full patient record (diagnosis included, token usage left out); None if the id is unknown."""
+    try:
+        return coll.find_one({"_id": object_id(patient_id)}, {"usage": 0})
+    except ValueError:
+        return None
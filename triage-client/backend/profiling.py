@@ -0,0 +1,321 @@
+"""
+On-demand per-request profiling.
+
+A request opts in with ``X-Triage-Profile: 1`` plus ``X-Admin-Token`` matching
+``TRIAGE_ADMIN_TOKEN`` (profiling is disabled while that variable is unset).
+The graph step it triggers then runs under a sampling profiler (a background
+thread capturing stacks every ``TRIAGE_PROFILE_INTERVAL_MS``) and records named
+spans around ``graph.invoke``, each node, ``get_state``, ``serialize_result``
+and ``_push_patient_record``.
+
+LangGraph runs the nodes of one superstep (agent and urgency) on its executor
+threads, not the request thread. The profile context follows them there, and
+a thread is sampled while it is inside one of the profile's spans. The request
+thread is sampled for the whole step. Each thread gets its own sampled
+profile in the speedscope file and its own root frame in collapsed stacks.
+
+Finished profiles go into a ring buffer of ``TRIAGE_PROFILE_BUFFER`` entries and
+can be downloaded from the admin endpoints as speedscope JSON or collapsed
+stacks (for flamegraph.pl / inferno). Requests that don't opt in only pay a
+context-variable lookup per span.
+"""
+
+import contextvars
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_HEADER = "x-triage-profile"
+ADMIN_TOKEN_HEADER = "x-admin-token"
+PROFILE_ID_HEADER = "X-Triage-Profile-Id"
+
+PROFILE_INTERVAL_MS = float(os.getenv("TRIAGE_PROFILE_INTERVAL_MS", "5"))
+PROFILE_BUFFER_SIZE = int(os.getenv("TRIAGE_PROFILE_BUFFER", "20"))
+MAX_SAMPLES = 50000
+
+_requested: contextvars.ContextVar[Optional["ProfileRequest"]] = contextvars.ContextVar("triage_profile_request", default=None)
+_active: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("triage_profile_active", default=None)
+
+_profiles: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+_profiles_lock = threading.Lock()
+_ids = itertools.count(1)
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    expected = os.getenv("TRIAGE_ADMIN_TOKEN")
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+
+class ProfileRequest:
+    """Marker placed in the request context by the middleware; filled with the profile ids it produced."""
+
+    def __init__(self):
+        self.profile_ids: List[str] = []
+
+
+class RequestProfile:
+    def __init__(self, step: str, thread_id: Optional[str]):
+        self.id = f"p{next(_ids)}-{int(time.time())}"
+        self.step = step
+        self.thread_id = thread_id
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[Tuple[str, float, float, int]] = []  # (name, start_s, end_s, depth)
+        self.samples: List[Tuple[float, str, Tuple[Tuple[str, str, int], ...]]] = []  # (at_s, thread, stack)
+        self.thread_ident = threading.get_ident()
+        # Threads being sampled -> open span depth; the step's thread is always in it
+        self._depth: Dict[int, int] = {self.thread_ident: 0}
+        self._thread_names: Dict[int, str] = {self.thread_ident: threading.current_thread().name}
+        self._lock = threading.Lock()
+
+    def enter_span(self) -> Tuple[int, Optional[int]]:
+        """Register the calling thread for sampling; returns (span depth, depth to restore)."""
+        ident = threading.get_ident()
+        with self._lock:
+            previous = self._depth.get(ident)
+            # A node on an executor thread nests under the spans open on the step's thread
+            depth = previous if previous is not None else self._depth[self.thread_ident]
+            self._depth[ident] = depth + 1
+            self._thread_names.setdefault(ident, threading.current_thread().name)
+        return depth, previous
+
+    def exit_span(self, previous: Optional[int]):
+        ident = threading.get_ident()
+        with self._lock:
+            if previous is None:
+                del self._depth[ident]  # the thread left the profiled work; stop sampling it
+            else:
+                self._depth[ident] = previous
+
+    def sampled_threads(self) -> List[Tuple[int, str]]:
+        with self._lock:
+            return [(ident, self._thread_names[ident]) for ident in self._depth]
+
+    def thread_names(self) -> List[str]:
+        """Names of the threads that were sampled, the step's thread first."""
+        with self._lock:
+            return list(dict.fromkeys(self._thread_names.values()))
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "step": self.step,
+            "thread_id": self.thread_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "samples": len(self.samples),
+            "spans": [
+                {"name": name, "start_ms": round(s * 1000, 3), "duration_ms": round((e - s) * 1000, 3), "depth": depth}
+                for name, s, e, depth in self.spans
+            ],
+        }
+
+
+class _Sampler(threading.Thread):
+    """Samples the Python stacks of the profile's threads at a fixed interval."""
+
+    def __init__(self, profile: RequestProfile, interval: float):
+        super().__init__(name="triage-profiler", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        samples = self.profile.samples
+        while not self._stop_event.wait(self.interval):
+            if len(samples) >= MAX_SAMPLES:
+                continue
+            frames = sys._current_frames()
+            at = time.perf_counter() - self.profile.start
+            for ident, thread_name in self.profile.sampled_threads():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                    frame = frame.f_back
+                stack.reverse()
+                samples.append((at, thread_name, tuple(stack)))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextmanager
+def request_context(enabled: bool):
+    """Mark the current request as profiled (used by the HTTP middleware)."""
+    if not enabled:
+        yield None
+        return
+    request = ProfileRequest()
+    token = _requested.set(request)
+    try:
+        yield request
+    finally:
+        _requested.reset(token)
+
+
+@contextmanager
+def profile_step(step: str, thread_id: Optional[str]):
+    """Profile one graph step if the surrounding request opted in; otherwise a no-op."""
+    request = _requested.get()
+    if request is None or _active.get() is not None:
+        yield
+        return
+    profile = RequestProfile(step, thread_id)
+    sampler = _Sampler(profile, PROFILE_INTERVAL_MS / 1000.0)
+    token = _active.set(profile)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        _active.reset(token)
+        profile.duration = time.perf_counter() - profile.start
+        with _profiles_lock:
+            _profiles.append(profile)
+        request.profile_ids.append(profile.id)
+
+
+@contextmanager
+def span(name: str):
+    """Time a named section of the active profile (no-op when the request isn't profiled)."""
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    depth, previous = profile.enter_span()
+    start = time.perf_counter() - profile.start
+    try:
+        yield
+    finally:
+        profile.exit_span(previous)
+        profile.spans.append((name, start, time.perf_counter() - profile.start, depth))
+
+
+def list_profiles() -> List[dict]:
+    with _profiles_lock:
+        profiles = list(_profiles)
+    return [
+        {k: v for k, v in p.summary().items() if k != "spans"}
+        for p in reversed(profiles)
+    ]
+
+
+def get_profile(profile_id: str) -> Optional[RequestProfile]:
+    with _profiles_lock:
+        for profile in _profiles:
+            if profile.id == profile_id:
+                return profile
+    return None
+
+
+def to_speedscope(profile: RequestProfile) -> dict:
+    """Speedscope file with a sampled stack profile and an evented profile of the spans."""
+    frames: List[dict] = []
+    frame_index: Dict[tuple, int] = {}
+
+    def index_of(key: tuple, frame: dict) -> int:
+        idx = frame_index.get(key)
+        if idx is None:
+            idx = frame_index[key] = len(frames)
+            frames.append(frame)
+        return idx
+
+    end_ms = profile.duration * 1000
+    interval_ms = PROFILE_INTERVAL_MS
+    samples: Dict[str, List[list]] = {thread: [] for thread in profile.thread_names()}
+    for _at, thread, stack in profile.samples:
+        samples.setdefault(thread, []).append([
+            index_of(("py", name, filename, line), {"name": name, "file": filename, "line": line})
+            for name, filename, line in stack
+        ])
+
+    events = []
+    for name, start, end, _depth in profile.spans:
+        idx = index_of(("span", name), {"name": name})
+        events.append((start * 1000, 1, {"type": "O", "frame": idx, "at": round(start * 1000, 3)}))
+        events.append((end * 1000, 0, {"type": "C", "frame": idx, "at": round(end * 1000, 3)}))
+    # Closes sort before opens at the same instant; nested spans close inner-first
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    title = f"{profile.step} {profile.thread_id or ''} {profile.started_at}".strip()
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": title,
+        "exporter": "caladrius-triage",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": f"{title} [{thread}] (samples every {interval_ms:g} ms)",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(end_ms, 3),
+                "samples": thread_samples,
+                "weights": [interval_ms] * len(thread_samples),
+            }
+            for thread, thread_samples in samples.items()
+        ] + [
+            {
+                "type": "evented",
+                "name": f"{title} (spans)",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(end_ms, 3),
+                "events": [e[2] for e in events],
+            },
+        ],
+    }
+
+
+def to_collapsed(profile: RequestProfile) -> str:
+    """Collapsed stacks (``frame;frame;frame count``) for flamegraph tooling."""
+    counts: Dict[str, int] = {}
+    for _at, thread, stack in profile.samples:
+        key = ";".join([thread] + [f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack])
+        counts[key] = counts.get(key, 0) + 1
+    return "".join(f"{stack} {count}\n" for stack, count in counts.items())
+
+
+class ProfilingMiddleware:
+    """ASGI middleware enabling profiling for authorized opt-in requests and returning the profile ids."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        wanted = headers.get(PROFILE_HEADER.encode(), b"").decode().strip().lower() in {"1", "true", "yes"}
+        enabled = wanted and admin_token_valid(headers.get(ADMIN_TOKEN_HEADER.encode(), b"").decode() or None)
+        if not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        with request_context(True) as request:
+            async def send_with_profile_id(message):
+                if message["type"] == "http.response.start" and request.profile_ids:
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers") or []) + [
+                        (PROFILE_ID_HEADER.lower().encode(), ",".join(request.profile_ids).encode())
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_profile_id)
@@ -0,0 +1,90 @@
+"""
+Adaptive stopping: is another interview question still worth asking?
+
+Before the next question, `expected_gain` estimates how much one more answer
+could change the triage outcome. It is the product of two shares, each
+between 0 and 1:
+
+- **Urgency:** how often the answers so far changed urgency_score's
+  estimate. With no answers yet it starts at one in two (Laplace smoothing).
+  An Emergency estimate gets no shortcut: its interview is not cut shorter
+  than anyone else's.
+- **Differential:** how many essential areas no question has covered yet.
+  These are the symptom's severity or character, its onset, associated
+  symptoms, and medical history when the patient has one.
+
+The agent stops asking and goes to ``signal_diagnosis_complete`` once
+``TRIAGE_STOP_MIN_QUESTIONS`` questions (default 3, agent_node's own minimum)
+are answered and the gain is below ``TRIAGE_STOP_GAIN_THRESHOLD``. Stopping
+early changes how much a patient is asked, so it is off by default
+(threshold 0), leaving only the fixed limits in agent_node. The estimate uses local rules
+and needs no model call, so a settled interview also skips the agent's model
+call. ``benchmarks/replay_bench.py --stop-gain`` replays recorded sessions
+under a threshold and reports the model calls it saves.
+"""
+
+import os
+from typing import Iterable, List, NamedTuple, Optional
+
+import transcript
+import urgency_score
+
+GAIN_THRESHOLD = float(os.getenv("TRIAGE_STOP_GAIN_THRESHOLD", "0"))
+MIN_QUESTIONS = int(os.getenv("TRIAGE_STOP_MIN_QUESTIONS", "3"))
+
+# Keywords marking which areas the questions so far have covered
+AREA_KEYWORDS = {
+    "timing": ("when", "started", "how long", "duration", "time"),
+    "severity": ("severe", "pain scale", "rate", "intensity", "bad"),
+    "quality": ("feel like", "describe", "type of", "kind of", "sensation"),
+    "triggers": ("better", "worse", "trigger", "cause", "aggravate", "relieve"),
+    "associated_symptoms": ("other symptoms", "anything else", "along with", "together"),
+    "context": ("doing when", "started when", "recent", "changes", "circumstances"),
+    "history_correlation": ("relate", "connection", "similar", "medication", "condition", "before"),
+}
+# Any one area in a group covers it
+ESSENTIAL_AREAS = (("severity", "quality"), ("timing",), ("associated_symptoms",))
+HISTORY_AREAS = (("history_correlation",),)
+
+_NO_HISTORY = {"", "no medical history provided", "no significant medical history"}
+
+
+class Gain(NamedTuple):
+    value: float
+    urgency_change: float
+    open_areas: List[str]
+
+
+def covered_areas(questions: Iterable[str]) -> List[str]:
+    """Areas (keys of `AREA_KEYWORDS`, in order) that the questions touch."""
+    text = " ".join(q for q in questions if q).lower()
+    return [area for area, words in AREA_KEYWORDS.items() if any(word in text for word in words)]
+
+
+def has_history(medical_records: Optional[str]) -> bool:
+    return bool(medical_records) and medical_records.lower() not in _NO_HISTORY
+
+
+def urgency_change(symptoms, turns: List["transcript.Turn"], medical_records: Optional[str] = None) -> float:
+    """Smoothed share of answers that changed the urgency estimate."""
+    answered = [turn for turn in turns if turn.is_question]
+    levels = [urgency_score.estimate(symptoms, answered[:n], medical_records).level for n in range(len(answered) + 1)]
+    changes = sum(1 for a, b in zip(levels, levels[1:]) if a != b)
+    return (changes + 1) / (len(answered) + 2)
+
+
+def expected_gain(state: dict) -> Gain:
+    medical_records = state.get("medical_records")
+    covered = set(covered_areas(transcript.questions_asked(state)))
+    groups = ESSENTIAL_AREAS + (HISTORY_AREAS if has_history(medical_records) else ())
+    open_areas = [group[0] for group in groups if covered.isdisjoint(group)]
+    change = urgency_change(state.get("symptoms"), transcript.turns(state), medical_records)
+    return Gain(round(change * len(open_areas) / len(groups), 3), round(change, 3), open_areas)
+
+
+def settled(state: dict) -> Optional[Gain]:
+    """The gain if questioning should stop now, else None."""
+    if GAIN_THRESHOLD <= 0 or transcript.question_count(state) < MIN_QUESTIONS:
+        return None
+    gain = expected_gain(state)
+    return gain if gain.value < GAIN_THRESHOLD else None
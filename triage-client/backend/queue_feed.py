@@ -0,0 +1,303 @@
+"""
+Live patient-queue feed for the admin dashboard (``GET /queue/stream``).
+
+Instead of re-reading the whole collection, a dashboard keeps one Server-Sent
+Events stream open and applies deltas:
+
+- An event lists the records that changed since the previous event, as
+  ``{"_id", "op", "fields"}``. ``op`` is ``upsert`` or ``remove`` (deleted or
+  discharged). ``fields`` holds only the queue fields
+  (``patient_store.QUEUE_FIELDS``) whose value changed; diagnoses are never
+  streamed.
+- Changes are coalesced for ``TRIAGE_QUEUE_FEED_COALESCE_MS``. Several writes
+  to one record within that window become one change, and the window becomes
+  one event. The event is encoded once and the same bytes go to every
+  subscriber.
+- Each event id is a cursor (``<epoch>-<seq>``). A client that reconnects with
+  ``Last-Event-ID`` (EventSource sends it) or ``?cursor=`` is replayed what it
+  missed from a ring buffer of the last ``TRIAGE_QUEUE_FEED_BUFFER`` events.
+  The client instead gets a ``reset`` event, meaning "reload the list once,
+  then apply deltas", in three cases:
+  - it connected without a cursor;
+  - its cursor comes from another process;
+  - its cursor is older than the buffer (including a subscriber too slow to
+    keep up).
+
+Where changes come from (``TRIAGE_QUEUE_FEED_SOURCE``):
+
+- ``changestream``: a MongoDB change stream on the patients collection. It
+  sees writes from every worker and from the dashboard itself (reorders,
+  discharges). It needs a replica set; Atlas clusters always are one. The
+  Mongo warmup fails when the server has no change streams.
+- ``local``: `_push_patient_record` publishes the writes of this process only.
+- ``auto`` (default): the change stream, or local writes while no stream is
+  open (not started yet, or unsupported by the server).
+
+Local writes are only enough for a single process. Behind `session_router`
+every ``/queue`` and ``/queue/stream`` request reaches one worker, whose feed
+(and read cache) would never see the other workers' confirms, so
+`start_server.py --prod` runs more than one worker only with ``changestream``.
+
+Every change is diffed against the last values published for its record, so
+a write seen by both sources is streamed once. pymongo is imported lazily.
+"""
+
+import asyncio
+import os
+import secrets
+import threading
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import metrics
+import patient_store
+import serialization
+from triage_logging import get_logger
+
+logger = get_logger("queue_feed")
+
+SOURCE = os.getenv("TRIAGE_QUEUE_FEED_SOURCE", "auto").strip().lower()
+COALESCE_SECONDS = float(os.getenv("TRIAGE_QUEUE_FEED_COALESCE_MS", "250")) / 1000
+BUFFER_EVENTS = int(os.getenv("TRIAGE_QUEUE_FEED_BUFFER", "1024"))
+TRACKED_RECORDS = int(os.getenv("TRIAGE_QUEUE_FEED_TRACKED", "10000"))
+HEARTBEAT_SECONDS = float(os.getenv("TRIAGE_QUEUE_FEED_HEARTBEAT_SECONDS", "15"))
+WATCH_RETRY_SECONDS = 5.0
+
+FIELDS = patient_store.QUEUE_FIELDS
+
+# $changeStream on a standalone server
+_CHANGE_STREAM_UNSUPPORTED = 40573
+
+_KEEPALIVE = b": keepalive\n\n"
+_MISSING = object()
+
+
+def _frame(cursor: str, event: str, data: dict) -> bytes:
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (cursor.encode(), event.encode(), serialization.dumps(data))
+
+
+class QueueFeed:
+    """Coalesces queue changes into numbered events and fans them out to SSE subscribers.
+
+    `publish` is thread-safe (called from request threads and the change-stream
+    thread); `flush` and `subscribe` run on the event loop.
+    """
+
+    def __init__(self, buffer_events: int = BUFFER_EVENTS, tracked_records: int = TRACKED_RECORDS):
+        self.epoch = secrets.token_hex(4)
+        self.watching = False
+        self.version = 0  # bumped by every published write; read caches compare it
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._notified_seq = 0
+        self._events: deque = deque(maxlen=buffer_events)  # (seq, encoded frame)
+        self._pending: Dict[str, dict] = {}
+        self._known: "OrderedDict[str, dict]" = OrderedDict()  # last values published per record
+        self._tracked_records = tracked_records
+        self._wakeup = asyncio.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def cursor(self) -> str:
+        return f"{self.epoch}-{self._seq}"
+
+    def publish(self, record_id, fields: Optional[dict] = None, removed: bool = False):
+        """Queue a change to one record; unchanged fields are dropped, no-op changes vanish."""
+        record_id = str(record_id)
+        with self._lock:
+            self.version += 1
+            if removed:
+                self._known.pop(record_id, None)
+                self._pending[record_id] = {"_id": record_id, "op": "remove"}
+                return
+            known = self._known.get(record_id)
+            if known is None:
+                known = self._known[record_id] = {}
+                if len(self._known) > self._tracked_records:
+                    self._known.popitem(last=False)
+            else:
+                self._known.move_to_end(record_id)
+            changed = {k: v for k, v in (fields or {}).items() if k in FIELDS and known.get(k, _MISSING) != v}
+            if not changed:
+                return
+            known.update(changed)
+            change = self._pending.get(record_id)
+            if change is None or change["op"] == "remove":
+                change = self._pending[record_id] = {"_id": record_id, "op": "upsert", "fields": {}}
+            change["fields"].update(changed)
+
+    def publish_write(self, coll, doc: dict, result):
+        """Local source: publish a patient upsert (`patient_store.upsert_patient`) unless a change stream covers it."""
+        if self.watching:
+            return
+        record_id = result.upserted_id
+        if record_id is None:
+            # The update may have moved the record up (queue_rank is $min)
+            existing = coll.find_one({"thread_id": doc["thread_id"]}, {"_id": 1, "queue_rank": 1})
+            if existing is None:
+                return
+            record_id = existing["_id"]
+            doc = {**doc, "queue_rank": existing.get("queue_rank")}
+        self.publish(record_id, doc)
+
+    def flush(self) -> Optional[str]:
+        """Turn the pending changes into one event and wake the subscribers; returns the new cursor, if any."""
+        with self._lock:
+            if self._pending:
+                changes, self._pending = list(self._pending.values()), {}
+                self._seq += 1
+                self._events.append((self._seq, _frame(self.cursor, "changes", {"cursor": self.cursor, "changes": changes})))
+                metrics.QUEUE_FEED_EVENTS.inc()
+            if self._seq == self._notified_seq:
+                return None
+            self._notified_seq = self._seq
+            cursor = self.cursor
+        waiter, self._wakeup = self._wakeup, asyncio.Event()
+        waiter.set()
+        return cursor
+
+    def resync(self):
+        """Queue a ``reset`` event: changes were lost, so every client reloads the list."""
+        with self._lock:
+            self.version += 1
+            self._pending.clear()
+            self._known.clear()
+            self._seq += 1
+            self._events.append((self._seq, _frame(self.cursor, "reset", {"cursor": self.cursor})))
+
+    async def run(self):
+        """Flush loop, one event per coalescing window at most."""
+        self._wakeup = asyncio.Event()
+        while True:
+            await asyncio.sleep(COALESCE_SECONDS)
+            self.flush()
+
+    def _resume_seq(self, cursor: Optional[str]) -> Optional[int]:
+        """The sequence a cursor resumes after, or None if its events are not all buffered."""
+        epoch, _, seq = (cursor or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq > self._seq:
+            return None
+        oldest = self._events[0][0] if self._events else self._seq + 1
+        return seq if seq >= oldest - 1 else None
+
+    def _reset(self) -> Tuple[int, bytes]:
+        return self._seq, _frame(self.cursor, "reset", {"cursor": self.cursor})
+
+    async def subscribe(self, cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+        """SSE frames for one client: missed events (or a reset), then live events and keepalives."""
+        metrics.QUEUE_FEED_SUBSCRIBERS.inc()
+        try:
+            last = self._resume_seq(cursor)
+            if last is None:
+                last, frame = self._reset()
+                yield frame
+            while True:
+                waiter = self._wakeup
+                if self._resume_seq(f"{self.epoch}-{last}") is None:
+                    # Fell behind the ring buffer
+                    last, frame = self._reset()
+                    yield frame
+                    continue
+                frames = [(seq, frame) for seq, frame in list(self._events) if seq > last]
+                for seq, frame in frames:
+                    yield frame
+                    last = seq
+                if frames:
+                    continue
+                try:
+                    await asyncio.wait_for(waiter.wait(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield _KEEPALIVE
+        finally:
+            metrics.QUEUE_FEED_SUBSCRIBERS.dec()
+
+    # --- change stream source ---
+
+    def apply_change(self, change: dict):
+        """Publish one change-stream event (insert, update, replace or delete)."""
+        record_id = change["documentKey"]["_id"]
+        op = change["operationType"]
+        if op == "delete":
+            self.publish(record_id, removed=True)
+            return
+        if op == "update":
+            fields = (change.get("updateDescription") or {}).get("updatedFields") or {}
+        else:
+            fields = change.get("fullDocument") or {}
+        self.publish(record_id, fields, removed=fields.get("discharged") is True)
+
+    def start_watching(self, coll) -> bool:
+        """Follow ``coll`` with a change stream in a background thread (once); False if the source is local."""
+        if SOURCE == "local":
+            return False
+        if self._watcher is not None and self._watcher.is_alive():
+            return True
+        if SOURCE == "changestream":
+            self._check_change_streams(coll)
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(coll,), name="triage-queue-feed", daemon=True)
+        self._watcher.start()
+        return True
+
+    @staticmethod
+    def _check_change_streams(coll):
+        """Raise if the server cannot open a change stream, so the warmup fails instead of retrying forever."""
+        from pymongo.errors import OperationFailure
+
+        try:
+            coll.watch(max_await_time_ms=1).close()
+        except OperationFailure as e:
+            if e.code == _CHANGE_STREAM_UNSUPPORTED:
+                raise RuntimeError("TRIAGE_QUEUE_FEED_SOURCE=changestream needs a MongoDB replica set") from e
+            raise
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def _watch(self, coll):
+        from pymongo.errors import OperationFailure, PyMongoError
+
+        # Trim events server-side: only queue fields and the discharge flag leave MongoDB
+        projected = FIELDS + ("discharged",)
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+            {"$project": {
+                "operationType": 1,
+                "documentKey": 1,
+                **{f"fullDocument.{f}": 1 for f in projected},
+                **{f"updateDescription.updatedFields.{f}": 1 for f in projected},
+            }},
+        ]
+        resume_token = None
+        while not self._stop.is_set():
+            try:
+                with coll.watch(pipeline, resume_after=resume_token, max_await_time_ms=1000) as stream:
+                    self.watching = True
+                    logger.info("Queue feed following the change stream", extra={"collection": coll.full_name})
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self.apply_change(change)
+                        resume_token = stream.resume_token
+            except OperationFailure as e:
+                self.watching = False
+                if e.code == _CHANGE_STREAM_UNSUPPORTED and SOURCE == "auto":
+                    logger.info("Change streams unsupported (not a replica set); queue feed uses local writes")
+                    return
+                logger.warning("Queue feed change stream failed", extra={"error": str(e)})
+                if resume_token is not None:
+                    # The token may be past the oplog window; start fresh and have clients reload
+                    resume_token = None
+                    self.resync()
+            except PyMongoError as e:
+                self.watching = False
+                logger.warning("Queue feed change stream interrupted", extra={"error": str(e)})
+            self._stop.wait(WATCH_RETRY_SECONDS)
+        self.watching = False
+
+
+FEED = QueueFeed()
@@ -0,0 +1,195 @@
+"""
+Queue order as fractional rank keys (``queue_rank``).
+
+Every waiting patient has a base-62 string key, and the queue is sorted by it
+(then ``_id``). Keys are fractions written as digits, so another key fits
+between any two; `rank_between` picks the shortest one. As a result:
+
+- moving a patient (`move`) rewrites only that patient's key, and concurrent
+  moves by different staff never touch the same documents;
+- a new arrival is slotted by urgency (`arrival_rank`): behind the last
+  waiting patient who is at least as urgent, ahead of everyone less urgent.
+  It costs two reads served by the ``waiting_urgency_rank`` and
+  ``waiting_queue`` indexes.
+
+Repeated inserts at the same spot make keys longer. Once a key is longer than
+``TRIAGE_QUEUE_RANK_MAX_LENGTH``, or a waiting record has no key yet (written
+before ranks existed), `rebalance` re-spaces the whole queue evenly. It
+rewrites only the keys that change, and medical_api runs it in the
+background.
+"""
+
+import os
+import string
+import threading
+from typing import List, Optional, Tuple
+
+from patient_store import WAITING
+from triage_logging import get_logger
+
+logger = get_logger("queue_order")
+
+DIGITS = string.digits + string.ascii_uppercase + string.ascii_lowercase  # ASCII order = sort order
+BASE = len(DIGITS)
+RANK_MAX_LENGTH = int(os.getenv("TRIAGE_QUEUE_RANK_MAX_LENGTH", "6"))
+REBALANCE_SECONDS = float(os.getenv("TRIAGE_QUEUE_REBALANCE_SECONDS", "60"))
+
+_RANKED = {"$type": "string"}
+_long_keys = threading.Event()
+
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    """Shortest digit string strictly between fractions ``a`` and ``b`` (None = 1); neither ends in "0"."""
+    if b is not None:
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else DIGITS[0]) == b[n]:
+            n += 1
+        if n:
+            return b[:n] + _midpoint(a[n:], b[n:])
+    low = DIGITS.index(a[0]) if a else 0
+    high = DIGITS.index(b[0]) if b is not None else BASE
+    if high - low > 1:
+        return DIGITS[(low + high) // 2]
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[low] + _midpoint(a[1:], None)
+
+
+def rank_between(before: Optional[str], after: Optional[str]) -> str:
+    """A key sorting after ``before`` and before ``after`` (None = queue start / end)."""
+    if before is not None and after is not None and not before < after:
+        raise ValueError(f"Rank {before!r} does not sort before {after!r}")
+    return _midpoint(before or "", after)
+
+
+def spaced_ranks(count: int) -> List[str]:
+    """``count`` ascending keys, evenly spaced and as short as possible."""
+    width = 1
+    while BASE ** width <= count:
+        width += 1
+    step = BASE ** width / (count + 1)
+    ranks = []
+    for i in range(1, count + 1):
+        value, digits = int(i * step), []
+        for _ in range(width):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+        ranks.append("".join(reversed(digits)).rstrip(DIGITS[0]))
+    return ranks
+
+
+def _note_length(rank: str) -> str:
+    if len(rank) > RANK_MAX_LENGTH:
+        _long_keys.set()
+    return rank
+
+
+def _neighbour_rank(coll, rank: Optional[str], direction: int, exclude=None) -> Optional[str]:
+    """Rank of the waiting record right after (1) or before (-1) ``rank``; None at the queue's end."""
+    condition = dict(_RANKED)
+    if rank is not None:
+        condition["$gt" if direction > 0 else "$lt"] = rank
+    query = {**WAITING, "queue_rank": condition}
+    if exclude is not None:
+        query["_id"] = {"$ne": exclude}
+    doc = coll.find_one(query, {"queue_rank": 1}, sort=[("queue_rank", direction)])
+    return doc["queue_rank"] if doc else None
+
+
+def arrival_rank(coll, urgency_level: int) -> str:
+    """Key for a new arrival: behind waiting patients of the same or higher urgency (1 = most urgent)."""
+    as_urgent = coll.find_one(
+        # $in rather than $lte: one index range per level, merged in rank order
+        {**WAITING, "urgency_level": {"$in": list(range(1, int(urgency_level) + 1))}, "queue_rank": _RANKED},
+        {"queue_rank": 1},
+        sort=[("queue_rank", -1)],
+    )
+    before = as_urgent["queue_rank"] if as_urgent else None
+    return _note_length(rank_between(before, _neighbour_rank(coll, before, 1)))
+
+
+def move(coll, patient_id, after_id=None, before_id=None, _retry: bool = True) -> Optional[str]:
+    """Place a waiting patient between two others (by id; one may be omitted); writes one document.
+
+    Returns the new key, or None if the patient is not waiting. Raises
+    ValueError if a neighbour is not a waiting patient.
+    """
+    neighbours = [i for i in (after_id, before_id) if i is not None]
+    if not neighbours:
+        raise ValueError("after_id or before_id is required")
+    if patient_id in neighbours:
+        raise ValueError("A patient cannot be placed next to itself")
+    ranks = {
+        doc["_id"]: doc.get("queue_rank")
+        for doc in coll.find({**WAITING, "_id": {"$in": neighbours}}, {"queue_rank": 1})
+    }
+    missing = [str(i) for i in neighbours if i not in ranks]
+    if missing:
+        raise ValueError(f"Not in the waiting queue: {', '.join(missing)}")
+    if any(rank is None for rank in ranks.values()) and _retry:
+        # Records from before rank keys; give the whole queue keys first
+        rebalance(coll)
+        return move(coll, patient_id, after_id, before_id, _retry=False)
+
+    low = ranks.get(after_id)
+    high = ranks.get(before_id)
+    if after_id is not None and (high is None or not low < high):
+        # Only one side given, or the pair changed order meanwhile: the side given first wins
+        high = _neighbour_rank(coll, low, 1, exclude=patient_id)
+    elif after_id is None:
+        low = _neighbour_rank(coll, high, -1, exclude=patient_id)
+    try:
+        rank = rank_between(low, high)
+    except ValueError:
+        if not _retry:
+            raise
+        # Equal keys (concurrent arrivals got the same slot); re-space and retry
+        rebalance(coll)
+        return move(coll, patient_id, after_id, before_id, _retry=False)
+
+    result = coll.update_one({**WAITING, "_id": patient_id}, {"$set": {"queue_rank": rank}})
+    if not result.matched_count:
+        return None
+    return _note_length(rank)
+
+
+def needs_rebalance(coll) -> bool:
+    return _long_keys.is_set() or coll.find_one({**WAITING, "queue_rank": None}, {"_id": 1}) is not None
+
+
+def rebalance(coll) -> List[Tuple[object, str]]:
+    """Re-space every waiting key evenly; returns the (id, key) pairs rewritten.
+
+    Unranked records are slotted by urgency, or keep the dashboard's order
+    (``priority_order``) when nothing is ranked yet. Each write is conditional on the key it replaces, so a record moved
+    meanwhile keeps its move.
+    """
+    from pymongo import UpdateOne
+
+    _long_keys.clear()
+    docs = list(coll.find(WAITING, {"queue_rank": 1, "urgency_level": 1, "priority_order": 1}))
+    ordered = sorted((d for d in docs if isinstance(d.get("queue_rank"), str)), key=lambda d: (d["queue_rank"], d["_id"]))
+    unranked = sorted(
+        (d for d in docs if not isinstance(d.get("queue_rank"), str)),
+        # the dashboard's order: manual positions first, then urgency
+        key=lambda d: (d.get("priority_order") is None, d.get("priority_order") or 0, d.get("urgency_level") or 5, d["_id"]),
+    )
+    if not ordered:
+        # First backfill: keep the dashboard's order as it is
+        ordered, unranked = unranked, []
+    for doc in unranked:
+        urgency = doc.get("urgency_level") or 5
+        slot = 0
+        for i, placed in enumerate(ordered):
+            if (placed.get("urgency_level") or 5) <= urgency:
+                slot = i + 1
+        ordered.insert(slot, doc)
+
+    changes = [(doc, rank) for doc, rank in zip(ordered, spaced_ranks(len(ordered))) if doc.get("queue_rank") != rank]
+    if changes:
+        coll.bulk_write(
+            [UpdateOne({"_id": doc["_id"], "queue_rank": doc.get("queue_rank")}, {"$set": {"queue_rank": rank}}) for doc, rank in changes],
+            ordered=False,
+        )
+    logger.info("Rebalanced queue ranks", extra={"waiting": len(ordered), "rewritten": len(changes)})
+    return [(doc["_id"], rank) for doc, rank in changes]
@@ -0,0 +1,62 @@
+"""
+Serialization shared by API responses and MongoDB documents.
+
+- `dumps`: JSON bytes via orjson (stdlib ``json`` when orjson is missing). Used
+  for NDJSON batch lines, WebSocket frames, SSE events and the cached
+  ``/queue`` bodies.
+- `JSONResponseClass`: default response class of the API and the session
+  router, FastAPI's ``ORJSONResponse`` (plain ``JSONResponse`` without
+  orjson). Session endpoints return it directly with their payload dict, which
+  skips FastAPI's ``jsonable_encoder`` pass; payloads are plain dicts, lists,
+  strings and numbers, and datetimes are written as ISO 8601.
+- MongoDB documents are built from the same plain values (the validated
+  diagnosis, usage entries, timezone-aware datetimes), which pymongo's C
+  encoder writes as BSON directly; `MONGO_CLIENT_OPTIONS` reads datetimes back
+  timezone-aware so they need no fix-up either.
+
+Checkpoints keep LangGraph's own ormsgpack serde (see `build_app`): every
+value the graph checkpoints is already a plain msgpack type, so a custom
+serializer would have nothing to speed up.
+
+``benchmarks/serialization_bench.py`` compares the response path with the
+library default and reports the BSON cost.
+"""
+
+import json
+from typing import Any
+
+import warnings
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# FastAPI steers new code towards response models; these payloads are plain dicts
+warnings.filterwarnings("ignore", message="ORJSONResponse is deprecated")
+
+MONGO_CLIENT_OPTIONS = {"tz_aware": True}
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=_OPTIONS, default=str)
+
+    loads = orjson.loads
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    loads = json.loads
+
+
+def dumps_text(obj: Any) -> str:
+    """`dumps` as text, for WebSocket text frames."""
+    return dumps(obj).decode("utf-8")
+
+
+JSONResponseClass = ORJSONResponse if orjson is not None else JSONResponse
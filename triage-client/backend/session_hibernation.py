@@ -0,0 +1,236 @@
+"""
+Hibernation of idle sessions out of the in-memory checkpointer.
+
+A patient spends tens of seconds reading each question, and meanwhile the
+session's checkpoints, channel blobs and pending writes sit in the heap.
+`HibernatingSaver` is a `MemorySaver` whose `hibernate_idle()` moves every
+session untouched for ``TRIAGE_HIBERNATE_AFTER_SECONDS`` into a local SQLite
+file as one msgpack + zstd blob and drops it from RAM. The next checkpointer
+access for that thread (``/resume``, ``/confirm``, a status read) rehydrates it
+first, so the graph never notices.
+
+Checkpoint values are already serialized by the graph's serde, so hibernation
+only packs bytes; nothing is re-encoded. The store belongs to one process (like
+its sessions), is created on the first hibernation and removed by `close()`.
+zstd comes from the ``zstandard`` package; without it blobs are zlib-compressed.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Set, Tuple
+
+import ormsgpack
+from langgraph.checkpoint.memory import MemorySaver
+
+import metrics
+from triage_logging import get_logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = get_logger("hibernation")
+
+HIBERNATE_AFTER_SECONDS = float(os.getenv("TRIAGE_HIBERNATE_AFTER_SECONDS", "30"))
+HIBERNATE_PATH = os.getenv("TRIAGE_HIBERNATE_PATH", "")
+ZSTD_LEVEL = int(os.getenv("TRIAGE_HIBERNATE_ZSTD_LEVEL", "3"))
+
+
+def _compress(raw: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class HibernatingSaver(MemorySaver):
+    """`MemorySaver` that parks idle threads in SQLite and loads them back on access.
+
+    Every checkpointer operation takes one lock, so a thread is never hibernated
+    halfway through a read or write; the operations themselves are dict updates.
+    """
+
+    def __init__(self, idle_seconds: float = HIBERNATE_AFTER_SECONDS, path: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.idle_seconds = idle_seconds
+        self.path = path or HIBERNATE_PATH or os.path.join(
+            tempfile.gettempdir(), f"triage-hibernate-{os.getpid()}-{id(self):x}.sqlite"
+        )
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_access: Dict[str, float] = {}
+        self._hibernated: Dict[str, int] = {}  # thread_id -> compressed bytes on disk
+        # Keys of each thread's blobs and writes, so hibernating one thread does not scan every session
+        self._blob_keys: Dict[str, Set[tuple]] = {}
+        self._write_keys: Dict[str, Set[tuple]] = {}
+
+    # --- store ---
+
+    def _store(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            # Sessions die with the process anyway; no need to survive a crash
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=OFF")
+            self._db.execute("DROP TABLE IF EXISTS sessions")
+            self._db.execute("CREATE TABLE sessions (thread_id TEXT PRIMARY KEY, codec TEXT NOT NULL, data BLOB NOT NULL)")
+        return self._db
+
+    def close(self):
+        """Drop the on-disk store (hibernated sessions are lost, like resident ones on exit)."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                for suffix in ("", "-wal", "-shm"):
+                    try:
+                        os.remove(self.path + suffix)
+                    except FileNotFoundError:
+                        pass
+            metrics.HIBERNATED_SESSIONS.dec(len(self._hibernated))
+            metrics.HIBERNATED_BYTES.dec(sum(self._hibernated.values()))
+            self._hibernated.clear()
+
+    @property
+    def hibernated_count(self) -> int:
+        return len(self._hibernated)
+
+    # --- hibernate / rehydrate ---
+
+    def hibernate_idle(self, now: Optional[float] = None) -> int:
+        """Hibernate every resident thread idle for ``idle_seconds``; returns how many moved."""
+        cutoff = (time.monotonic() if now is None else now) - self.idle_seconds
+        with self._lock:
+            idle = [t for t, at in self._last_access.items() if at <= cutoff and t not in self._hibernated]
+        moved = 0
+        for thread_id in idle:
+            # One thread per lock hold so requests for other sessions are not held up by a long sweep
+            with self._lock:
+                at = self._last_access.get(thread_id)
+                if at is None or at > cutoff or thread_id in self._hibernated:
+                    continue
+                self._hibernate(thread_id)
+                moved += 1
+        if moved:
+            logger.debug("Hibernated idle sessions", extra={"sessions": moved, "hibernated": len(self._hibernated)})
+        return moved
+
+    def _hibernate(self, thread_id: str):
+        start = time.perf_counter()
+        checkpoints = [
+            [ns, checkpoint_id, checkpoint, metadata, parent]
+            for ns, entries in self.storage.pop(thread_id, {}).items()
+            for checkpoint_id, (checkpoint, metadata, parent) in entries.items()
+        ]
+        blobs = [
+            [key[1], key[2], key[3], *self.blobs.pop(key)]
+            for key in self._blob_keys.pop(thread_id, ())
+            if key in self.blobs
+        ]
+        writes = [
+            [key[1], key[2], [[inner[0], inner[1], *value] for inner, value in self.writes.pop(key).items()]]
+            for key in self._write_keys.pop(thread_id, ())
+            if key in self.writes
+        ]
+        codec, data = _compress(ormsgpack.packb([checkpoints, blobs, writes]))
+        self._store().execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (thread_id, codec, data))
+        self._hibernated[thread_id] = len(data)
+        metrics.HIBERNATED_SESSIONS.inc()
+        metrics.HIBERNATED_BYTES.inc(len(data))
+        metrics.SESSION_HIBERNATE_LATENCY.observe(time.perf_counter() - start)
+
+    def _rehydrate(self, thread_id: str):
+        start = time.perf_counter()
+        db = self._store()
+        row = db.execute("SELECT codec, data FROM sessions WHERE thread_id = ?", (thread_id,)).fetchone()
+        db.execute("DELETE FROM sessions WHERE thread_id = ?", (thread_id,))
+        size = self._hibernated.pop(thread_id)
+        metrics.HIBERNATED_SESSIONS.dec()
+        metrics.HIBERNATED_BYTES.dec(size)
+        if row is None:
+            return
+        checkpoints, blobs, writes = ormsgpack.unpackb(_decompress(*row))
+        for ns, checkpoint_id, checkpoint, metadata, parent in checkpoints:
+            self.storage[thread_id][ns][checkpoint_id] = (tuple(checkpoint), tuple(metadata), parent)
+        blob_keys = self._blob_keys.setdefault(thread_id, set())
+        for ns, channel, version, value_type, value in blobs:
+            key = (thread_id, ns, channel, version)
+            self.blobs[key] = (value_type, value)
+            blob_keys.add(key)
+        write_keys = self._write_keys.setdefault(thread_id, set())
+        for ns, checkpoint_id, entries in writes:
+            key = (thread_id, ns, checkpoint_id)
+            self.writes[key] = {
+                (inner_task, inner_idx): (task_id, channel, tuple(value), task_path)
+                for inner_task, inner_idx, task_id, channel, value, task_path in entries
+            }
+            write_keys.add(key)
+        metrics.SESSION_REHYDRATE_LATENCY.observe(time.perf_counter() - start)
+
+    def _touch(self, thread_id: str):
+        """Make ``thread_id`` resident and mark it used. Caller holds the lock."""
+        if thread_id in self._hibernated:
+            self._rehydrate(thread_id)
+        self._last_access[thread_id] = time.monotonic()
+
+    # --- checkpointer API (the async variants delegate to these) ---
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def get_delta_channel_history(self, *, config, channels):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_delta_channel_history(config=config, channels=channels)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            else:
+                # Listing every thread is a debugging path; bring them all back
+                for thread_id in list(self._hibernated):
+                    self._touch(thread_id)
+            items = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from items
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            self._touch(thread_id)
+            keys = self._blob_keys.setdefault(thread_id, set())
+            keys.update((thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items())
+            return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        with self._lock:
+            self._touch(thread_id)
+            self._write_keys.setdefault(thread_id, set()).add(key)
+            return super().put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            if thread_id in self._hibernated:
+                self._store().execute("DELETE FROM sessions WHERE thread_id = ?", (thread_id,))
+                size = self._hibernated.pop(thread_id)
+                metrics.HIBERNATED_SESSIONS.dec()
+                metrics.HIBERNATED_BYTES.dec(size)
+            self._last_access.pop(thread_id, None)
+            self._blob_keys.pop(thread_id, None)
+            self._write_keys.pop(thread_id, None)
+            super().delete_thread(thread_id)
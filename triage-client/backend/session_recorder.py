@@ -0,0 +1,82 @@
+"""
+Opt-in interview recorder producing replay fixtures.
+
+Set ``TRIAGE_RECORD_DIR`` and every session handled by the API is appended to
+``<dir>/<thread_id>.jsonl``: API steps with their inputs and results, and every
+model response in call order (including responses from interrupt replays),
+captured by `llm_callbacks.RecordingCallback`.
+`benchmarks/replay_bench.py` replays these files against `build_app()` with
+the model served from the recording.
+
+Fixture format (one JSON object per line):
+- ``{"event": "session", "format": 1, "thread_id": ..., "recorded_at": ..., "stop_gain_threshold": ..., "interview_trees": ..., "duplicate_question_similarity": ...}``
+  (the question_gain threshold, interview tree version and duplicate_questions
+  threshold the session ran under; absent means none)
+- ``{"event": "model", "node": "agent" | "final_output", "message": <message_to_dict>}``
+- ``{"event": "step", "step": "start" | "resume" | "confirm", "input": {...}, "result": {...}}``
+
+Recordings contain patient data; keep them out of version control unless synthetic.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+
+FIXTURE_FORMAT = 1
+
+_lock = threading.Lock()
+
+
+def record_dir() -> Optional[str]:
+    return os.getenv("TRIAGE_RECORD_DIR") or None
+
+
+def recording_enabled() -> bool:
+    return record_dir() is not None
+
+
+def _fixture_path(directory: str, thread_id: str) -> str:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in thread_id)
+    return os.path.join(directory, f"{safe}.jsonl")
+
+
+def begin_session(thread_id: str):
+    """Start (or restart) the fixture for a session; called before its first graph step."""
+    directory = record_dir()
+    if not directory:
+        return
+    import duplicate_questions
+    import interview_trees
+    import question_gain
+
+    trees = interview_trees.load_configured()
+    header = {
+        "event": "session",
+        "format": FIXTURE_FORMAT,
+        "thread_id": thread_id,
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "stop_gain_threshold": question_gain.GAIN_THRESHOLD,
+        "interview_trees": trees.version if trees is not None else None,
+        "duplicate_question_similarity": duplicate_questions.SIMILARITY_THRESHOLD,
+    }
+    with _lock:
+        os.makedirs(directory, exist_ok=True)
+        with open(_fixture_path(directory, thread_id), "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+
+
+def record(thread_id: Optional[str], event: dict):
+    """Append one event to the session's fixture file (no-op unless recording is enabled)."""
+    directory = record_dir()
+    if not directory or not thread_id:
+        return
+    with _lock:
+        with open(_fixture_path(directory, thread_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, default=str) + "\n")
+
+
+def record_step(thread_id: str, step: str, inputs: dict, result: dict):
+    record(thread_id, {"event": "step", "step": step, "input": inputs, "result": result})
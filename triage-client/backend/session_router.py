@@ -0,0 +1,439 @@
+"""
+Session-pinning front for multi-worker deployments.
+
+The graph's checkpointer is in-process, so every step of an interview must reach
+the worker that started it. `start_server.py --prod` runs one single-process API
+worker per core on Unix domain sockets and puts this router on the public port.
+It places ``thread_id`` on a consistent-hash ring of workers and forwards the
+request over a pooled keep-alive connection:
+
+- ``POST /start``, ``/resume``, ``/confirm``: ``thread_id`` from the JSON body
+- ``GET /session/{thread_id}/status`` and ``WS /ws/session/{thread_id}``: from the path
+- ``POST /batch/start`` and ``/batch/resume``: split per worker, results merged
+  into one NDJSON stream with the original item indexes
+- ``/shards/{n}/...``: passthrough to worker ``n`` (per-worker ``/metrics``,
+  ``/admin/profiles``)
+- anything else goes to the first live worker; ``/livez`` and ``/readyz`` answer
+  for the router and the whole pool
+
+``/queue`` and ``/queue/stream`` are among "anything else", so one worker
+serves the whole dashboard. Its queue feed sees the other workers' writes only
+through the MongoDB change stream (``TRIAGE_QUEUE_FEED_SOURCE=changestream``,
+which `start_server.py` requires for a pool); a ``local`` feed would stream and
+cache that worker's writes alone.
+
+Workers come from ``TRIAGE_SHARD_URLS``: comma-separated base URLs
+(``http://127.0.0.1:8001``) or socket paths (``unix:/run/triage/worker-0.sock``).
+
+Rebalancing: the router probes every worker's ``/livez`` each
+``TRIAGE_ROUTER_HEALTH_INTERVAL_SECONDS`` (and immediately when a connection
+fails). A down worker leaves the ring, so only its share of ``thread_id`` values
+moves to the next worker on the ring; the rest stay put. Sessions started on a
+stand-in worker are remembered in an affinity table, so when the worker comes
+back (the launcher restarts it) they finish where they started while new
+sessions hash to it again. Sessions held by a worker that crashed are lost with
+its in-memory checkpointer.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+
+import httpx
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
+
+import serialization
+from triage_logging import configure_logging, get_logger
+
+configure_logging()
+logger = get_logger("router")
+
+FORWARD_TIMEOUT_SECONDS = float(os.getenv("TRIAGE_ROUTER_TIMEOUT_SECONDS", "120"))
+MAX_CONNECTIONS_PER_SHARD = int(os.getenv("TRIAGE_ROUTER_MAX_CONNECTIONS", "256"))
+HEALTH_INTERVAL_SECONDS = float(os.getenv("TRIAGE_ROUTER_HEALTH_INTERVAL_SECONDS", "1"))
+# Points per worker on the ring; more points even out the split between workers
+VIRTUAL_NODES = int(os.getenv("TRIAGE_ROUTER_VNODES", "160"))
+MAX_AFFINITY_ENTRIES = int(os.getenv("TRIAGE_ROUTER_AFFINITY_SIZE", "100000"))
+
+BODY_ROUTED = {"/start", "/resume", "/confirm"}
+BATCH_ROUTES = {"/batch/start", "/batch/resume"}
+# Hop-by-hop and recomputed headers are not forwarded
+_SKIP_HEADERS = {"host", "content-length", "connection", "keep-alive", "transfer-encoding", "upgrade"}
+
+
+def _shard_urls() -> List[str]:
+    urls = [u.strip().rstrip("/") for u in os.getenv("TRIAGE_SHARD_URLS", "").split(",") if u.strip()]
+    if not urls:
+        raise RuntimeError("TRIAGE_SHARD_URLS is not set; start the router through start_server.py --prod")
+    return urls
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring of worker indexes with virtual nodes.
+
+    ``owner`` is the worker a key maps to with every worker up; ``route`` skips
+    workers that are down, which only moves the keys the down worker owned.
+    """
+
+    def __init__(self, workers: int, vnodes: int = VIRTUAL_NODES):
+        self.workers = workers
+        self.vnodes = vnodes
+        self.live: Set[int] = set(range(workers))
+        self._full = self._build(self.live)
+        self._ring = self._full
+
+    def _build(self, members) -> tuple:
+        points = sorted((_hash(f"worker-{m}#{v}"), m) for m in members for v in range(self.vnodes))
+        return [p for p, _ in points], [m for _, m in points]
+
+    @staticmethod
+    def _lookup(ring: tuple, key: str) -> Optional[int]:
+        hashes, owners = ring
+        if not hashes:
+            return None
+        return owners[bisect.bisect(hashes, _hash(key)) % len(hashes)]
+
+    def owner(self, key: str) -> int:
+        return self._lookup(self._full, key)
+
+    def route(self, key: str) -> Optional[int]:
+        """Live worker for ``key``; None when no worker is up."""
+        return self._lookup(self._ring, key)
+
+    def set_live(self, live: Set[int]) -> bool:
+        """Update membership; returns True when the ring changed."""
+        if live == self.live:
+            return False
+        self.live = set(live)
+        self._ring = self._build(self.live)
+        return True
+
+
+class ShardMap:
+    """Routes a ``thread_id`` to a worker: affinity for sessions placed during an outage, else the ring."""
+
+    def __init__(self, urls: List[str]):
+        self.urls = urls
+        self.ring = HashRing(len(urls))
+        self._affinity: "OrderedDict[str, int]" = OrderedDict()
+
+    def shard_for(self, thread_id: str) -> Optional[int]:
+        pinned = self._affinity.get(thread_id)
+        if pinned is not None:
+            if pinned in self.ring.live:
+                self._affinity.move_to_end(thread_id)
+                return pinned
+            del self._affinity[thread_id]
+        shard = self.ring.route(thread_id)
+        if shard is not None and shard != self.ring.owner(thread_id):
+            # Placed on a stand-in; keep it there when the owner comes back
+            self._affinity[thread_id] = shard
+            if len(self._affinity) > MAX_AFFINITY_ENTRIES:
+                self._affinity.popitem(last=False)
+        return shard
+
+    def mark(self, shard: int, live: bool) -> bool:
+        members = self.ring.live | {shard} if live else self.ring.live - {shard}
+        changed = self.ring.set_live(members)
+        if changed:
+            logger.warning("Worker back, rebalanced" if live else "Worker down, rebalanced",
+                           extra={"shard": shard, "live_workers": len(members)})
+        return changed
+
+    def default_shard(self) -> Optional[int]:
+        """Target for requests without a session: the first live worker."""
+        return min(self.ring.live) if self.ring.live else None
+
+
+def _socket_path(url: str) -> Optional[str]:
+    return url[len("unix:"):] if url.startswith("unix:") else None
+
+
+def _new_client(url: str) -> httpx.AsyncClient:
+    """Keep-alive pool to one worker, over its Unix socket when it has one."""
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS_PER_SHARD, max_keepalive_connections=MAX_CONNECTIONS_PER_SHARD)
+    timeout = httpx.Timeout(FORWARD_TIMEOUT_SECONDS, connect=5.0)
+    path = _socket_path(url)
+    if path:
+        transport = httpx.AsyncHTTPTransport(uds=path, limits=limits)
+        return httpx.AsyncClient(transport=transport, base_url="http://worker", timeout=timeout)
+    return httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout)
+
+
+_shards: Optional[ShardMap] = None
+_clients: List[httpx.AsyncClient] = []
+
+
+async def _probe_live(shard: int) -> bool:
+    try:
+        response = await _clients[shard].get("/livez", timeout=2.0)
+        return response.status_code == 200
+    except httpx.HTTPError:
+        return False
+
+
+async def _health_loop():
+    while True:
+        results = await asyncio.gather(*(_probe_live(i) for i in range(len(_clients))))
+        for shard, live in enumerate(results):
+            _shards.mark(shard, live)
+        await asyncio.sleep(HEALTH_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global _shards, _clients
+    _shards = ShardMap(_shard_urls())
+    _clients = [_new_client(url) for url in _shards.urls]
+    health = asyncio.create_task(_health_loop())
+    logger.info("Session router started", extra={"shards": len(_shards.urls)})
+    try:
+        yield
+    finally:
+        health.cancel()
+        await asyncio.gather(*(client.aclose() for client in _clients))
+
+
+app = FastAPI(
+    title="Medical Diagnosis API (session router)",
+    lifespan=lifespan,
+    docs_url=None,
+    redoc_url=None,
+    default_response_class=serialization.JSONResponseClass,
+)
+
+
+def _error(status_code: int, message: str) -> Response:
+    return serialization.JSONResponseClass({"type": "error", "error": message, "status": "error"}, status_code=status_code)
+
+
+def _forward_headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in _SKIP_HEADERS}
+
+
+def _unavailable() -> Response:
+    return _error(503, "No session workers available")
+
+
+async def _forward(request: Request, shard: int, path: str, body: bytes, thread_id: Optional[str] = None) -> Response:
+    """Stream the worker's response back.
+
+    A connection that could not be opened never reached the worker, so the
+    request is retried once on the worker the ring now picks for it.
+    """
+    headers = _forward_headers(request.headers)
+    for attempt in range(2):
+        client = _clients[shard]
+        upstream_request = client.build_request(request.method, path, params=request.query_params, headers=headers, content=body)
+        try:
+            upstream = await client.send(upstream_request, stream=True)
+            break
+        except httpx.ConnectError as e:
+            logger.warning("Worker unreachable", extra={"shard": shard, "error": str(e)})
+            _shards.mark(shard, False)
+            retry = None
+            if attempt == 0 and thread_id is not None:
+                retry = _shards.shard_for(thread_id)
+            if retry is None:
+                return _error(502, f"Session worker {shard} unavailable")
+            shard = retry
+        except httpx.HTTPError as e:
+            logger.warning("Worker unreachable", extra={"shard": shard, "error": str(e)})
+            return _error(502, f"Session worker {shard} unavailable")
+
+    async def body_iter():
+        try:
+            async for chunk in upstream.aiter_raw():
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    return StreamingResponse(body_iter(), status_code=upstream.status_code, headers=_forward_headers(upstream.headers))
+
+
+def _thread_id_from_body(body: bytes) -> Optional[str]:
+    try:
+        data = serialization.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    thread_id = data.get("thread_id") if isinstance(data, dict) else None
+    return thread_id if isinstance(thread_id, str) else None
+
+
+async def _stream_shard_batch(path: str, shard: int, items: list, indexes: List[int], headers: dict,
+                              queue: asyncio.Queue):
+    """Forward one worker's share of a batch, re-indexing its NDJSON lines onto the original batch."""
+    answered = set()
+    try:
+        async with _clients[shard].stream(
+            "POST", path, content=serialization.dumps({"sessions": items}),
+            headers={**headers, "content-type": "application/json"},
+        ) as upstream:
+            if upstream.status_code != 200:
+                text = (await upstream.aread()).decode(errors="replace")
+                raise RuntimeError(f"worker {shard} returned {upstream.status_code}: {text[:200]}")
+            async for line in upstream.aiter_lines():
+                if not line.strip():
+                    continue
+                entry = serialization.loads(line)
+                entry["index"] = indexes[entry.get("index", 0)]
+                answered.add(entry["index"])
+                await queue.put(entry)
+    except Exception as e:
+        logger.warning("Batch forward failed", extra={"shard": shard, "error": str(e)})
+        for index in indexes:
+            if index in answered:
+                continue
+            await queue.put({"index": index, "type": "error", "error": f"Session worker {shard} unavailable", "status": "error"})
+    finally:
+        await queue.put(None)
+
+
+async def _forward_batch(request: Request, path: str, body: bytes) -> Response:
+    try:
+        sessions = serialization.loads(body).get("sessions")
+    except (ValueError, UnicodeDecodeError, AttributeError):
+        sessions = None
+    default = _shards.default_shard()
+    if default is None:
+        return _unavailable()
+    if not isinstance(sessions, list):
+        # Let a worker produce the usual validation error
+        return await _forward(request, default, path, body)
+
+    groups: Dict[int, tuple] = {}
+    for index, item in enumerate(sessions):
+        thread_id = item.get("thread_id") if isinstance(item, dict) else None
+        shard = _shards.shard_for(thread_id) if isinstance(thread_id, str) else default
+        if shard is None:
+            return _unavailable()
+        groups.setdefault(shard, ([], []))
+        groups[shard][0].append(item)
+        groups[shard][1].append(index)
+
+    headers = {k: v for k, v in _forward_headers(request.headers).items() if k.lower() != "content-type"}
+    queue: asyncio.Queue = asyncio.Queue()
+    tasks = [
+        asyncio.create_task(_stream_shard_batch(path, shard, items, indexes, headers, queue))
+        for shard, (items, indexes) in groups.items()
+    ]
+
+    async def merged():
+        pending = len(tasks)
+        try:
+            while pending:
+                entry = await queue.get()
+                if entry is None:
+                    pending -= 1
+                    continue
+                yield serialization.dumps(entry) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(merged(), media_type="application/x-ndjson")
+
+
+@app.get("/livez")
+async def liveness():
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+async def readiness():
+    """Ready when every worker is ready; 503 with each worker's status otherwise."""
+    async def probe(shard: int):
+        try:
+            response = await _clients[shard].get("/readyz", timeout=5.0)
+            return {"shard": shard, "status": response.json().get("status", "unknown"), "ready": response.status_code == 200}
+        except (httpx.HTTPError, ValueError) as e:
+            return {"shard": shard, "status": "unreachable", "ready": False, "error": str(e)}
+
+    workers = await asyncio.gather(*(probe(i) for i in range(len(_clients))))
+    ready = all(w["ready"] for w in workers)
+    return serialization.JSONResponseClass({"status": "ready" if ready else "not_ready", "workers": workers}, status_code=200 if ready else 503)
+
+
+@app.websocket("/ws/session/{thread_id}")
+async def websocket_session(websocket: WebSocket, thread_id: str):
+    """Bridge the socket to the worker that owns the session."""
+    import websockets
+
+    shard = _shards.shard_for(thread_id)
+    await websocket.accept()
+    if shard is None:
+        await websocket.send_text(serialization.dumps_text({"type": "error", "error": "No session workers available", "status": "error"}))
+        await websocket.close(code=1013)
+        return
+    url = _shards.urls[shard]
+    path = _socket_path(url)
+    try:
+        if path:
+            upstream = await websockets.unix_connect(path, f"ws://worker/ws/session/{thread_id}", max_size=None)
+        else:
+            upstream_url = url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+            upstream = await websockets.connect(f"{upstream_url}/ws/session/{thread_id}", max_size=None)
+    except Exception as e:
+        logger.warning("Worker unreachable", extra={"shard": shard, "error": str(e)})
+        await websocket.send_text(serialization.dumps_text({"type": "error", "error": f"Session worker {shard} unavailable", "status": "error"}))
+        await websocket.close(code=1011)
+        return
+
+    async def client_to_worker():
+        try:
+            while True:
+                await upstream.send(await websocket.receive_text())
+        except WebSocketDisconnect:
+            pass
+
+    async def worker_to_client():
+        async for message in upstream:
+            await websocket.send_text(message if isinstance(message, str) else message.decode())
+
+    tasks = [asyncio.create_task(client_to_worker()), asyncio.create_task(worker_to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await upstream.close()
+        if upstream.close_code is not None:
+            try:
+                await websocket.close(code=upstream.close_code)
+            except RuntimeError:
+                pass
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+async def route(request: Request, path: str):
+    path = "/" + path
+    body = await request.body()
+
+    if path.startswith("/shards/"):
+        _, _, rest = path.partition("/shards/")
+        shard_str, _, sub_path = rest.partition("/")
+        if not shard_str.isdigit() or int(shard_str) >= len(_shards.urls):
+            return _error(404, f"No worker {shard_str}")
+        return await _forward(request, int(shard_str), "/" + sub_path, body)
+
+    if path in BATCH_ROUTES and request.method == "POST":
+        return await _forward_batch(request, path, body)
+
+    thread_id = None
+    if path in BODY_ROUTED:
+        thread_id = _thread_id_from_body(body)
+    elif path.startswith("/session/") and path.endswith("/status"):
+        thread_id = path[len("/session/"):-len("/status")]
+    shard = _shards.shard_for(thread_id) if thread_id else _shards.default_shard()
+    if shard is None:
+        return _unavailable()
+    return await _forward(request, shard, path, body, thread_id)
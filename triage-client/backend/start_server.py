@@ -1,65 +1,355 @@
 """
 Startup script for the Medical Diagnosis API server.
+
+Development (default): one uvicorn process with auto-reload.
+
+Production (``--prod``): a self-check first (exits non-zero on a missing package,
+missing configuration, or a dependency that fails to warm up), then one
+worker per core with uvloop/httptools when installed, connection and backlog
+limits, and graceful shutdown that lets in-flight interview steps finish.
+
+Sessions live in each worker's in-process checkpointer, so by default the
+workers are separate processes on Unix domain sockets (loopback ports where
+those are unavailable, or with ``--worker-base-port``) behind
+`session_router.py`, which pins every ``thread_id`` to one worker on a
+consistent-hash ring. A worker that dies is restarted; the router moves only
+its sessions while it is down. ``--no-pin-sessions`` runs plain
+``uvicorn --workers N`` instead; only use it with a shared checkpointer.
+
+With more than one worker the queue feed must follow the MongoDB change
+stream, since ``/queue`` and ``/queue/stream`` are served by one worker: the
+launcher sets ``TRIAGE_QUEUE_FEED_SOURCE=changestream``, refuses ``local``,
+and the self-check fails when the server has no change streams.
 """
 
+import http.client
+import importlib.util
+import json
+import os
+import shutil
+import signal
+import socket
 import subprocess
 import sys
-import os
+import tempfile
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
 
-def check_dependencies():
+def check_dependencies(packages=None):
     """Check if required packages are installed."""
-    required_packages = ['fastapi', 'uvicorn', 'pydantic']
+    required_packages = packages or ['fastapi', 'uvicorn', 'pydantic']
     missing_packages = []
-    
+
     for package in required_packages:
         try:
             __import__(package)
         except ImportError:
             missing_packages.append(package)
-    
+
     if missing_packages:
         print(f"Missing required packages: {', '.join(missing_packages)}")
         print("Install them with:")
         print(f"   pip install {' '.join(missing_packages)}")
         return False
-    
+
+    return True
+
+
+def self_check(pin_sessions: bool, env: dict = None) -> bool:
+    """Production startup check: packages, configuration, and a full warmup in a scratch process."""
+    # Module name -> pip package
+    packages = {
+        "fastapi": "fastapi", "uvicorn": "uvicorn", "pydantic": "pydantic", "dotenv": "python-dotenv",
+        "langgraph": "langgraph", "langchain_openai": "langchain-openai", "httpx": "httpx",
+        "prometheus_client": "prometheus-client",
+    }
+    if os.getenv("TRIAGE_MONGO_URI") or os.getenv("MONGO_URI"):
+        packages["pymongo"] = "pymongo"
+    if pin_sessions:
+        packages["websockets"] = "websockets"
+    missing = [pip for module, pip in packages.items() if importlib.util.find_spec(module) is None]
+    if missing:
+        print(f"Missing required packages: {', '.join(missing)}")
+        print(f"   pip install {' '.join(missing)}")
+        return False
+
+    for module in ("uvloop", "httptools"):
+        if importlib.util.find_spec(module) is None:
+            print(f"Note: {module} is not installed; falling back to the default implementation "
+                  f"(pip install 'uvicorn[standard]' for better throughput)")
+
+    # Warm every dependency exactly as a worker would; reads .env like the app does
+    probe = "import json, medical_api; print(json.dumps(medical_api.warmup()))"
+    env = dict(env or os.environ, TRIAGE_LOG_LEVEL="WARNING")
+    proc = subprocess.run([sys.executable, "-c", probe], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print("Self-check failed: the API module could not be imported")
+        print(proc.stderr.strip()[-2000:])
+        return False
+    components = json.loads(proc.stdout.strip().splitlines()[-1])
+    failed = {name: entry for name, entry in components.items() if entry["status"] == "failed"}
+    for name, entry in components.items():
+        detail = f" ({entry['error']})" if entry.get("error") else ""
+        print(f"  {name:6s} {entry['status']}{detail}")
+    if failed:
+        print(f"Self-check failed: {', '.join(failed)} not reachable")
+        return False
     return True
 
+
 def start_server(port=8000, reload=True):
     """Start the FastAPI server."""
     if not check_dependencies():
         sys.exit(1)
-    
+
     print("Starting Medical Diagnosis API Server...")
     print(f"Server will be available at: http://localhost:{port}")
-    print("API documentation at: http://localhost:{port}/docs")
-    print("Interactive docs at: http://localhost:{port}/redoc")
+    print(f"API documentation at: http://localhost:{port}/docs")
+    print(f"Interactive docs at: http://localhost:{port}/redoc")
     print("\n" + "="*50)
-    
+
     cmd = [
-        sys.executable, "-m", "uvicorn", 
-        "medical_api:app", 
+        sys.executable, "-m", "uvicorn",
+        "medical_api:app",
         "--port", str(port),
         "--host", "0.0.0.0"
     ]
-    
+
     if reload:
         cmd.append("--reload")
-    
+
     try:
-        subprocess.run(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run(cmd, cwd=BACKEND_DIR)
     except KeyboardInterrupt:
         print("\n👋 Server stopped by user")
     except Exception as e:
         print(f"Error starting server: {e}")
 
+
+def _uvicorn_args(args) -> list:
+    """Tuning flags shared by workers and the router."""
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return [
+        "--loop", loop,
+        "--http", http,
+        "--backlog", str(args.backlog),
+        "--limit-concurrency", str(args.limit_concurrency),
+        "--timeout-keep-alive", str(args.timeout_keep_alive),
+        "--timeout-graceful-shutdown", str(args.graceful_timeout),
+        "--no-access-log",
+    ]
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def _is_live(url: str) -> bool:
+    try:
+        if url.startswith("unix:"):
+            conn = _UnixHTTPConnection(url[len("unix:"):], timeout=1)
+            try:
+                conn.request("GET", "/livez")
+                return conn.getresponse().status == 200
+            finally:
+                conn.close()
+        with urllib.request.urlopen(f"{url}/livez", timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def _wait_until_live(url: str, proc: subprocess.Popen, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        if _is_live(url):
+            return True
+        time.sleep(0.2)
+    return False
+
+
+class _Child:
+    """A supervised process; ``restart`` children are relaunched when they die."""
+
+    def __init__(self, name: str, cmd: list, env: dict, restart: bool = False, socket_path: str = None):
+        self.name = name
+        self.cmd = cmd
+        self.env = env
+        self.restart = restart
+        self.socket_path = socket_path
+        self.proc = None
+        self.restarts = 0
+        self.started_at = 0.0
+        self.next_start = 0.0
+
+    def start(self):
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.proc = subprocess.Popen(self.cmd, cwd=BACKEND_DIR, env=self.env)
+        self.started_at = time.monotonic()
+
+
+def _supervise(children: list, graceful_timeout: float) -> int:
+    """Wait for the children, restarting the restartable ones with backoff.
+
+    On SIGTERM/SIGINT, or when a child that is not restartable exits, stop them
+    all gracefully (in list order).
+    """
+    stopping = False
+
+    def request_stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    exit_code = 0
+    while not stopping:
+        now = time.monotonic()
+        for child in children:
+            if child.proc is None:
+                if now >= child.next_start:
+                    print(f"Restarting {child.name} (restart {child.restarts})")
+                    child.start()
+                continue
+            if child.proc.poll() is None:
+                continue
+            if not child.restart:
+                print(f"{child.name} exited with code {child.proc.returncode}; shutting down")
+                exit_code = child.proc.returncode or 1
+                stopping = True
+                break
+            # Back off 1s, 2s, 4s ... 30s so a worker that cannot start does not spin
+            if now - child.started_at > 60:
+                child.restarts = 0
+            delay = min(30.0, 2.0 ** child.restarts)
+            print(f"{child.name} exited with code {child.proc.returncode}; restarting in {delay:.0f}s")
+            child.restarts += 1
+            child.proc = None
+            child.next_start = now + delay
+        else:
+            time.sleep(0.5)
+
+    _stop_all(children, graceful_timeout)
+    return exit_code
+
+
+def _stop_all(children: list, graceful_timeout: float):
+    """SIGTERM in list order (router first so it stops taking requests), then wait; kill stragglers."""
+    running = [child.proc for child in children if child.proc is not None]
+    for proc in running:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+    deadline = time.monotonic() + graceful_timeout + 5
+    for proc in running:
+        try:
+            proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def start_production(args):
+    """Run the production worker pool (see module docstring)."""
+    pin_sessions = not args.no_pin_sessions
+    workers = args.workers or os.cpu_count() or 1
+    # Uvicorn waits up to --timeout-graceful-shutdown for requests, then the app drains graph steps
+    env = dict(os.environ, TRIAGE_DRAIN_TIMEOUT_SECONDS=str(args.graceful_timeout))
+    if workers > 1:
+        # /queue and /queue/stream reach one worker, which must see every worker's writes
+        feed_source = env.get("TRIAGE_QUEUE_FEED_SOURCE", "auto").strip().lower()
+        if feed_source == "local":
+            print("TRIAGE_QUEUE_FEED_SOURCE=local only sees one worker's writes; "
+                  "use changestream (a MongoDB replica set) or --workers 1")
+            sys.exit(1)
+        env["TRIAGE_QUEUE_FEED_SOURCE"] = "changestream"
+
+    print("Running startup self-check...")
+    if not self_check(pin_sessions, env):
+        sys.exit(1)
+
+    tuning = _uvicorn_args(args)
+
+    print(f"Starting Medical Diagnosis API ({workers} workers, {tuning[1]}/{tuning[3]}) on http://{args.host}:{args.port}")
+    if not pin_sessions:
+        cmd = [sys.executable, "-m", "uvicorn", "medical_api:app", "--host", args.host, "--port", str(args.port),
+               "--workers", str(workers), *tuning]
+        uvicorn = _Child("uvicorn", cmd, env)
+        uvicorn.start()
+        sys.exit(_supervise([uvicorn], args.graceful_timeout))
+
+    use_sockets = hasattr(socket, "AF_UNIX") and not args.worker_base_port
+    socket_dir = tempfile.mkdtemp(prefix="triage-workers-") if use_sockets else None
+    base_port = args.worker_base_port or args.port + 1
+    urls, worker_children = [], []
+    for i in range(workers):
+        if use_sockets:
+            path = os.path.join(socket_dir, f"worker-{i}.sock")
+            bind, url, name = ["--uds", path], f"unix:{path}", f"worker {i}"
+        else:
+            path = None
+            bind, url, name = ["--host", "127.0.0.1", "--port", str(base_port + i)], f"http://127.0.0.1:{base_port + i}", f"worker {i} (:{base_port + i})"
+        cmd = [sys.executable, "-m", "uvicorn", "medical_api:app", *bind, *tuning]
+        child = _Child(name, cmd, env, restart=True, socket_path=path)
+        child.start()
+        worker_children.append(child)
+        urls.append(url)
+
+    try:
+        for url, child in zip(urls, worker_children):
+            if not _wait_until_live(url, child.proc, timeout=60):
+                print(f"{child.name} did not come up")
+                _stop_all(worker_children, 0)
+                sys.exit(1)
+
+        router_env = dict(env, TRIAGE_SHARD_URLS=",".join(urls))
+        cmd = [sys.executable, "-m", "uvicorn", "session_router:app", "--host", args.host, "--port", str(args.port), *tuning]
+        router = _Child("router", cmd, router_env)
+        router.start()
+        exit_code = _supervise([router, *worker_children], args.graceful_timeout)
+    finally:
+        if socket_dir:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+    sys.exit(exit_code)
+
+
 if __name__ == "__main__":
     import argparse
-    
+
     parser = argparse.ArgumentParser(description="Start Medical Diagnosis API Server")
     parser.add_argument("--port", "-p", type=int, default=8000, help="Port to run server on")
     parser.add_argument("--no-reload", action="store_true", help="Disable auto-reload")
-    
+    prod = parser.add_argument_group("production")
+    prod.add_argument("--prod", action="store_true", help="Self-check, then run the production worker pool")
+    prod.add_argument("--host", default="0.0.0.0")
+    prod.add_argument("--workers", "-w", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")),
+                      help="Worker processes (default: CPU count)")
+    prod.add_argument("--backlog", type=int, default=2048, help="Pending TCP connections per listener")
+    prod.add_argument("--limit-concurrency", type=int, default=1000,
+                      help="Concurrent connections per process before answering 503")
+    prod.add_argument("--timeout-keep-alive", type=int, default=15, help="Idle keep-alive seconds")
+    prod.add_argument("--graceful-timeout", type=int, default=30,
+                      help="Seconds to let in-flight requests and graph steps finish on shutdown")
+    prod.add_argument("--no-pin-sessions", action="store_true",
+                      help="Plain uvicorn workers without thread_id pinning (needs a shared checkpointer)")
+    prod.add_argument("--worker-base-port", type=int, default=0, help="Run pinned workers on loopback ports from this one instead of Unix sockets")
+
     args = parser.parse_args()
-    
-    start_server(port=args.port, reload=not args.no_reload)
\ No newline at end of file
+
+    if args.prod:
+        start_production(args)
+    else:
+        start_server(port=args.port, reload=not args.no_reload)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules are flat files next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TRIAGE_LOG_LEVEL", "WARNING")
+
+
+@pytest.fixture
+def interview():
+    """run(app, thread_id, symptoms, answer="Moderate") -> final state values, confirming at the end."""
+    from langgraph.types import Command
+
+    import transcript
+
+    def run(app, thread_id, symptoms, answer="Moderate", medical_records=""):
+        config = {"configurable": {"thread_id": thread_id}}
+        app.invoke({"symptoms": symptoms, "medical_records": medical_records}, config=config)
+        for _ in range(50):
+            snapshot = app.get_state(config)
+            if not snapshot.interrupts:
+                return snapshot.values
+            pending = snapshot.interrupts[0].value
+            if isinstance(pending, dict) and "query" in pending:
+                row = transcript.answer_row(answer, pending=pending)
+                app.invoke(Command(resume=answer, update={"transcript": [row]}), config=config)
+            else:
+                app.invoke(Command(resume="yes"), config=config)
+        raise AssertionError("interview did not finish")
+
+    return run
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """medical_api driving a graph on the fake model, with no MongoDB and no recording."""
+    import fake_llm
+    import interview_trees
+    import langgraph_model_medical
+    import medical_api
+
+    for name in ("TRIAGE_MONGO_URI", "MONGO_URI", "TRIAGE_RECORD_DIR"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(langgraph_model_medical, "CHAT_MODEL_FACTORY", lambda model=None, **kwargs: fake_llm.FakeTriageChatModel(**kwargs))
+    monkeypatch.setattr(interview_trees, "TREES", None)
+    monkeypatch.setattr(medical_api, "_graph", None)
+    monkeypatch.setattr(medical_api, "_mongo_client", None)
+    return medical_api
@@ -0,0 +1,63 @@
+"""NDJSON batch intake on the fake model (no MongoDB, no server process)."""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import medical_api
+import transcript
+
+
+@pytest.fixture
+def client(api):
+    # Not entered as a context manager: the lifespan warmup and background loops are not needed
+    return TestClient(api.app)
+
+
+def _lines(response):
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text.endswith("\n")
+    return sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+
+
+def test_batch_start_streams_one_line_per_session(client):
+    sessions = [{"thread_id": f"batch-{i}", "symptoms": ["cough", "fever"]} for i in range(3)]
+
+    lines = _lines(client.post("/batch/start", json={"sessions": sessions}))
+
+    assert [(line["index"], line["thread_id"]) for line in lines] == [(0, "batch-0"), (1, "batch-1"), (2, "batch-2")]
+    assert all(line["type"] == "question" and line["query"] for line in lines)
+
+
+def test_batch_resume_answers_each_pending_question(client):
+    started = _lines(client.post("/batch/start", json={"sessions": [{"thread_id": "resume-a", "symptoms": ["headache"]}, {"thread_id": "resume-b", "symptoms": ["rash"]}]}))
+    answers = [{"thread_id": line["thread_id"], "response": "Moderate", "question": line["query"]} for line in started]
+
+    lines = _lines(client.post("/batch/resume", json={"sessions": answers}))
+
+    assert [line["thread_id"] for line in lines] == ["resume-a", "resume-b"]
+    assert all(line["type"] in ("question", "confirm") for line in lines)
+    state = medical_api.get_graph().get_state({"configurable": {"thread_id": "resume-a"}}).values
+    assert transcript.qa_pairs(state)[0] == (started[0]["query"], "Moderate")
+
+
+def test_a_malformed_item_fails_alone(client):
+    sessions = [{"thread_id": "ok", "symptoms": ["cough"]}, {"thread_id": "no-symptoms"}, "not a session"]
+
+    lines = _lines(client.post("/batch/start", json={"sessions": sessions}))
+
+    assert lines[0]["type"] == "question"
+    assert (lines[1]["thread_id"], lines[1]["type"]) == ("no-symptoms", "error")
+    assert lines[1]["error"].startswith("Invalid session")
+    assert (lines[2]["thread_id"], lines[2]["type"]) == (None, "error")
+
+
+def test_a_failing_session_becomes_an_error_line():
+    def fails(req):
+        raise RuntimeError("model unavailable")
+
+    line = medical_api._batch_item(4, {"thread_id": "t", "symptoms": ["cough"]}, medical_api.StartRequest, "start", fails)
+
+    assert line == {"index": 4, "thread_id": "t", "type": "error", "error": "Failed to start diagnosis: model unavailable", "status": "error"}
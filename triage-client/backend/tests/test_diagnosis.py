@@ -0,0 +1,102 @@
+"""Final diagnosis replies that do not validate: one retry, then a marked fallback."""
+
+import json
+
+import pytest
+from pydantic import PrivateAttr
+
+import diagnosis_schema
+import fake_llm
+import interview_trees
+import langgraph_model_medical
+import medical_api
+import question_gain
+
+REFUSAL = "I'm sorry, but I can't help with that."
+
+
+class ScriptedDiagnosisModel(fake_llm.FakeTriageChatModel):
+    """The fake model, with the diagnosis replies taken from a list (None = the fake's own)."""
+
+    _replies: list = PrivateAttr(default_factory=list)
+
+    def _diagnosis_text(self, messages):
+        reply = self._replies.pop(0) if self._replies else None
+        return super()._diagnosis_text(messages) if reply is None else reply
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    replies = []
+
+    def factory(model=None, **kwargs):
+        fake = ScriptedDiagnosisModel(**kwargs)
+        fake._replies = replies
+        return fake
+
+    monkeypatch.setattr(langgraph_model_medical, "CHAT_MODEL_FACTORY", factory)
+    monkeypatch.setattr(question_gain, "GAIN_THRESHOLD", 0.0)
+    monkeypatch.setattr(interview_trees, "TREES", None)
+    return langgraph_model_medical.build_app(), replies
+
+
+def _truncated():
+    return fake_llm.FakeTriageChatModel()._diagnosis_text([])[:120]
+
+
+def _off_schema():
+    payload = json.loads(fake_llm.FakeTriageChatModel()._diagnosis_text([]))
+    payload["urgency_level"] = "high"
+    return json.dumps(payload)
+
+
+def test_fake_diagnosis_validates():
+    parsed = diagnosis_schema.parse(fake_llm.FakeTriageChatModel()._diagnosis_text([]))
+    assert parsed["urgency_level_text"] == diagnosis_schema.URGENCY_TEXT[parsed["urgency_level"]]
+
+
+@pytest.mark.parametrize("bad_reply", [REFUSAL, "", _truncated(), _off_schema()], ids=["refusal", "empty", "truncated", "off-schema"])
+def test_one_bad_reply_is_retried(graph, interview, bad_reply):
+    app, replies = graph
+    replies.extend([bad_reply, None])
+
+    values = interview(app, "retry", ["cough", "sore throat"])
+
+    assert "validated" not in values["diagnosis"]
+    assert values["diagnosis"]["differential_diagnosis"]
+    assert replies == []
+
+
+@pytest.mark.parametrize("bad_reply", [REFUSAL, _truncated(), _off_schema()], ids=["refusal", "truncated", "off-schema"])
+def test_repeated_bad_replies_fall_back_to_the_provisional_urgency(graph, interview, bad_reply):
+    app, replies = graph
+    replies.extend([bad_reply, bad_reply])
+
+    values = interview(app, "fallback", ["chest pain", "shortness of breath"])
+
+    diagnosis = values["diagnosis"]
+    assert diagnosis["validated"] is False
+    assert diagnosis["raw_text"] == bad_reply
+    assert diagnosis["differential_diagnosis"] == []
+    assert diagnosis["urgency_level"] == values["provisional_urgency"]
+    assert diagnosis["urgency_level_text"] == diagnosis_schema.URGENCY_TEXT[diagnosis["urgency_level"]]
+
+    # The fallback still makes a queue record, flagged for review
+    doc = medical_api._patient_document("fallback", values, diagnosis)
+    assert doc["validated"] is False
+    assert doc["urgency_level"] == diagnosis["urgency_level"]
+
+
+def test_fallback_without_an_estimate_is_moderate():
+    diagnosis = diagnosis_schema.unvalidated(REFUSAL)
+    assert (diagnosis["urgency_level"], diagnosis["urgency_level_text"]) == (3, "Moderate")
+
+
+def test_age_from_the_history_reaches_the_patient_record(graph, interview):
+    app, _ = graph
+
+    values = interview(app, "age", ["chest pain"], medical_records="58-year-old male, hypertension")
+
+    assert values["diagnosis"]["age"] == 58
+    assert medical_api._patient_document("age", values, values["diagnosis"])["age"] == 58
+    assert "age" not in medical_api._patient_document("no-age", values, {**values["diagnosis"], "age": None})
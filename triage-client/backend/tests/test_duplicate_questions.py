@@ -0,0 +1,88 @@
+"""Near-duplicate questions: the similarity check, and what agent_node asks instead."""
+
+import pytest
+from langchain_core.messages import AIMessage
+from pydantic import PrivateAttr
+
+import duplicate_questions
+import fake_llm
+import interview_trees
+import langgraph_model_medical
+import transcript
+
+
+@pytest.mark.parametrize(
+    "asked, candidate",
+    [
+        ("When did it start?", "How long have you had this?"),
+        ("How severe is the pain?", "Rate the intensity of your pain"),
+        ("What makes it better or worse?", "Does anything make it worse?"),
+        ("Any medications?", "What medicines are you on?"),
+    ],
+)
+def test_paraphrases_are_duplicates(asked, candidate):
+    duplicate = duplicate_questions.find_duplicate(candidate, ["Any fever?", asked])
+    assert duplicate is not None
+    assert (duplicate.index, duplicate.question) == (1, asked)
+
+
+@pytest.mark.parametrize(
+    "asked, candidate",
+    [
+        ("When did it start?", "How severe is it?"),
+        ("Do you have a fever?", "Do you have a rash?"),
+        ("What makes it better or worse?", "Any other symptoms along with it?"),
+    ],
+)
+def test_different_questions_are_not(asked, candidate):
+    assert duplicate_questions.find_duplicate(candidate, [asked]) is None
+
+
+def test_the_closest_match_wins_and_zero_turns_the_check_off():
+    asked = ["When did the cough begin?", "When did it start?"]
+    assert duplicate_questions.find_duplicate("When did it start?", asked).index == 1
+    assert duplicate_questions.find_duplicate("When did it start?", asked, threshold=0) is None
+    assert duplicate_questions.find_duplicate("", asked) is None
+
+
+class RepeatingModel(fake_llm.FakeTriageChatModel):
+    """Asks when it started, then keeps proposing the same question in other words."""
+
+    _proposals: list = PrivateAttr(default_factory=list)
+
+    def _agent_message(self, messages, tool_names):
+        asked = self._questions_asked(messages)
+        query = "When did it start?" if asked == 0 else "How long have you had this?"
+        self._proposals.append(query)
+        call = {"name": "ask_user_for_input", "args": {"query": query, "question_type": "open_ended"}, "id": f"call_{len(self._proposals)}", "type": "tool_call"}
+        return AIMessage(content="", tool_calls=[call])
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(langgraph_model_medical, "CHAT_MODEL_FACTORY", lambda model=None, **kwargs: RepeatingModel(**kwargs))
+    monkeypatch.setattr(interview_trees, "TREES", None)
+    return langgraph_model_medical.build_app()
+
+
+def test_a_second_repeat_asks_the_next_open_area_instead_of_finishing(app, interview):
+    values = interview(app, "repeats", ["cough"])
+
+    asked = transcript.questions_asked(values)
+    assert asked == [
+        "When did it start?",
+        langgraph_model_medical.AREA_QUESTIONS["severity"],
+        langgraph_model_medical.AREA_QUESTIONS["associated_symptoms"],
+    ]
+    # Then agent_node's own criteria (3 questions, severity covered) end the interview
+    assert values["diagnosis"]["differential_diagnosis"]
+
+
+def test_the_fallback_question_skips_answered_areas():
+    state = {"symptoms": ["cough"], "transcript": [transcript.question_row("How severe is it right now?", "7")]}
+    asked = transcript.questions_asked(state)
+
+    params = langgraph_model_medical._open_area_question(state, ["severity", "triggers"], asked)
+
+    # severity is covered; timing is question_gain's first open essential area
+    assert params == {"query": langgraph_model_medical.AREA_QUESTIONS["timing"], "question_type": "open_ended"}
@@ -0,0 +1,66 @@
+"""Interrupt replays with the fake model make the same tool call as the original call."""
+
+import pytest
+from langgraph.types import Command
+from pydantic import PrivateAttr
+
+import duplicate_questions
+import fake_llm
+import interview_trees
+import langgraph_model_medical
+import question_gain
+import transcript
+
+
+class RecordingFakeModel(fake_llm.FakeTriageChatModel):
+    _calls: list = PrivateAttr(default_factory=list)
+
+    def _respond(self, messages, tool_names):
+        message = super()._respond(messages, tool_names)
+        if tool_names:
+            self._calls.append(message.tool_calls[0])
+        return message
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    calls = []
+
+    def factory(model=None, **kwargs):
+        fake = RecordingFakeModel(**kwargs)
+        fake._calls = calls
+        return fake
+
+    monkeypatch.setattr(langgraph_model_medical, "CHAT_MODEL_FACTORY", factory)
+    # Only the model decides when the interview ends
+    monkeypatch.setattr(question_gain, "GAIN_THRESHOLD", 0.0)
+    monkeypatch.setattr(duplicate_questions, "SIMILARITY_THRESHOLD", 0.0)
+    monkeypatch.setattr(interview_trees, "TREES", None)
+    return langgraph_model_medical.build_app(), calls
+
+
+@pytest.mark.parametrize("symptoms, medical_records", [
+    (["headache", "neck stiffness"], ""),
+    (["chest pain", "shortness of breath"], "58-year-old male, hypertension"),
+])
+def test_replayed_agent_call_repeats_the_interrupted_tool_call(graph, symptoms, medical_records):
+    app, calls = graph
+    config = {"configurable": {"thread_id": f"replay-{symptoms[0]}"}}
+    app.invoke({"symptoms": symptoms, "medical_records": medical_records}, config=config)
+
+    resumed = 0
+    while True:
+        snapshot = app.get_state(config)
+        pending = next((i.value for i in snapshot.interrupts if isinstance(i.value, dict) and "query" in i.value), None)
+        if pending is None:
+            break
+        interrupted = calls[-1]
+        before = len(calls)
+        # As medical_api does: the resume stores the answer before the node replays
+        row = transcript.answer_row("Moderate", pending=pending)
+        app.invoke(Command(resume="Moderate", update={"transcript": [row]}), config=config)
+        replayed = calls[before]
+        assert (replayed["name"], replayed["args"], replayed["id"]) == (interrupted["name"], interrupted["args"], interrupted["id"])
+        resumed += 1
+
+    assert resumed >= 3
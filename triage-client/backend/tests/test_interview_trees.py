@@ -0,0 +1,98 @@
+"""Mining interview trees from recorded sessions, and serving them back."""
+
+import pytest
+
+import interview_trees
+import transcript
+
+
+@pytest.fixture
+def record(api, tmp_path, monkeypatch):
+    """record(thread_id, symptoms, answers, finish=True): one session through the API, recorded under tmp_path."""
+    monkeypatch.setenv("TRIAGE_RECORD_DIR", str(tmp_path))
+
+    def run(thread_id, symptoms, answers, finish=True):
+        payload = api._run_start(thread_id, symptoms)
+        for answer in answers:
+            if payload["type"] != "question":
+                break
+            payload = api._run_resume(thread_id, answer, pending=payload)
+        if finish:
+            assert payload["type"] == "confirm"
+            api._run_confirm(thread_id, True)
+        return tmp_path / f"{thread_id}.jsonl"
+
+    return run
+
+
+def _session(questions, answers, key="cough|fever", completed=True):
+    return key, [({"query": q, "options": None, "question_type": "open_ended"}, a) for q, a in zip(questions, answers)], completed
+
+
+def test_recorded_interviews_reads_questions_answers_and_completion(record):
+    key, turns, completed = interview_trees.recorded_interviews(record("done", ["Fever", "cough "], ["Moderate"] * 5))
+
+    assert key == "cough|fever"
+    assert completed is True
+    assert len(turns) == 3
+    assert [answer for _, answer in turns] == ["Moderate"] * 3
+    assert all(set(question) == {"query", "options", "question_type"} for question, _ in turns)
+
+    key, turns, completed = interview_trees.recorded_interviews(record("abandoned", ["cough", "fever"], ["Moderate"], finish=False))
+    assert (key, len(turns), completed) == ("cough|fever", 1, False)
+
+
+def test_mined_trees_replay_the_recorded_interview(record):
+    sessions = [interview_trees.recorded_interviews(record(f"s{i}", ["cough", "fever"], ["Moderate"] * 5)) for i in range(5)]
+    _, turns, _ = sessions[0]
+
+    trees = interview_trees.mine(sessions, min_support=5, min_agreement=0.8)
+    loaded = interview_trees.InterviewTrees(interview_trees.build_artifact(trees, len(sessions), 5, 0.8))
+
+    assert list(trees) == ["cough|fever"]
+    assert all(interview_trees.served_steps(trees, *session) == len(turns) + 1 for session in sessions)
+    state = {"symptoms": ["fever", "cough"], "transcript": []}
+    for question, answer in turns:
+        assert loaded.next_question(state) == question
+        assert not loaded.completes(state)
+        state["transcript"].append(transcript.answer_row(answer, pending=question))
+    assert loaded.next_question(state) is None
+    assert loaded.completes(state)
+
+
+def test_a_history_is_a_separate_complaint():
+    assert interview_trees.complaint_key(["Cough", "fever", ""]) == "cough|fever"
+    assert interview_trees.complaint_key(["cough"], "58-year-old male, hypertension") == "cough +history"
+
+
+def test_each_answer_gets_its_own_branch():
+    sessions = [_session(["Q1", "Q2"], ["yes", "x"]) for _ in range(5)] + [_session(["Q1", "Q3"], ["No", "x"]) for _ in range(5)]
+
+    root = interview_trees.mine(sessions, min_support=5, min_agreement=0.8)["cough|fever"]
+
+    assert (root["support"], root["question"]["query"]) == (10, "Q1")
+    assert root["answers"]["yes"]["question"]["query"] == "Q2"
+    assert root["answers"]["no"]["question"]["query"] == "Q3"
+    assert root["answers"]["no"]["answers"]["x"] == {"support": 5, "complete": True}
+
+
+def test_nodes_without_support_or_agreement_are_pruned():
+    agreeing = [_session(["Q1", "Q2"], ["yes", "x"]) for _ in range(4)]
+
+    assert interview_trees.mine(agreeing, min_support=5, min_agreement=0.8) == {}
+
+    split = agreeing + [_session(["Q1", "Q9"], ["yes", "x"])]
+    root = interview_trees.mine(split, min_support=5, min_agreement=0.8)["cough|fever"]
+    # 4 of 5 agree on Q2 after "yes", but only 4 sessions reach it
+    assert root["answers"]["yes"] == {"support": 5, "question": {"query": "Q2", "options": None, "question_type": "open_ended"}, "answers": {}}
+
+    assert interview_trees.mine(split, min_support=5, min_agreement=0.9)["cough|fever"]["answers"] == {}
+
+
+def test_an_unfinished_session_ends_its_path_without_a_complete_leaf():
+    sessions = [_session(["Q1"], ["yes"]) for _ in range(5)] + [_session(["Q1"], ["yes"], completed=False) for _ in range(5)]
+
+    root = interview_trees.mine(sessions, min_support=5, min_agreement=0.8)["cough|fever"]
+
+    assert root["support"] == 10
+    assert root["answers"]["yes"] == {"support": 5, "complete": True}
@@ -0,0 +1,110 @@
+"""The /metrics exposition and the request-latency middleware, without a server."""
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+import pytest
+
+import metrics
+
+
+def _scrape():
+    return metrics.render().decode()
+
+
+def test_exposition_has_help_type_and_buckets():
+    metrics.LLM_TOKENS.labels("test-node", "test-model", "prompt").inc(3)
+    metrics.QUESTIONS_PER_SESSION.observe(4)
+
+    text = _scrape()
+
+    assert "# TYPE triage_llm_tokens_total counter" in text
+    assert 'triage_llm_tokens_total{kind="prompt",model="test-model",node="test-node"} 3.0' in text
+    assert "# HELP triage_questions_per_session" in text
+    assert 'triage_questions_per_session_bucket{le="+Inf"}' in text
+    assert "_created" not in text
+    assert metrics.CONTENT_TYPE.startswith("text/plain")
+
+
+def test_computed_gauge_reports_nan_when_its_source_fails():
+    def broken():
+        raise RuntimeError("saver unavailable")
+
+    metrics.computed_gauge("triage_test_broken_gauge", "A gauge whose source raises.", broken)
+
+    assert "triage_test_broken_gauge NaN" in _scrape()
+
+
+def test_middleware_reuses_one_child_per_route_and_method():
+    class Route:
+        path = "/test/{thread_id}"
+
+    async def endpoint(scope, receive, send):
+        pass
+
+    middleware = metrics.RequestMetricsMiddleware(endpoint)
+    for _ in range(3):
+        asyncio.run(middleware({"type": "http", "method": "POST", "route": Route()}, None, None))
+
+    child = middleware._child("/test/{thread_id}", "POST")
+    assert child is middleware._child("/test/{thread_id}", "POST")
+    assert child is not middleware._child("/test/{thread_id}", "GET")
+    assert 'triage_http_request_duration_seconds_count{endpoint="/test/{thread_id}",method="POST"} 3.0' in _scrape()
+
+
+def _questions_observed():
+    return metrics.REGISTRY.get_sample_value("triage_questions_per_session_count")
+
+
+def _interview(api, thread_id):
+    payload = api._run_start(thread_id, ["cough", "sore throat"])
+    while payload["type"] == "question":
+        assert api._active_session_count() == 1
+        payload = api._run_resume(thread_id, "Moderate", pending=payload)
+    assert payload["type"] == "confirm"
+    return api._run_confirm(thread_id, True, "Test Patient")
+
+
+@pytest.fixture
+def sessions(api, monkeypatch):
+    monkeypatch.setattr(api, "_open_sessions", OrderedDict())
+    return api
+
+
+def test_a_session_is_active_until_its_first_diagnosis(sessions):
+    api = sessions
+    before = _questions_observed()
+
+    assert _interview(api, "active")["type"] == "diagnosis"
+    assert api._active_session_count() == 0
+    assert _questions_observed() == before + 1
+
+    # A repeated /confirm returns the diagnosis again without counting the session twice
+    assert api._run_confirm("active", True, "Test Patient")["type"] == "diagnosis"
+    assert api._active_session_count() == 0
+    assert _questions_observed() == before + 1
+
+
+def test_an_abandoned_session_expires(sessions, monkeypatch):
+    api = sessions
+    api._run_start("abandoned", ["headache"])
+    api._run_start("answering", ["cough"])
+    assert api._active_session_count() == 2
+
+    monkeypatch.setattr(api, "ACTIVE_SESSION_IDLE_SECONDS", 60)
+    api._open_sessions["abandoned"] -= 120
+
+    assert api._active_session_count() == 1
+    assert list(api._open_sessions) == ["answering"]
+
+
+def test_a_failed_record_push_is_logged(sessions, monkeypatch, caplog):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("store unavailable")
+
+    monkeypatch.setattr(sessions, "_push_patient_record", unavailable)
+    with caplog.at_level(logging.ERROR):
+        assert _interview(sessions, "push-fails")["type"] == "diagnosis"
+
+    assert "Error recording final diagnosis" in caplog.text
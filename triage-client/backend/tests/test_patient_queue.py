@@ -0,0 +1,65 @@
+"""Queue position of a provisional entry once its final record is written (needs MongoDB)."""
+
+import os
+import uuid
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+import patient_store
+import queue_order
+
+MONGO_URI = os.getenv("TRIAGE_TEST_MONGO_URI")
+
+
+@pytest.fixture
+def coll():
+    if not MONGO_URI:
+        pytest.skip("TRIAGE_TEST_MONGO_URI is not set")
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    db = client[f"triage_test_{uuid.uuid4().hex[:8]}"]
+    coll = db[patient_store.COLLECTION]
+    patient_store.ensure_indexes(coll)
+    yield coll
+    client.drop_database(db.name)
+    client.close()
+
+
+def _final(thread_id, level, text):
+    return {"thread_id": thread_id, "name": thread_id, "urgency_level": level, "urgency_level_text": text, "provisional": False}
+
+
+def _confirm(coll, doc):
+    return patient_store.upsert_patient(coll, doc, rank=queue_order.arrival_rank(coll, doc["urgency_level"]))
+
+
+def _queue(coll):
+    rows, _ = patient_store.queue_page(coll, limit=50)
+    return [row["thread_id"] for row in rows]
+
+
+def test_final_emergency_moves_a_provisional_routine_entry_up(coll):
+    for i in range(3):
+        _confirm(coll, _final(f"routine-{i}", 5, "Routine"))
+    provisional = {"symptoms": "cough", "urgency_level": 5, "urgency_level_text": "Routine", "provisional_reasons": []}
+    patient_store.upsert_provisional(coll, "late", provisional, rank=queue_order.arrival_rank(coll, 5))
+    assert _queue(coll) == ["routine-0", "routine-1", "routine-2", "late"]
+
+    _confirm(coll, _final("late", 1, "Emergency"))
+
+    assert _queue(coll) == ["late", "routine-0", "routine-1", "routine-2"]
+    record = coll.find_one({"thread_id": "late"})
+    assert record["provisional"] is False
+    assert "provisional_reasons" not in record
+
+
+def test_final_write_never_moves_a_record_down(coll):
+    _confirm(coll, _final("first", 5, "Routine"))
+    _confirm(coll, _final("second", 1, "Emergency"))
+    assert _queue(coll) == ["second", "first"]
+
+    # A lower final urgency would slot it behind "first"; it keeps its place
+    _confirm(coll, _final("second", 5, "Routine"))
+
+    assert _queue(coll) == ["second", "first"]
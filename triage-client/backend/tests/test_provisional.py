@@ -0,0 +1,166 @@
+"""Provisional urgency and its queue entry, without MongoDB.
+
+The writes are checked against a collection double that records the update
+documents; the queue behaviour on a real server is in test_patient_queue.py.
+"""
+
+import threading
+
+import pytest
+
+import diagnosis_schema
+import medical_api
+import patient_store
+import transcript
+import urgency_score
+
+errors = pytest.importorskip("pymongo.errors")
+
+
+def _turns(*rows):
+    return [transcript.Turn.from_row(row) for row in rows]
+
+
+def _answer(question, answer):
+    return transcript.question_row(question, answer)
+
+
+@pytest.mark.parametrize(
+    "symptoms, rows, records, level, reasons",
+    [
+        (["itchy skin"], [], None, 4, ["itch"]),
+        (["coughing up blood"], [], None, 1, ["coughing up blood"]),
+        (["cough"], [_answer("Is it getting worse?", "yes")], None, 3, ["getting worse", "cough"]),
+        (["cough"], [_answer("Is it getting worse?", "yes")], "history of heart disease", 2, ["getting worse", "cough", "history: heart"]),
+        (["itchy skin"], [_answer("Any chest pain?", "yes")], None, 2, ["chest pain"]),
+        (["itchy skin"], [_answer("Any chest pain?", "no")], None, 4, ["itch"]),
+        (["itchy skin"], [transcript.confirm_row("Any chest pain?", "yes")], None, 4, ["itch"]),
+        ([], [], "diabetes", 5, []),
+    ],
+    ids=["symptom", "red-flag", "escalator", "escalator-and-history", "yes-counts-the-question", "no-counts-nothing", "confirm-ignored", "routine"],
+)
+def test_estimate(symptoms, rows, records, level, reasons):
+    estimate = urgency_score.estimate(symptoms, _turns(*rows), records)
+    assert (estimate.level, estimate.reasons) == (level, reasons)
+    assert estimate.text == diagnosis_schema.URGENCY_TEXT[level]
+
+
+def test_only_a_red_flag_reaches_emergency():
+    rows = [_answer("Is it getting worse?", "yes"), _answer("Rate the pain", "10/10"), _answer("Was it sudden?", "yes")]
+    estimate = urgency_score.estimate(["fever"], _turns(*rows), "heart failure, on warfarin")
+    assert estimate.level == 2
+    assert len(estimate.reasons) <= 3
+
+
+class RecordingCollection:
+    """Records find_one_and_update / update_one calls; optionally raises a duplicate key."""
+
+    def __init__(self, duplicate=False):
+        self.calls = []
+        self.duplicate = duplicate
+
+    def find_one_and_update(self, query, update, **kwargs):
+        self.calls.append((query, update, kwargs))
+        if self.duplicate:
+            raise errors.DuplicateKeyError("E11000 duplicate key error")
+        return {"thread_id": query["thread_id"], **update["$set"]}
+
+    def update_one(self, query, update, upsert=False):
+        self.calls.append((query, update, {"upsert": upsert}))
+
+
+FIELDS = {"symptoms": "cough", "urgency_level": 4, "urgency_level_text": "Low", "provisional_reasons": ["cough"]}
+
+
+def test_provisional_upsert_never_matches_the_final_record():
+    coll = RecordingCollection()
+
+    entry = patient_store.upsert_provisional(coll, "t-1", FIELDS, rank="V")
+
+    query, update, options = coll.calls[0]
+    assert query == {"thread_id": "t-1", "provisional": {"$ne": False}}
+    assert update["$set"] == {**FIELDS, "provisional": True}
+    assert update["$setOnInsert"]["name"] == "t-1"
+    assert update["$setOnInsert"]["discharged"] is False
+    assert update["$min"] == {"queue_rank": "V"}
+    assert options["upsert"] is True
+    assert set(options["projection"]) == set(patient_store.QUEUE_FIELDS)
+    assert entry["provisional"] is True
+
+
+def test_falling_risk_keeps_the_queue_position():
+    coll = RecordingCollection()
+    patient_store.upsert_provisional(coll, "t-1", FIELDS)
+    assert "$min" not in coll.calls[0][1]
+
+
+def test_a_final_record_stops_provisional_writes():
+    # The unique thread_id index rejects the upsert once provisional is False
+    assert patient_store.upsert_provisional(RecordingCollection(duplicate=True), "t-1", FIELDS, rank="V") is None
+
+
+def test_the_final_record_drops_the_provisional_fields():
+    coll = RecordingCollection()
+    patient_store.upsert_patient(coll, {"thread_id": "t-1", "urgency_level": 1, "provisional": False}, rank="1")
+
+    query, update, options = coll.calls[0]
+    assert query == {"thread_id": "t-1"}
+    assert update["$unset"] == {field: "" for field in patient_store.PROVISIONAL_ONLY_FIELDS}
+    assert update["$min"] == {"queue_rank": "1"}
+    assert options == {"upsert": True}
+
+
+class Executor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    executor = Executor()
+    monkeypatch.setattr(medical_api, "_provisional_executor", executor)
+    monkeypatch.setattr(medical_api, "_provisional_ready", threading.Event())
+    monkeypatch.setattr(medical_api, "_mongo_client", object())
+    return executor
+
+
+def _queue(thread_id, level, previous):
+    estimate = urgency_score.Estimate(level, ["cough"])
+    medical_api._queue_provisional(thread_id, estimate, previous, {"symptoms": ["cough", "fever"]})
+
+
+def test_no_provisional_writes_before_the_unique_index(sink):
+    _queue("t-1", 4, None)
+    assert sink.submitted == []
+
+    medical_api._provisional_ready.set()
+    _queue("t-1", 4, None)
+    _queue("t-1", 2, 4)
+    _queue("t-1", 3, 2)
+
+    assert [(thread_id, fields["symptoms"], rising) for thread_id, fields, rising in sink.submitted] == [
+        ("t-1", "cough, fever", True), ("t-1", "cough, fever", True), ("t-1", "cough, fever", False)
+    ]
+
+
+@pytest.mark.parametrize("built, ready", [([patient_store.THREAD_ID_INDEX, "waiting_queue"], True), (["waiting_queue"], False)])
+def test_the_mongo_warmup_enables_provisional_writes_with_the_index(sink, monkeypatch, built, ready):
+    class Client:
+        class admin:
+            @staticmethod
+            def command(name):
+                return {"ok": 1}
+
+        def __getitem__(self, name):
+            return {patient_store.COLLECTION: object()}
+
+    monkeypatch.setattr(medical_api, "_get_mongo_client", Client)
+    monkeypatch.setattr(patient_store, "ensure_indexes", lambda coll: built)
+    monkeypatch.setattr(medical_api.queue_feed.FEED, "start_watching", lambda coll: None)
+
+    medical_api._warm_mongo()
+
+    assert medical_api._provisional_ready.is_set() is ready
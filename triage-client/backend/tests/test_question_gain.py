@@ -0,0 +1,64 @@
+"""Adaptive stopping: when question_gain.settled ends the questioning."""
+
+import pytest
+
+import question_gain
+import transcript
+
+COVERING = [
+    ("How severe is the pain on a scale of 1 to 10?", "4"),
+    ("When did it start?", "Yesterday"),
+    ("Do you have any other symptoms along with it?", "no"),
+]
+
+
+def _state(answers, symptoms=("cough",), medical_records=""):
+    rows = [transcript.question_row(question, answer) for question, answer in answers]
+    return {"symptoms": list(symptoms), "medical_records": medical_records, "transcript": rows}
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(question_gain, "GAIN_THRESHOLD", 0.12)
+    monkeypatch.setattr(question_gain, "MIN_QUESTIONS", 3)
+
+
+def test_off_by_default():
+    assert question_gain.GAIN_THRESHOLD == 0
+    assert question_gain.MIN_QUESTIONS == 3
+    assert question_gain.settled(_state(COVERING)) is None
+
+
+def test_settles_once_the_essential_areas_are_covered(enabled):
+    gain = question_gain.settled(_state(COVERING))
+    assert gain is not None
+    assert gain.value == 0 and gain.open_areas == []
+
+
+def test_never_settles_before_the_minimum(enabled, monkeypatch):
+    monkeypatch.setattr(question_gain, "MIN_QUESTIONS", 4)
+    assert question_gain.settled(_state(COVERING)) is None
+
+
+def test_open_areas_keep_the_interview_going(enabled):
+    answers = [("How severe is it?", "4"), ("Is it severe at night?", "no"), ("Rate the intensity", "4")]
+    gain = question_gain.expected_gain(_state(answers))
+    assert gain.open_areas == ["timing", "associated_symptoms"]
+    assert question_gain.settled(_state(answers)) is None
+
+
+def test_history_is_an_essential_area_only_with_a_history():
+    history = "58-year-old male, hypertension, on lisinopril"
+    assert question_gain.expected_gain(_state(COVERING)).open_areas == []
+    assert question_gain.expected_gain(_state(COVERING, medical_records=history)).open_areas == ["history_correlation"]
+    with_history = COVERING + [("Is this related to any condition or medication you take?", "no")]
+    assert question_gain.expected_gain(_state(with_history, medical_records=history)).open_areas == []
+
+
+def test_emergency_gets_no_shorter_interview(enabled):
+    answers = [("How severe is it?", "4"), ("Is the pain bad?", "yes"), ("Rate the intensity", "4")]
+    emergency = _state(answers, symptoms=("coughing up blood",))
+    routine = _state(answers, symptoms=("itchy skin",))
+    assert question_gain.expected_gain(emergency) == question_gain.expected_gain(routine)
+    assert question_gain.expected_gain(emergency).value > 0
+    assert question_gain.settled(emergency) is None
@@ -0,0 +1,86 @@
+"""Rank key arithmetic in queue_order (pure functions, no MongoDB)."""
+
+import random
+
+import pytest
+
+import queue_order
+
+ZERO = queue_order.DIGITS[0]
+
+
+def _check_between(before, after, rank):
+    assert (before or "") < rank
+    assert after is None or rank < after
+    assert not rank.endswith(ZERO)
+
+
+@pytest.mark.parametrize(
+    "before, after, expected",
+    [(None, None, "V"), ("U", None, "k"), (None, "U", "F"), ("U", "V", "UV"), ("1", "2", "1V"), ("UV", "V", "Uk")],
+)
+def test_rank_between_picks_the_shortest_key(before, after, expected):
+    assert queue_order.rank_between(before, after) == expected
+
+
+@pytest.mark.parametrize("before, after", [("V", "V"), ("k", "F")])
+def test_rank_between_rejects_keys_out_of_order(before, after):
+    with pytest.raises(ValueError):
+        queue_order.rank_between(before, after)
+
+
+@pytest.mark.parametrize("where", ["front", "back", "after-first"])
+def test_repeated_inserts_at_one_spot_stay_ordered(where):
+    ranks = ["V"]
+    for _ in range(200):
+        if where == "front":
+            before, after = None, ranks[0]
+        elif where == "back":
+            before, after = ranks[-1], None
+        else:
+            before, after = ranks[0], ranks[1] if len(ranks) > 1 else None
+        rank = queue_order.rank_between(before, after)
+        _check_between(before, after, rank)
+        ranks.append(rank)
+        ranks.sort()
+    assert len(set(ranks)) == len(ranks)
+
+
+def test_random_inserts_keep_every_key_between_its_neighbours():
+    rng = random.Random(46)
+    ranks = []
+    for _ in range(500):
+        slot = rng.randint(0, len(ranks))
+        before = ranks[slot - 1] if slot else None
+        after = ranks[slot] if slot < len(ranks) else None
+        rank = queue_order.rank_between(before, after)
+        _check_between(before, after, rank)
+        ranks.insert(slot, rank)
+    assert ranks == sorted(ranks)
+
+
+@pytest.mark.parametrize("count, width", [(1, 1), (3, 1), (61, 1), (62, 2), (500, 2), (3844, 3)])
+def test_spaced_ranks_are_ascending_and_short(count, width):
+    ranks = queue_order.spaced_ranks(count)
+    assert len(ranks) == count
+    assert ranks == sorted(set(ranks))
+    assert max(len(rank) for rank in ranks) <= width
+    assert not any(rank.endswith(ZERO) for rank in ranks)
+
+
+def test_spaced_ranks_leave_room_at_both_ends():
+    ranks = queue_order.spaced_ranks(10)
+    assert queue_order.rank_between(None, ranks[0]) < ranks[0]
+    assert queue_order.rank_between(ranks[-1], None) > ranks[-1]
+    assert all(len(queue_order.rank_between(a, b)) == 1 for a, b in zip(ranks, ranks[1:]))
+
+
+def test_long_keys_flag_a_rebalance(monkeypatch):
+    monkeypatch.setattr(queue_order, "RANK_MAX_LENGTH", 3)
+    queue_order._long_keys.clear()
+
+    queue_order._note_length("UVW")
+    assert not queue_order._long_keys.is_set()
+    queue_order._note_length("UVWX")
+    assert queue_order._long_keys.is_set()
+    queue_order._long_keys.clear()
@@ -0,0 +1,125 @@
+"""Per-session serialization of graph steps and the idempotency cache (no graph, no server)."""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import medical_api
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(medical_api, "_idempotent_results", OrderedDict())
+
+
+class Step:
+    """A fake step function: counts calls and how many run at once."""
+
+    def __init__(self, payload=None, delay=0.0):
+        self.payload = payload or {"type": "question", "query": "When did it start?"}
+        self.delay = delay
+        self.calls = 0
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, thread_id, *args):
+        with self._lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+        return {**self.payload, "args": list(args)}
+
+
+def _run_concurrently(*calls):
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        futures = [pool.submit(medical_api._run_serialized_step, *call) for call in calls]
+        return [future.result(timeout=5) for future in futures]
+
+
+def test_steps_for_one_session_never_overlap():
+    step = Step(delay=0.05)
+
+    _run_concurrently(*[("one", "resume", None, step, i) for i in range(4)])
+
+    assert (step.calls, step.peak) == (4, 1)
+    assert "one" not in medical_api._session_locks
+
+
+def test_steps_for_different_sessions_run_in_parallel():
+    step = Step(delay=0.1)
+
+    _run_concurrently(("a", "resume", None, step), ("b", "resume", None, step))
+
+    assert step.peak == 2
+
+
+def test_a_repeated_key_replays_the_first_result():
+    step = Step()
+
+    first = medical_api._run_serialized_step("s", "resume", "key-1", step, "Moderate")
+    second = medical_api._run_serialized_step("s", "resume", "key-1", step, "Severe")
+
+    assert first == (step.payload | {"args": ["Moderate"]}, False)
+    assert second == (first[0], True)
+    assert step.calls == 1
+
+
+def test_a_retry_of_an_in_flight_step_waits_and_replays():
+    step = Step(delay=0.1)
+
+    (first, replayed_first), (second, replayed_second) = _run_concurrently(
+        ("s", "confirm", "key-1", step, True), ("s", "confirm", "key-1", step, True)
+    )
+
+    assert step.calls == 1
+    assert first == second
+    assert sorted([replayed_first, replayed_second]) == [False, True]
+
+
+def test_the_key_is_scoped_to_session_and_step():
+    step = Step()
+
+    medical_api._run_serialized_step("s", "resume", "key-1", step)
+    medical_api._run_serialized_step("s", "confirm", "key-1", step)
+    medical_api._run_serialized_step("other", "resume", "key-1", step)
+    medical_api._run_serialized_step("s", "resume", None, step)
+    medical_api._run_serialized_step("s", "resume", None, step)
+
+    assert step.calls == 5
+
+
+def test_errors_are_not_cached():
+    step = Step({"type": "error", "error": "model unavailable", "status": "error"})
+
+    medical_api._run_serialized_step("s", "start", "key-1", step)
+    _, replayed = medical_api._run_serialized_step("s", "start", "key-1", step)
+
+    assert (step.calls, replayed) == (2, False)
+
+
+def test_results_expire_after_the_ttl():
+    step = Step()
+    medical_api._run_serialized_step("s", "resume", "key-1", step)
+    key = ("s", "resume", "key-1")
+    _, payload = medical_api._idempotent_results[key]
+    medical_api._idempotent_results[key] = (time.monotonic() - 1, payload)
+
+    _, replayed = medical_api._run_serialized_step("s", "resume", "key-1", step)
+
+    assert (step.calls, replayed) == (2, False)
+
+
+def test_the_cache_drops_the_oldest_entries_past_its_cap(monkeypatch):
+    monkeypatch.setattr(medical_api, "IDEMPOTENCY_MAX_ENTRIES", 2)
+    for i in range(3):
+        medical_api._idempotent_store(("s", "resume", f"key-{i}"), {"type": "question"})
+
+    assert list(medical_api._idempotent_results) == [("s", "resume", "key-1"), ("s", "resume", "key-2")]
+    assert medical_api._idempotent_lookup(("s", "resume", "key-0")) is None
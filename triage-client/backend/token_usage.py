@@ -0,0 +1,231 @@
+"""
+Per-session token and cost accounting.
+
+Every model call made by a graph node becomes one usage entry (node, model,
+prompt/cached/completion/reasoning tokens, latency). Entries are parked per
+``thread_id`` until the node returns and are then written to ``State["usage"]``,
+so calls that ran before an interrupt (and are repeated when the node replays on
+resume) are still counted. `summarize` turns the entries into the ``usage``
+block stored with the patient record; `aggregate` rolls finished sessions up
+per model and per session for ``GET /usage/summary``.
+
+Prices are USD per 1M tokens. Override or extend them with ``TRIAGE_MODEL_PRICING``,
+e.g. ``{"gpt-4o": {"input": 2.5, "cached_input": 1.25, "output": 10}}``.
+Reasoning tokens are part of the completion count and are billed as output.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_PRICING: Dict[str, dict] = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4.1-mini": {"input": 0.40, "cached_input": 0.10, "output": 1.60},
+    "gpt-4.1": {"input": 2.00, "cached_input": 0.50, "output": 8.00},
+    "o4-mini": {"input": 1.10, "cached_input": 0.275, "output": 4.40},
+}
+
+MAX_PENDING_SESSIONS = 10000
+LEDGER_SIZE = int(os.getenv("TRIAGE_USAGE_LEDGER_SIZE", "5000"))
+
+_pending: "OrderedDict[str, list]" = OrderedDict()
+_pending_lock = threading.Lock()
+
+# Sessions finished by this process, for /usage/summary when Mongo isn't configured
+_ledger: deque = deque(maxlen=LEDGER_SIZE)
+_ledger_lock = threading.Lock()
+
+
+def _load_pricing() -> Dict[str, dict]:
+    pricing = dict(DEFAULT_PRICING)
+    raw = os.getenv("TRIAGE_MODEL_PRICING")
+    if raw:
+        try:
+            pricing.update(json.loads(raw))
+        except (ValueError, TypeError):
+            pass
+    return pricing
+
+
+PRICING = _load_pricing()
+
+
+def price_for(model: str) -> Optional[dict]:
+    """Price table for a model, matching dated snapshots (``gpt-4o-mini-2024-07-18``) by prefix."""
+    if model in PRICING:
+        return PRICING[model]
+    best = None
+    for name in PRICING:
+        if model.startswith(name) and (best is None or len(name) > len(best)):
+            best = name
+    return PRICING[best] if best else None
+
+
+def usage_entry(node: str, model: str, message, latency_s: float) -> dict:
+    """One usage entry from a model response's LangChain ``usage_metadata``."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_details = usage.get("input_token_details") or {}
+    output_details = usage.get("output_token_details") or {}
+    return {
+        "node": node,
+        "model": model,
+        "prompt_tokens": int(usage.get("input_tokens", 0) or 0),
+        "cached_tokens": int(input_details.get("cache_read", 0) or 0),
+        "completion_tokens": int(usage.get("output_tokens", 0) or 0),
+        "reasoning_tokens": int(output_details.get("reasoning", 0) or 0),
+        "latency_ms": round(latency_s * 1000, 2),
+    }
+
+
+def cost_usd(entry: dict) -> Optional[float]:
+    """Cost of one entry, or None when the model has no price."""
+    price = price_for(entry.get("model", ""))
+    if price is None:
+        return None
+    cached = entry.get("cached_tokens", 0)
+    uncached = max(entry.get("prompt_tokens", 0) - cached, 0)
+    cached_price = price.get("cached_input", price.get("input", 0))
+    return (
+        uncached * price.get("input", 0)
+        + cached * cached_price
+        + entry.get("completion_tokens", 0) * price.get("output", 0)
+    ) / 1_000_000
+
+
+def add_pending(thread_id: Optional[str], entry: dict):
+    if not thread_id:
+        return
+    with _pending_lock:
+        entries = _pending.get(thread_id)
+        if entries is None:
+            entries = _pending[thread_id] = []
+            # Sessions abandoned mid-interrupt never drain; drop the oldest
+            while len(_pending) > MAX_PENDING_SESSIONS:
+                _pending.popitem(last=False)
+        entries.append(entry)
+
+
+def drain_pending(thread_id: Optional[str]) -> List[dict]:
+    if not thread_id:
+        return []
+    with _pending_lock:
+        return _pending.pop(thread_id, [])
+
+
+_COUNT_FIELDS = ("prompt_tokens", "cached_tokens", "completion_tokens", "reasoning_tokens")
+
+
+def _empty_totals() -> dict:
+    totals = {field: 0 for field in _COUNT_FIELDS}
+    totals.update({"calls": 0, "latency_ms": 0.0, "cost_usd": 0.0, "unpriced_calls": 0})
+    return totals
+
+
+def _add(totals: dict, entry: dict, cost: Optional[float]):
+    for field in _COUNT_FIELDS:
+        totals[field] += entry.get(field, 0)
+    totals["calls"] += 1
+    totals["latency_ms"] = round(totals["latency_ms"] + entry.get("latency_ms", 0), 2)
+    if cost is None:
+        totals["unpriced_calls"] += 1
+    else:
+        totals["cost_usd"] += cost
+
+
+def _merge(totals: dict, other: dict):
+    for field in _COUNT_FIELDS + ("calls", "unpriced_calls"):
+        totals[field] += other.get(field, 0)
+    totals["latency_ms"] = round(totals["latency_ms"] + other.get("latency_ms", 0), 2)
+    totals["cost_usd"] += other.get("cost_usd", 0.0)
+
+
+def _model_list(by_model: Dict[str, dict]) -> List[dict]:
+    models = []
+    for model, model_totals in sorted(by_model.items(), key=lambda item: item[1]["cost_usd"], reverse=True):
+        models.append({"model": model, **model_totals, "cost_usd": round(model_totals["cost_usd"], 6)})
+    return models
+
+
+def summarize(entries: Iterable[dict]) -> dict:
+    """Totals overall and per model for one session's usage entries.
+
+    ``by_model`` is a list (not keyed by model name) because names such as
+    ``gpt-4.1`` contain dots, which don't make safe MongoDB field names.
+    """
+    totals = _empty_totals()
+    by_model: Dict[str, dict] = {}
+    for entry in entries:
+        cost = cost_usd(entry)
+        _add(totals, entry, cost)
+        _add(by_model.setdefault(entry.get("model", "unknown"), _empty_totals()), entry, cost)
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+    return {"totals": totals, "by_model": _model_list(by_model)}
+
+
+def record_session(thread_id: str, summary: dict, finished_at: datetime):
+    with _ledger_lock:
+        _ledger.append({"thread_id": thread_id, "finished_at": finished_at, **summary})
+
+
+def ledger_sessions(since: datetime) -> List[dict]:
+    with _ledger_lock:
+        return [s for s in _ledger if s["finished_at"] >= since]
+
+
+def parse_window(window: str) -> float:
+    """Seconds in a window like ``15m``, ``24h`` or ``7d``."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    window = window.strip().lower()
+    if not window or window[-1] not in units:
+        raise ValueError(f"Invalid window {window!r}; use e.g. 15m, 24h or 7d")
+    try:
+        amount = float(window[:-1])
+    except ValueError:
+        raise ValueError(f"Invalid window {window!r}; use e.g. 15m, 24h or 7d") from None
+    if amount <= 0:
+        raise ValueError(f"Invalid window {window!r}; must be positive")
+    return amount * units[window[-1]]
+
+
+def aggregate(sessions: Iterable[dict], top: int = 10) -> dict:
+    """Roll session usage summaries up per model, plus the most expensive sessions."""
+    totals = _empty_totals()
+    by_model: Dict[str, dict] = {}
+    per_session = []
+    count = 0
+    for session in sessions:
+        count += 1
+        for model_totals in session.get("by_model") or []:
+            _merge(totals, model_totals)
+            _merge(by_model.setdefault(model_totals.get("model", "unknown"), _empty_totals()), model_totals)
+        session_totals = session.get("totals") or {}
+        per_session.append({
+            "thread_id": session.get("thread_id"),
+            "finished_at": session.get("finished_at"),
+            "cost_usd": session_totals.get("cost_usd", 0.0),
+            "calls": session_totals.get("calls", 0),
+            "prompt_tokens": session_totals.get("prompt_tokens", 0),
+            "completion_tokens": session_totals.get("completion_tokens", 0),
+        })
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+    per_session.sort(key=lambda s: s["cost_usd"], reverse=True)
+    return {
+        "sessions": count,
+        "totals": totals,
+        "avg_cost_per_session_usd": round(totals["cost_usd"] / count, 6) if count else 0.0,
+        "by_model": _model_list(by_model),
+        "most_expensive_sessions": per_session[:top],
+    }
+
+
+def timed_invoke(model, messages, node: str, model_name: str, thread_id: Optional[str], config: Optional[dict] = None):
+    """Invoke ``model`` and park a usage entry for ``thread_id``."""
+    start = time.perf_counter()
+    response = model.invoke(messages, config=config)
+    add_pending(thread_id, usage_entry(node, model_name, response, time.perf_counter() - start))
+    return response
@@ -1,7 +1,8 @@
 from langgraph.types import interrupt, Command
 from typing import Optional, Dict
 from langchain_core.tools import tool
-from langchain_core.messages import AIMessage, HumanMessage
+
+from transcript import confirm_row
 
 @tool
 def ask_user_for_input(
@@ -30,7 +31,8 @@ def ask_user_for_input(
     Open-ended: "How would you describe the pain?"
     
     Returns:
-        Command to update state and continue diagnosis
+        Command to continue diagnosis (the caller resuming the interrupt
+        records the answer as a transcript row)
     """
         
     # Create interrupt payload
@@ -38,42 +40,13 @@ def ask_user_for_input(
     if options and question_type in ("multiple_choice", "select_multiple"):
         interrupt_payload["options"] = options
         
-    # Get user input through interrupt
-    user_input = interrupt(interrupt_payload)
+    # Pause for the patient's answer
+    interrupt(interrupt_payload)
 
-    # If the UI returns multiple selections as a list for select_multiple,
-    # normalize it to a comma-separated string for consistent downstream handling.
-    if question_type == "select_multiple":
-        try:
-            if isinstance(user_input, list):
-                user_input = ", ".join(str(x) for x in user_input)
-        except Exception:
-            pass
-    
-    # Create faux messages representing this interaction
-    # This preserves the conversation flow for better AI understanding
-    if question_type == "open_ended":
-        ai_question = AIMessage(content=f"Can you help me understand: {query}")
-    else:
-        ai_question = AIMessage(content=f"I need to clarify something: {query}")
-        if options:
-            # If options is a dict of label->description
-            if isinstance(options, dict):
-                if question_type == "select_multiple":
-                    ai_question.content += f" You may choose one or more of: {', '.join(f'{op}: {description}' for op, description in options.items())}"
-                else:
-                    ai_question.content += f" Please choose from: {', '.join(f'{op}: {description}' for op, description in options.items())}"
-            else:
-                # Fallback for list[str]
-                if question_type == "select_multiple":
-                    ai_question.content += f" You may choose one or more of: {', '.join(options)}"
-                else:
-                    ai_question.content += f" Please choose from: {', '.join(options)}"
-
-    user_response = HumanMessage(content=user_input)
-    
-    # Return a Command that adds the conversation messages to state
-    return Command(update={"messages": [ai_question, user_response]}, goto="agent")
+    # The answer reaches the state through the resume's transcript row, which is
+    # already there when this node replays; nothing to add here. The urgency
+    # branch re-scores the session alongside the next question.
+    return Command(goto=["agent", "urgency"])
 
 
 @tool
@@ -105,9 +78,8 @@ def signal_diagnosis_complete(
         ack_norm = ""
 
     # Proceed only on explicit yes/y; otherwise go back to agent
+    update = {"transcript": [confirm_row(confirmation_message, ack_norm)]}
     if ack_norm in {"y", "yes"}:
-        ai_msg = AIMessage(content="Thanks. Generating your differential diagnosis now.")
-        return Command(update={"messages": [ai_msg]}, goto="final_output")
+        return Command(update=update, goto="final_output")
     else:
-        ai_msg = AIMessage(content="Okay. I’ll ask a few more clarifying questions.")
-        return Command(update={"messages": [ai_msg]}, goto="agent")
\ No newline at end of file
+        return Command(update=update, goto="agent")
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Compact interview transcript kept in the graph state.
+
+``State["transcript"]`` holds one row per answered question or confirmation:
+a plain list ``[question, answer, kind, option_labels]``. Rows are what the
+checkpoint serde stores, so they pack as bare msgpack arrays with no per-object
+class tag, and each checkpoint appends one row instead of copying parallel
+``questions_asked``/``responses`` lists and a pair of chat messages per answer.
+
+`Turn` is the ``__slots__`` view over a row. The question list, answer list,
+Q/A text and chat history for the model are derived from the rows when a node
+needs them. Kinds, option labels and symptoms repeat across sessions and are
+interned so a worker keeps one copy of each.
+"""
+
+import sys
+from typing import Iterable, List, Optional
+
+CONFIRM = "confirm"
+OPEN_ENDED = "open_ended"
+CHOICE_KINDS = ("multiple_choice", "select_multiple")
+# Sentinel the frontend sends for a skipped question, and what is recorded for it
+SKIP_TOKEN = "__skip__"
+NO_RESPONSE = "No Response"
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def intern_symptoms(symptoms: Iterable[str]) -> List[str]:
+    return [_intern(s) for s in symptoms or []]
+
+
+def _option_labels(options) -> Optional[List[str]]:
+    """Option labels only (descriptions are display text); None for open questions."""
+    if not options:
+        return None
+    labels = options.keys() if isinstance(options, dict) else options
+    return [_intern(str(label)) for label in labels]
+
+
+def question_row(question: Optional[str], answer: str, kind: Optional[str] = None, options=None) -> list:
+    """Row for an answered question; ``options`` may be a label -> description dict or a list."""
+    kind = kind or OPEN_ENDED
+    if isinstance(answer, list):
+        # select_multiple answers may arrive as a list of labels
+        answer = ", ".join(str(x) for x in answer)
+    return [question, answer, _intern(kind), _option_labels(options) if kind in CHOICE_KINDS else None]
+
+
+def recorded_answer(response):
+    """The answer stored for a client response: a skip becomes ``NO_RESPONSE``."""
+    return NO_RESPONSE if isinstance(response, str) and response.strip() == SKIP_TOKEN else response
+
+
+def answer_row(response, question: Optional[str] = None, pending: Optional[dict] = None) -> list:
+    """Row for a client's answer to the pending question payload (query, question_type, options).
+
+    A ``question`` sent with the answer takes precedence for the text. The API's
+    resume and the interview-tree miner both build rows here, so a mined
+    session matches what the live one stored.
+    """
+    pending = pending or {}
+    return question_row(
+        question or pending.get("query"), recorded_answer(response), pending.get("question_type"), pending.get("options"),
+    )
+
+
+def confirm_row(message: str, answer: str) -> list:
+    return [message, answer, CONFIRM, None]
+
+
+class Turn:
+    """One transcript row: an answered question or a confirmation."""
+
+    __slots__ = ("question", "answer", "kind", "options")
+
+    def __init__(self, question: Optional[str], answer: str, kind: str = OPEN_ENDED, options: Optional[List[str]] = None):
+        self.question = question
+        self.answer = answer
+        self.kind = kind
+        self.options = options
+
+    @classmethod
+    def from_row(cls, row) -> "Turn":
+        return cls(*row)
+
+    def to_row(self) -> list:
+        return [self.question, self.answer, self.kind, self.options]
+
+    @property
+    def is_question(self) -> bool:
+        return self.kind != CONFIRM
+
+    @property
+    def confirmed(self) -> bool:
+        return self.kind == CONFIRM and str(self.answer).strip().lower() in {"y", "yes"}
+
+    def __repr__(self):
+        return f"Turn({self.question!r}, {self.answer!r}, {self.kind!r})"
+
+
+def turns(state: dict) -> List[Turn]:
+    return [Turn.from_row(row) for row in state.get("transcript") or ()]
+
+
+def questions_asked(state: dict) -> List[str]:
+    """Questions answered so far (in order)."""
+    return [row[0] for row in state.get("transcript") or () if row[2] != CONFIRM and row[0]]
+
+
+def responses(state: dict) -> List[str]:
+    """Answers to questions so far (confirmations excluded)."""
+    return [row[1] for row in state.get("transcript") or () if row[2] != CONFIRM]
+
+
+def question_count(state: dict) -> int:
+    return sum(1 for row in state.get("transcript") or () if row[2] != CONFIRM and row[0])
+
+
+def qa_pairs(state: dict) -> List[tuple]:
+    """(question, answer) for every answered question with known text."""
+    return [(row[0], row[1]) for row in state.get("transcript") or () if row[2] != CONFIRM and row[0]]
@@ -0,0 +1,124 @@
+"""
+Structured, non-blocking logging for the triage backend.
+
+Records are formatted as one JSON object per line and handed to a background
+writer thread through a queue, so request threads never block on stdout.
+Correlation fields (``thread_id``, ``node``, ``duration_ms`` ...) come either
+from ``extra=`` or from the context set with `bind_thread_id`.
+
+Environment:
+- ``TRIAGE_LOG_LEVEL``: minimum level (default ``INFO``)
+- ``TRIAGE_LOG_DEBUG_SAMPLE_RATE``: fraction of sessions (0-1) whose DEBUG
+  records are kept (default ``1``). Sampling is per ``thread_id`` so a sampled
+  session is logged completely.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+_thread_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("triage_thread_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed via extra= and is emitted as a field
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@contextmanager
+def bind_thread_id(thread_id: Optional[str]):
+    """Attach ``thread_id`` to every record logged inside the block (including graph nodes)."""
+    token = _thread_id_var.set(thread_id)
+    try:
+        yield
+    finally:
+        _thread_id_var.reset(token)
+
+
+def current_thread_id() -> Optional[str]:
+    return _thread_id_var.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _ContextFilter(logging.Filter):
+    """Fill in ``thread_id`` from context and apply per-session DEBUG sampling."""
+
+    def __init__(self, debug_sample_rate: float):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "thread_id", None) is None:
+            record.thread_id = _thread_id_var.get()
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1:
+            key = str(record.thread_id or "").encode()
+            if (zlib.crc32(key) % 10000) >= self.debug_sample_rate * 10000:
+                return False
+        return True
+
+
+class _PreformattedQueueHandler(logging.handlers.QueueHandler):
+    """Queue the record as-is; formatting happens on the writer thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve args now so mutable arguments can't change before the writer runs
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging():
+    """Install the queue handler on the ``triage`` logger; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = getattr(logging, os.getenv("TRIAGE_LOG_LEVEL", "INFO").upper(), logging.INFO)
+    try:
+        sample_rate = float(os.getenv("TRIAGE_LOG_DEBUG_SAMPLE_RATE", "1"))
+    except ValueError:
+        sample_rate = 1.0
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = _PreformattedQueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter(sample_rate))
+
+    logger = logging.getLogger("triage")
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"triage.{name}")
@@ -0,0 +1,112 @@
+"""
+Provisional urgency while the interview is still running.
+
+`estimate` scores a session on the final diagnosis's 1 (Emergency) to
+5 (Routine) scale. It uses red-flag phrases in the presenting symptoms and
+the answers so far. A "yes" to a question counts the question's words, and
+a "no" counts nothing. Then:
+
+- ``ESCALATORS`` (a 9/10 pain score, "getting worse", "sudden"...) raise a
+  moderate or lower level by one;
+- ``RISK_HISTORY`` conditions in the medical records raise it by one more;
+- neither can go past High (2): only a red flag reaches Emergency.
+
+It is a cheap rule pass with no model call. The graph's ``urgency`` node runs
+it next to the agent after every answer, so the admin queue can show risk as
+it emerges. The final diagnosis's ``urgency_level`` still replaces it.
+"""
+
+import re
+from typing import Iterable, List, NamedTuple, Optional
+
+from diagnosis_schema import URGENCY_TEXT
+import transcript
+
+ROUTINE = 5
+
+# Most urgent first; a phrase matches at the start of a word ("breath" matches "breathing")
+RED_FLAGS = {
+    1: (
+        "unconscious", "unresponsive", "not breathing", "can't breathe", "cannot breathe", "choking",
+        "seizure", "anaphyla", "throat swelling", "severe bleeding", "won't stop bleeding", "stroke",
+        "overdose", "suicid", "coughing up blood", "vomiting blood",
+    ),
+    2: (
+        "chest pain", "chest pressure", "chest tight", "shortness of breath", "short of breath",
+        "difficulty breathing", "trouble breathing", "confus", "slurred", "face droop", "one side",
+        "fainted", "fainting", "passed out", "blood in", "black stool", "worst headache",
+        "stiff neck", "severe pain", "head injury", "pregnan", "allergic reaction",
+    ),
+    3: (
+        "fever", "vomit", "dehydrat", "dizz", "abdominal pain", "stomach pain", "wheez", "palpitation",
+        "fracture", "broken", "burn", "cut", "swelling", "blurred vision", "infection",
+    ),
+    4: (
+        "pain", "ache", "nausea", "cough", "rash", "sore throat", "diarrh", "earache", "sprain",
+        "itch", "cold", "congest", "tired", "fatigue",
+    ),
+}
+ESCALATORS = (
+    r"\b(?:[89]|10)\s*(?:/|out of)\s*10\b", r"\bgetting worse\b", r"\bworse\b", r"\bsudden", r"\bsevere\b",
+    r"\bworst\b", r"\bunbearable\b", r"\bcan'?t (?:walk|stand|move)\b",
+)
+RISK_HISTORY = (
+    "heart", "cardiac", "coronary", "diabet", "copd", "asthma", "kidney", "cancer", "chemo",
+    "immuno", "transplant", "anticoagul", "warfarin", "pregnan", "stroke",
+)
+AFFIRMATIVE = {"yes", "y", "yeah", "yep", "true", "correct", "i do", "i have"}
+NEGATIVE = {"no", "n", "nope", "none", "no response", "not really", "false"}
+
+
+def _phrases(words: Iterable[str]):
+    return re.compile("|".join(r"\b" + re.escape(w) for w in words))
+
+
+_RED_FLAG_PATTERNS = {level: _phrases(words) for level, words in RED_FLAGS.items()}
+_ESCALATOR_PATTERN = re.compile("|".join(ESCALATORS))
+_RISK_HISTORY_PATTERN = _phrases(RISK_HISTORY)
+
+
+class Estimate(NamedTuple):
+    level: int
+    # Phrases that set the level, most significant first (for the queue entry)
+    reasons: List[str]
+
+    @property
+    def text(self) -> str:
+        return URGENCY_TEXT[self.level]
+
+
+def evidence_text(symptoms: Optional[Iterable[str]], turns: Iterable["transcript.Turn"]) -> str:
+    """Lower-cased symptoms and answers; an affirmative answer stands for its question."""
+    parts = [s for s in symptoms or () if isinstance(s, str)]
+    for turn in turns:
+        if turn.kind == transcript.CONFIRM:
+            continue
+        answer = (turn.answer or "").strip().lower().rstrip(".!")
+        if answer in AFFIRMATIVE:
+            parts.append(turn.question or "")
+        elif answer not in NEGATIVE:
+            parts.append(answer)
+    return " \n".join(parts).lower()
+
+
+def estimate(symptoms: Optional[Iterable[str]], turns: Iterable["transcript.Turn"], medical_records: Optional[str] = None) -> Estimate:
+    text = evidence_text(symptoms, turns)
+    level, reasons = ROUTINE, []
+    for candidate, pattern in _RED_FLAG_PATTERNS.items():
+        found = pattern.findall(text)
+        if found:
+            level, reasons = candidate, list(dict.fromkeys(found))
+            break
+    if level > 2:
+        escalators = _ESCALATOR_PATTERN.findall(text)
+        if escalators:
+            level -= 1
+            reasons = list(dict.fromkeys(escalators)) + reasons
+        if level > 2 and level < ROUTINE and medical_records:
+            history = _RISK_HISTORY_PATTERN.findall(medical_records.lower())
+            if history:
+                level -= 1
+                reasons.append(f"history: {history[0]}")
+    return Estimate(level, reasons[:3])